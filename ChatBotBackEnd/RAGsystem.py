@@ -1,52 +1,253 @@
 
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from typing import List, Optional, Tuple
+import logging
 import os
 
+import numpy as np
+
+from mmap_store import MmapVectorStore, is_mmap_store
+from ann_index import configure_search, enable_reconstruction, load_index_config, search_overrides_from_env
+from context_selection import Candidate, ContextSelectionStats, context_selection_settings_from_env, select_context
+from lexical_index import BM25Index, fused_scores, has_lexical_index, reciprocal_rank_fusion
+from model_registry import EMBEDDING_MODEL_NAME
+from observability import record_cache_lookup, span
+from retrieval_cache import LRUCache, SQLiteCacheBackend, normalize_query, vector_store_version
+
+logger = logging.getLogger(__name__)
+
 class RAGSystem:
-    def __init__(self):
-        print("Initializing RAG System...")
+    def __init__(self, vector_store_path: str = "vector_store_db", k: int = 5):
+        logger.info("Initializing RAG System...")
+        self.vector_store_path = vector_store_path
+        self.k = k
         self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
+            model_name=EMBEDDING_MODEL_NAME
+        )
+
+        # Two-level cache: normalized query -> embedding, and query -> top-k chunks.
+        # RAG_CACHE_PATH adds a persistent SQLite backing store.
+        cache_path = os.environ.get("RAG_CACHE_PATH")
+        backend = SQLiteCacheBackend(cache_path) if cache_path else None
+        self.embedding_cache = LRUCache(
+            "query_embeddings",
+            max_entries=int(os.environ.get("RAG_EMBEDDING_CACHE_SIZE", 4096)),
+            backend=backend
+        )
+        self.result_cache = LRUCache(
+            "retrieval_results",
+            max_entries=int(os.environ.get("RAG_RESULT_CACHE_SIZE", 1024)),
+            backend=backend
         )
+        # Hybrid retrieval: BM25 hits are fused with vector hits by reciprocal rank.
+        # RAG_LEXICAL_WEIGHT is the BM25 share of the fusion (0 = vector only).
+        self.lexical_weight = float(os.environ.get("RAG_LEXICAL_WEIGHT", 0.5))
+        self.rrf_k = int(os.environ.get("RAG_RRF_K", 60))
+        self.candidates = int(os.environ.get("RAG_HYBRID_CANDIDATES", max(4 * k, 20)))
+        # Over-fetch, then pick diverse passages by MMR up to a similarity cutoff and
+        # character budget (context_selection.py); None keeps the plain top-k
+        self.context_selection = context_selection_settings_from_env(k)
+        self.context_stats = ContextSelectionStats()
+        self.lexical_index = None
+        self.index_version = None
         self.load_documents()
-        
+
     def load_documents(self):
         """Load documents into the vector store"""
         try:
             # Load existing vector store
-            if os.path.exists("vector_store_db"):
-                print("Loading existing vector store...")
+            if is_mmap_store(self.vector_store_path):
+                # Index is memory-mapped and shared between worker processes;
+                # chunk texts are read from SQLite only for search hits
+                logger.info("Loading memory-mapped vector store...")
+                self.vectorstore = MmapVectorStore(self.vector_store_path, self.embeddings)
+                logger.info("Vector store loaded successfully (memory-mapped: %s)", self.vectorstore.memory_mapped)
+            elif os.path.exists(self.vector_store_path):
+                logger.warning("Loading legacy pickled vector store; run `python mmap_store.py convert` to upgrade it")
                 self.vectorstore = FAISS.load_local(
-                    "vector_store_db", 
+                    self.vector_store_path,
                     self.embeddings,
-                    allow_dangerous_deserialization=True  
+                    allow_dangerous_deserialization=True
                 )
-                print("Vector store loaded successfully")
+                logger.info("Vector store loaded successfully")
             else:
                 raise FileNotFoundError("Vector store not found. Please run document_processor.py first.")
-                
-            # Initialize the retriever
-            self.retriever = self.vectorstore.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 5}  
-            )
+
+            # Apply the search knobs recorded at build time (nprobe / efSearch),
+            # optionally overridden by RAG_NPROBE / RAG_EF_SEARCH
+            index_config = load_index_config(self.vector_store_path)
+            params = dict(index_config["params"])
+            params.update({key: value for key, value in search_overrides_from_env().items() if key in params})
+            configure_search(self.vectorstore.index, index_config["type"], params)
+            self.index_config = {"type": index_config["type"], "params": params}
+            # Search knobs change results, so they are part of the result cache key
+            self._search_signature = ",".join(f"{key}={value}" for key, value in sorted(params.items()))
+            logger.info("Using %s index with %s", index_config["type"], params)
+            if self.context_selection is not None:
+                # MMR compares candidates by their stored vectors
+                enable_reconstruction(self.vectorstore.index, index_config["type"])
+
+            self.lexical_index = None
+            if self.lexical_weight > 0 and has_lexical_index(self.vector_store_path):
+                lexical_index = BM25Index.load(self.vector_store_path)
+                if lexical_index.num_docs == self.vectorstore.index.ntotal:
+                    self.lexical_index = lexical_index
+                    logger.info("Hybrid retrieval enabled: BM25 over %d chunks, weight %s",
+                                lexical_index.num_docs, self.lexical_weight)
+                else:
+                    logger.warning("BM25 index is out of sync with the vector store; using vector search only")
+            if self.lexical_index is not None:
+                self._search_signature += f",lexical={self.lexical_weight},rrf_k={self.rrf_k},candidates={self.candidates}"
+            if self.context_selection is not None:
+                self._search_signature += "," + ",".join(
+                    f"{key}={value}" for key, value in sorted(self.context_selection.items())
+                )
+
+            # Retrieval results are keyed on the store's content hash, so a rebuilt
+            # index never serves stale chunks
+            version = vector_store_version(self.vector_store_path)
+            if self.index_version is not None and version != self.index_version:
+                self.result_cache.clear()
+            self.index_version = version
         except Exception as e:
-            print(f"Error loading documents: {e}")
+            logger.error("Error loading documents: %s", e)
             raise
 
-    def get_relevant_context(self, query: str) -> str:
-        """Get relevant context for a query"""
-        print(f"\nSearching for relevant context for query: {query[:50]}...")
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query, reusing the cached embedding for repeated questions"""
+        # Embeddings depend only on the model, not on the index contents
+        key = f"{EMBEDDING_MODEL_NAME}:{normalize_query(query)}"
+        embedding = self.embedding_cache.get(key)
+        record_cache_lookup("rag_embeddings", embedding is not None)
+        if embedding is None:
+            with span("retrieval.embed"):
+                embedding = self.embeddings.embed_query(normalize_query(query))
+            self.embedding_cache.put(key, embedding)
+        return embedding
+
+    def retrieve(self, query: str) -> List[Document]:
+        """Return the top-k chunks for a query, served from cache when possible"""
+        key = f"{self.index_version}:{self._search_signature}:{self.k}:{normalize_query(query)}"
+        cached = self.result_cache.get(key)
+        record_cache_lookup("rag_results", cached is not None)
+        if cached is not None:
+            return [Document(page_content=doc["page_content"], metadata=doc["metadata"]) for doc in cached]
+
+        if self.context_selection is not None:
+            docs = self.select(query)
+        elif self.lexical_index is None:
+            embedding = self.embed_query(query)
+            with span("retrieval.search"):
+                docs = self.vectorstore.similarity_search_by_vector(embedding, k=self.k)
+        else:
+            docs = self._chunks_at(self.hybrid_positions(query)[:self.k])
+        self.result_cache.put(key, [
+            {"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs
+        ])
+        return docs
+
+    def vector_positions(self, query: str, k: int, embedding: Optional[List[float]] = None) -> List[int]:
+        """Index positions of the k nearest chunks"""
+        if embedding is None:
+            embedding = self.embed_query(query)
+        vector = np.asarray(embedding, dtype="float32").reshape(1, -1)
+        with span("retrieval.search"):
+            _, positions = self.vectorstore.index.search(vector, k)
+        return [int(p) for p in positions[0] if p >= 0]
+
+    def _hybrid_hits(self, query: str, embedding: Optional[List[float]] = None) -> Tuple[List[int], List[int]]:
+        vector_hits = self.vector_positions(query, self.candidates, embedding)
+        with span("retrieval.bm25"):
+            lexical_hits = self.lexical_index.search(query, self.candidates)
+        return vector_hits, lexical_hits
+
+    def hybrid_positions(self, query: str, embedding: Optional[List[float]] = None) -> List[int]:
+        """Vector and BM25 candidates fused by weighted reciprocal rank, best first"""
+        return reciprocal_rank_fusion(
+            self._hybrid_hits(query, embedding),
+            [1 - self.lexical_weight, self.lexical_weight],
+            self.rrf_k
+        )
+
+    def select(self, query: str) -> List[Document]:
+        """Over-fetch candidates (vector or hybrid), then select and merge passages"""
+        limit = self.context_selection["candidates"]
+        embedding = self.embed_query(query)
+        relevance = cutoff_exempt = None
+        if self.lexical_index is None:
+            positions = self.vector_positions(query, limit, embedding)
+        else:
+            vector_hits, lexical_hits = self._hybrid_hits(query, embedding)
+            scores = fused_scores(
+                [vector_hits, lexical_hits], [1 - self.lexical_weight, self.lexical_weight], self.rrf_k
+            )
+            positions = sorted(scores, key=scores.get, reverse=True)[:limit]
+            if positions:
+                # Rank by the fused score, and keep exact-term BM25 hits that
+                # cosine similarity alone would cut off
+                relevance = np.asarray([scores[p] for p in positions], dtype="float32") / scores[positions[0]]
+                lexical = set(lexical_hits)
+                cutoff_exempt = np.asarray([p in lexical for p in positions], dtype=bool)
+        docs = self._chunks_at(positions)
+        with span("retrieval.select"):
+            passages = select_context(
+                np.asarray(embedding, dtype="float32"),
+                [Candidate(position, doc.page_content, doc.metadata) for position, doc in zip(positions, docs)],
+                self._vectors_at(positions, docs),
+                self.k,
+                self.context_selection,
+                self.context_stats,
+                relevance=relevance,
+                cutoff_exempt=cutoff_exempt
+            )
+        return [Document(page_content=passage.text, metadata=passage.metadata) for passage in passages]
+
+    def _vectors_at(self, positions: List[int], docs: List[Document]) -> np.ndarray:
+        try:
+            return self.vectorstore.index.reconstruct_batch(np.asarray(positions, dtype="int64"))
+        except RuntimeError:
+            # Index types that can't return stored vectors: embed the chunk texts instead
+            return np.asarray(self.embeddings.embed_documents([doc.page_content for doc in docs]), dtype="float32")
+
+    def _chunks_at(self, positions: List[int]) -> List[Document]:
+        if isinstance(self.vectorstore, MmapVectorStore):
+            return self.vectorstore.get_chunks(positions)
+        return [
+            self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[p]) for p in positions
+        ]
+
+    def get_relevant_chunks(self, query: str) -> List[str]:
+        """Get the texts of the relevant chunks for a query, most relevant first"""
+        logger.debug("Searching for relevant context for query: %s...", query[:50])
         try:
             # Get relevant documents
-            docs = self.retriever.get_relevant_documents(query)
-            
-            # Combine document contents
-            context = "\n\n".join(doc.page_content for doc in docs)
-            
-            print(f"Found {len(docs)} relevant documents")
-            return context
+            with span("retrieval"):
+                docs = self.retrieve(query)
+            logger.debug("Found %d relevant documents", len(docs))
+            return [doc.page_content for doc in docs]
         except Exception as e:
-            print(f"Error retrieving context: {e}")
-            return ""
+            logger.error("Error retrieving context: %s", e)
+            return []
+
+    def get_relevant_context(self, query: str) -> str:
+        """Get relevant context for a query"""
+        # Combine document contents
+        return "\n\n".join(self.get_relevant_chunks(query))
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters for both cache levels"""
+        return {
+            "index_version": self.index_version,
+            "index": self.index_config,
+            "hybrid": {
+                "enabled": self.lexical_index is not None,
+                "lexical_weight": self.lexical_weight,
+                "rrf_k": self.rrf_k,
+                "candidates": self.candidates
+            },
+            "context_selection": self.context_selection,
+            "embeddings": self.embedding_cache.stats(),
+            "results": self.result_cache.stats()
+        }
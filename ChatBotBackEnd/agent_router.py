@@ -1,31 +1,120 @@
-from typing import List, Optional, Dict
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, AsyncIterator, Iterator, List, Optional, Dict, Tuple, Union
 from langchain_core.messages import BaseMessage
-from text_agent import TextGenerationService
-from image_agent import PropertyIssueDetectionAgent
-from RAGsystem import RAGSystem
+from fanout import FanoutStats, run_stage_async, stage_timings, submit_stage, wait_stage
+from prompt_builder import ConversationMemory
+from observability import ROUTED_MESSAGES, record_cache_lookup, span
+from worker_pools import BoundedExecutor, PoolSaturatedError
+
+if TYPE_CHECKING:
+    # Only for annotations: importing these pulls in torch, transformers and FAISS
+    from image_agent import PropertyIssueDetectionAgent
+    from RAGsystem import RAGSystem
+    from semantic_cache import SemanticAnswerCache
+    from text_agent import TextGenerationService
+
+logger = logging.getLogger(__name__)
+
+IMAGE_UNAVAILABLE_CONTEXT = "Image Analysis:\nThe photo could not be analysed in time; answer from the text alone."
 
 class AgentRouter:
     def __init__(
         self, 
-        text_generation_service: TextGenerationService, 
-        image_agent: PropertyIssueDetectionAgent,
-        rag_system: RAGSystem
+        text_generation_service: "TextGenerationService",
+        image_agent: "PropertyIssueDetectionAgent",
+        rag_system: "RAGSystem",
+        semantic_cache: Optional["SemanticAnswerCache"] = None,
+        image_timeout_seconds: float = 30.0,
+        retrieval_timeout_seconds: float = 5.0,
+        caption_reretrieval: bool = False,
+        fanout_workers: int = 8
     ):
         self.text_generation_service = text_generation_service
         self.image_agent = image_agent
         self.rag_system = rag_system
+        self.semantic_cache = semantic_cache
+        # Image requests run BLIP and RAG retrieval side by side (see fanout.py)
+        self.image_timeout_seconds = image_timeout_seconds
+        self.retrieval_timeout_seconds = retrieval_timeout_seconds
+        self.caption_reretrieval = caption_reretrieval
+        self._fanout_executor = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix="router-fanout")
+        self.fanout_stats = FanoutStats()
 
-    def _handle_image_request(
-        self, 
-        message: str, 
-        image_data: str,
-        chat_history: List[BaseMessage]
-    ) -> Dict[str, str]:
-        """Handle image-based requests"""
-        # Get image analysis
-        image_analysis = self.image_agent.analyze_image(image_data, message)
-        
-        # Create context from image analysis
+    def _is_first_turn(self, chat_history: List[BaseMessage], user_turns: Optional[int] = None) -> bool:
+        # Follow-ups depend on earlier turns, so only opening questions are cacheable.
+        # The history may have been trimmed, so prefer the session's own count
+        # of user messages when the caller has one.
+        if user_turns is not None:
+            return user_turns == 1
+        return sum(1 for msg in chat_history if msg.type == "human") == 1
+
+    def _lookup_cached_answer(self, message: str, first_turn: bool) -> Optional[Dict[str, str]]:
+        """Return a cached answer for a near-duplicate opening question, if any"""
+        if self.semantic_cache is None or not first_turn:
+            return None
+        hit = self.semantic_cache.lookup(message)
+        record_cache_lookup("semantic_answers", hit is not None)
+        if hit is None:
+            return None
+        logger.info("Semantic cache hit (similarity %.3f)", hit["similarity"])
+        return {
+            "response": hit["answer"],
+            "context": hit["context"]
+        }
+
+    def _store_answer(
+        self,
+        message: str,
+        first_turn: bool,
+        response: str,
+        context: str,
+        started: float
+    ) -> None:
+        if self.semantic_cache is None or not first_turn:
+            return
+        self.semantic_cache.store(message, response, context, (time.perf_counter() - started) * 1000)
+
+    def _caching_stream(
+        self,
+        stream: Iterator[str],
+        message: str,
+        first_turn: bool,
+        context: str,
+        started: float
+    ) -> Iterator[str]:
+        """Pass chunks through and cache the full answer once the stream completes"""
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        self._store_answer(message, first_turn, "".join(chunks), context, started)
+
+    def _counted_stream(self, stream: Iterator[str], path: str) -> Iterator[str]:
+        """Pass chunks through and record the message's outcome once the stream ends"""
+        try:
+            yield from stream
+        except GeneratorExit:
+            # The client went away mid-answer
+            ROUTED_MESSAGES.inc(path=path, outcome="cancelled")
+            raise
+        except Exception as e:
+            self._record_failure(path, e)
+            raise
+        ROUTED_MESSAGES.inc(path=path, outcome="ok")
+
+    def _record_failure(self, path: str, error: Exception) -> None:
+        if isinstance(error, PoolSaturatedError):
+            # Load shedding, not a failure; the server answers 503
+            ROUTED_MESSAGES.inc(path=path, outcome="rejected")
+            return
+        ROUTED_MESSAGES.inc(path=path, outcome="error")
+        logger.error("Error in agent router: %s", error)
+
+    def _format_image_context(self, image_analysis: dict) -> str:
+        """Format an image analysis as LLM context"""
         image_context = f"Image Analysis:\n{image_analysis['description']}"
         if image_analysis['detected_issues']:
             issues_text = "\nDetected Issues:\n" + "\n".join(
@@ -33,34 +122,152 @@ class AgentRouter:
                  for issue in image_analysis['detected_issues']]
             )
             image_context += issues_text
+        return image_context
+
+    def _reretrieval_query(self, message: str, image_analysis: dict) -> str:
+        """The question plus what BLIP saw, so retrieval can match the photo's subject"""
+        return f"{message}\n{image_analysis['description']}"
+
+    def _merge_image_stages(self, stages: Dict[str, dict]) -> List[str]:
+        """Image analysis first, then caption-aware chunks, then chunks for the bare question"""
+        image = stages["image"]
+        if image["status"] == "ok":
+            chunks = [self._format_image_context(image["value"])]
+        else:
+            chunks = [IMAGE_UNAVAILABLE_CONTEXT]
+        seen = set(chunks)
+        for name in ("reretrieval", "retrieval"):
+            stage = stages.get(name)
+            if stage is None or stage["status"] != "ok":
+                continue
+            for chunk in stage["value"]:
+                if chunk not in seen:
+                    seen.add(chunk)
+                    chunks.append(chunk)
+        return chunks
 
-        # Generate response using image analysis as context
+    def _finish_fanout(self, stages: Dict[str, dict], started: float) -> Tuple[List[str], dict]:
+        timings = stage_timings(stages, (time.perf_counter() - started) * 1000)
+        self.fanout_stats.record(timings)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Image request stages: %s; wall %.0fms, overlap saved %.0fms",
+                ", ".join(f"{name} {stage['status']}" + (f" {stage['ms']:.0f}ms" if stage["ms"] is not None else "")
+                          for name, stage in timings["stages"].items()),
+                timings["wall_ms"], timings["overlap_saved_ms"]
+            )
+        return self._merge_image_stages(stages), timings
+
+    def _gather_image_context(self, message: str, image_data: Union[str, bytes]) -> Tuple[List[str], dict]:
+        """Analyse the image and retrieve documents for the question concurrently.
+
+        Each stage has its own deadline measured from the start of the request.
+        A late image analysis is replaced by a note and late retrieval is
+        dropped; errors from the image analysis itself still propagate.
+        """
+        started = time.perf_counter()
+        image_future = submit_stage(self._fanout_executor, self.image_agent.analyze_image, image_data, message)
+        retrieval_future = submit_stage(self._fanout_executor, self.rag_system.get_relevant_chunks, message)
+        stages = {
+            "image": wait_stage(image_future, started + self.image_timeout_seconds, critical=True),
+            "retrieval": wait_stage(retrieval_future, started + self.retrieval_timeout_seconds),
+        }
+
+        if self.caption_reretrieval and stages["image"]["status"] == "ok":
+            reretrieval_started = time.perf_counter()
+            reretrieval_future = submit_stage(
+                self._fanout_executor,
+                self.rag_system.get_relevant_chunks,
+                self._reretrieval_query(message, stages["image"]["value"])
+            )
+            stages["reretrieval"] = wait_stage(
+                reretrieval_future, reretrieval_started + self.retrieval_timeout_seconds
+            )
+        return self._finish_fanout(stages, started)
+
+    async def _gather_image_context_async(
+        self,
+        message: str,
+        image_data: Union[str, bytes],
+        pools: Dict[str, BoundedExecutor]
+    ) -> Tuple[List[str], dict]:
+        """Async variant of _gather_image_context on the bounded pools.
+
+        A saturated image pool still raises PoolSaturatedError (503); a
+        saturated retrieval pool only drops the retrieved documents.
+        """
+        started = time.perf_counter()
+        image, retrieval = await asyncio.gather(
+            run_stage_async(
+                pools["image"].run(self.image_agent.analyze_image, image_data, message),
+                self.image_timeout_seconds,
+                critical=True
+            ),
+            run_stage_async(
+                pools["retrieval"].run(self.rag_system.get_relevant_chunks, message),
+                self.retrieval_timeout_seconds
+            )
+        )
+        stages = {"image": image, "retrieval": retrieval}
+
+        if self.caption_reretrieval and image["status"] == "ok":
+            stages["reretrieval"] = await run_stage_async(
+                pools["retrieval"].run(self.rag_system.get_relevant_chunks, self._reretrieval_query(message, image["value"])),
+                self.retrieval_timeout_seconds
+            )
+        return self._finish_fanout(stages, started)
+
+    def _handle_image_request(
+        self, 
+        message: str, 
+        image_data: Union[str, bytes],
+        chat_history: List[BaseMessage],
+        memory: Optional[ConversationMemory] = None
+    ) -> Dict[str, str]:
+        """Handle image-based requests"""
+        chunks, _timings = self._gather_image_context(message, image_data)
+        context = "\n\n".join(chunks)
+
+        # Generate response using image analysis and retrieved documents as context
         response = self.text_generation_service.generate_response(
             user_message=message,
             chat_history=chat_history,
-            context=image_context
+            context=chunks,
+            memory=memory
         )
 
         return {
             "response": response,
-            "context": image_context
+            "context": context
         }
 
     def _handle_text_request(
         self, 
         message: str, 
-        chat_history: List[BaseMessage]
+        chat_history: List[BaseMessage],
+        memory: Optional[ConversationMemory] = None,
+        user_turns: Optional[int] = None
     ) -> Dict[str, str]:
         """Handle text-based requests"""
-        # Get relevant context from RAG system
-        context = self.rag_system.get_relevant_context(message)
+        first_turn = self._is_first_turn(chat_history, user_turns)
+        cached = self._lookup_cached_answer(message, first_turn)
+        if cached is not None:
+            return cached
+
+        started = time.perf_counter()
+        # Get relevant context from RAG system; chunks stay separate so the
+        # prompt builder can drop the least relevant ones to fit its budget
+        chunks = self.rag_system.get_relevant_chunks(message)
+        context = "\n\n".join(chunks)
         
         # Generate response using retrieved context
         response = self.text_generation_service.generate_response(
             user_message=message,
             chat_history=chat_history,
-            context=context
+            context=chunks,
+            memory=memory
         )
+        self._store_answer(message, first_turn, response, context, started)
 
         return {
             "response": response,
@@ -71,23 +278,227 @@ class AgentRouter:
         self, 
         message: str, 
         chat_history: List[BaseMessage], 
-        image_data: Optional[str] = None
+        image_data: Optional[Union[str, bytes]] = None,
+        memory: Optional[ConversationMemory] = None,
+        user_turns: Optional[int] = None
     ) -> Dict[str, str]:
-        """Route the message to appropriate agent and return response"""
+        """Route the message to appropriate agent and return response.
+
+        ``user_turns`` is the number of user messages in the session so far,
+        including this one; it decides whether the semantic cache applies.
+        """
+        path = "image" if image_data else "text"
         try:
             # Route based on presence of image
+            with span(f"route.{path}"):
+                if image_data:
+                    result = self._handle_image_request(message, image_data, chat_history, memory)
+                else:
+                    result = self._handle_text_request(message, chat_history, memory, user_turns)
+            ROUTED_MESSAGES.inc(path=path, outcome="ok")
+
+            return result
+
+        except Exception as e:
+            self._record_failure(path, e)
+            raise
+
+    def route_message_stream(
+        self, 
+        message: str, 
+        chat_history: List[BaseMessage], 
+        image_data: Optional[Union[str, bytes]] = None,
+        memory: Optional[ConversationMemory] = None,
+        user_turns: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Gather context for the message and return a generator of response chunks.
+
+        Context retrieval runs eagerly so routing errors surface before streaming starts;
+        the message's outcome is recorded once the stream has been consumed.
+        """
+        path = "image" if image_data else "text"
+        try:
             if image_data:
-                result = self._handle_image_request(message, image_data, chat_history)
+                chunks, _timings = self._gather_image_context(message, image_data)
             else:
-                result = self._handle_text_request(message, chat_history)
+                first_turn = self._is_first_turn(chat_history, user_turns)
+                cached = self._lookup_cached_answer(message, first_turn)
+                if cached is not None:
+                    stream = self._counted_stream(iter([cached["response"]]), path)
+                    return {"stream": stream, "context": cached["context"]}
+                started = time.perf_counter()
+                chunks = self.rag_system.get_relevant_chunks(message)
+            context = "\n\n".join(chunks)
 
+            stream = self.text_generation_service.generate_response_stream(
+                user_message=message,
+                chat_history=chat_history,
+                context=chunks,
+                memory=memory
+            )
+            if not image_data:
+                stream = self._caching_stream(stream, message, first_turn, context, started)
+
+            return {
+                "stream": self._counted_stream(stream, path),
+                "context": context
+            }
+
+        except Exception as e:
+            self._record_failure(path, e)
+            raise
+
+    async def _get_context_async(
+        self,
+        message: str,
+        pools: Dict[str, BoundedExecutor],
+        image_data: Optional[Union[str, bytes]] = None
+    ) -> List[str]:
+        """Gather context chunks on the bounded pools so BLIP and FAISS never block the event loop"""
+        if image_data:
+            chunks, _timings = await self._gather_image_context_async(message, image_data, pools)
+            return chunks
+        return await pools["retrieval"].run(self.rag_system.get_relevant_chunks, message)
+
+    async def route_message_async(
+        self,
+        message: str,
+        chat_history: List[BaseMessage],
+        pools: Dict[str, BoundedExecutor],
+        image_data: Optional[Union[str, bytes]] = None,
+        memory: Optional[ConversationMemory] = None,
+        user_turns: Optional[int] = None
+    ) -> Dict[str, str]:
+        """Async variant of route_message for the aiohttp server"""
+        path = "image" if image_data else "text"
+        try:
+            with span(f"route.{path}"):
+                result = await self._route_async(message, chat_history, pools, image_data, memory, user_turns)
+            ROUTED_MESSAGES.inc(path=path, outcome="ok")
             return result
 
         except Exception as e:
-            print(f"Error in agent router: {str(e)}")
+            self._record_failure(path, e)
             raise
 
+    async def _route_async(
+        self,
+        message: str,
+        chat_history: List[BaseMessage],
+        pools: Dict[str, BoundedExecutor],
+        image_data: Optional[Union[str, bytes]],
+        memory: Optional[ConversationMemory],
+        user_turns: Optional[int] = None
+    ) -> Dict[str, str]:
+        first_turn = self._is_first_turn(chat_history, user_turns)
+        if not image_data and self.semantic_cache is not None:
+            cached = await pools["retrieval"].run(self._lookup_cached_answer, message, first_turn)
+            if cached is not None:
+                return cached
 
+        started = time.perf_counter()
+        chunks = await self._get_context_async(message, pools, image_data)
+        context = "\n\n".join(chunks)
 
+        response = await self.text_generation_service.generate_response_async(
+            user_message=message,
+            chat_history=chat_history,
+            context=chunks,
+            memory=memory
+        )
+        if not image_data and self.semantic_cache is not None:
+            await self._store_answer_async(message, first_turn, response, context, started, pools)
+
+        return {
+            "response": response,
+            "context": context
+        }
+
+    async def route_message_stream_async(
+        self,
+        message: str,
+        chat_history: List[BaseMessage],
+        pools: Dict[str, BoundedExecutor],
+        image_data: Optional[Union[str, bytes]] = None,
+        memory: Optional[ConversationMemory] = None,
+        user_turns: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Async variant of route_message_stream"""
+        path = "image" if image_data else "text"
+        try:
+            first_turn = self._is_first_turn(chat_history, user_turns)
+            if not image_data and self.semantic_cache is not None:
+                cached = await pools["retrieval"].run(self._lookup_cached_answer, message, first_turn)
+                if cached is not None:
+                    stream = self._counted_stream_async(self._single_chunk_async(cached["response"]), path)
+                    return {"stream": stream, "context": cached["context"]}
+
+            started = time.perf_counter()
+            chunks = await self._get_context_async(message, pools, image_data)
+            context = "\n\n".join(chunks)
+
+            stream = self.text_generation_service.generate_response_stream_async(
+                user_message=message,
+                chat_history=chat_history,
+                context=chunks,
+                memory=memory
+            )
+            if not image_data and self.semantic_cache is not None:
+                stream = self._caching_stream_async(stream, message, first_turn, context, started, pools)
 
+            return {
+                "stream": self._counted_stream_async(stream, path),
+                "context": context
+            }
 
+        except Exception as e:
+            self._record_failure(path, e)
+            raise
+
+    async def _single_chunk_async(self, text: str) -> AsyncIterator[str]:
+        yield text
+
+    async def _counted_stream_async(self, stream: AsyncIterator[str], path: str) -> AsyncIterator[str]:
+        """Async variant of _counted_stream"""
+        try:
+            async for chunk in stream:
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            ROUTED_MESSAGES.inc(path=path, outcome="cancelled")
+            raise
+        except Exception as e:
+            self._record_failure(path, e)
+            raise
+        ROUTED_MESSAGES.inc(path=path, outcome="ok")
+
+    async def _caching_stream_async(
+        self,
+        stream: AsyncIterator[str],
+        message: str,
+        first_turn: bool,
+        context: str,
+        started: float,
+        pools: Dict[str, BoundedExecutor]
+    ) -> AsyncIterator[str]:
+        """Async variant of _caching_stream"""
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        await self._store_answer_async(message, first_turn, "".join(chunks), context, started, pools)
+
+    async def _store_answer_async(
+        self,
+        message: str,
+        first_turn: bool,
+        response: str,
+        context: str,
+        started: float,
+        pools: Dict[str, BoundedExecutor]
+    ) -> None:
+        # Embedding the question runs on the retrieval pool; skip caching rather
+        # than fail a request that already has its answer
+        try:
+            await pools["retrieval"].run(self._store_answer, message, first_turn, response, context, started)
+        except PoolSaturatedError:
+            pass
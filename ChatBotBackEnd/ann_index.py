@@ -0,0 +1,126 @@
+import json
+import math
+import os
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+
+INDEX_CONFIG_NAME = "index_config.json"
+SOURCE_VECTORS_NAME = "vectors.npy"
+
+# Build-time parameters and search-time knobs for each supported index type
+DEFAULT_PARAMS: Dict[str, dict] = {
+    "flat": {},
+    "ivf_flat": {"nlist": 100, "nprobe": 8},
+    "hnsw": {"M": 32, "efConstruction": 200, "efSearch": 64},
+    "ivf_pq": {"nlist": 100, "m": 16, "nbits": 8, "nprobe": 16},
+}
+MIN_TRAINING_VECTORS = 39
+
+
+def resolve_params(kind: str, params: Optional[dict] = None) -> dict:
+    """Merge user parameters over the defaults for an index type"""
+    if kind not in DEFAULT_PARAMS:
+        raise ValueError(f"Unknown index type '{kind}', expected one of {sorted(DEFAULT_PARAMS)}")
+    unknown = set(params or {}) - set(DEFAULT_PARAMS[kind])
+    if unknown:
+        raise ValueError(f"Unknown parameters for {kind}: {sorted(unknown)}")
+    return {**DEFAULT_PARAMS[kind], **(params or {})}
+
+
+def effective_params(kind: str, n: int, params: Optional[dict] = None) -> dict:
+    """The parameters build_index uses for n vectors.
+
+    nlist and nbits are clamped to what the number of vectors can train, so
+    small corpora still produce a usable index.
+    """
+    params = resolve_params(kind, params)
+    if kind in ("ivf_flat", "ivf_pq"):
+        # FAISS wants roughly 39 training points per centroid
+        params["nlist"] = max(1, min(params["nlist"], n // 39))
+        if kind == "ivf_pq":
+            params["nbits"] = max(1, min(params["nbits"], int(math.log2(max(2, n // 39)))))
+    return params
+
+
+def build_index(kind: str, vectors: np.ndarray, params: Optional[dict] = None) -> faiss.Index:
+    """Build (and train, where needed) an L2 index of the given type over vectors,
+    with nlist and nbits clamped by effective_params"""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, dim = vectors.shape
+    params = effective_params(kind, n, params)
+    if kind in ("ivf_flat", "ivf_pq") and n < MIN_TRAINING_VECTORS:
+        raise ValueError(f"{kind} needs at least {MIN_TRAINING_VECTORS} vectors to train, got {n}")
+
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+    else:
+        nlist = params["nlist"]
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            if dim % params["m"]:
+                raise ValueError(f"ivf_pq needs m to divide the dimension ({dim}), got m={params['m']}")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, params["m"], params["nbits"])
+        index.train(vectors)
+
+    if n:
+        index.add(vectors)
+    configure_search(index, kind, params)
+    return index
+
+
+def configure_search(index: faiss.Index, kind: str, params: Optional[dict] = None) -> None:
+    """Apply search-time knobs (nprobe for IVF, efSearch for HNSW) to a loaded index"""
+    params = resolve_params(kind, params)
+    if kind in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+    elif kind == "hnsw":
+        index.hnsw.efSearch = params["efSearch"]
+
+
+def enable_reconstruction(index: faiss.Index, kind: str) -> None:
+    """Let IVF indexes return stored vectors by position (flat and HNSW already can)"""
+    if kind in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).make_direct_map()
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """Serialized size of the index, a close proxy for its resident memory"""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def load_index_config(vector_store_path: str) -> dict:
+    """Index type and parameters recorded with a store; stores without one are flat.
+
+    ``params`` are those the index was built with; ``requested``, when
+    present, are the ones asked for before clamping to the corpus size.
+    """
+    config_path = os.path.join(vector_store_path, INDEX_CONFIG_NAME)
+    if not os.path.exists(config_path):
+        return {"type": "flat", "params": {}}
+    with open(config_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_index_config(vector_store_path: str, kind: str, params: dict, requested: Optional[dict] = None) -> None:
+    config = {"type": kind, "params": resolve_params(kind, params)}
+    if requested is not None and resolve_params(kind, requested) != config["params"]:
+        config["requested"] = resolve_params(kind, requested)
+    with open(os.path.join(vector_store_path, INDEX_CONFIG_NAME), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+
+def search_overrides_from_env() -> dict:
+    """Search-time knobs overridden at serving time via RAG_NPROBE / RAG_EF_SEARCH"""
+    overrides = {}
+    if os.environ.get("RAG_NPROBE"):
+        overrides["nprobe"] = int(os.environ["RAG_NPROBE"])
+    if os.environ.get("RAG_EF_SEARCH"):
+        overrides["efSearch"] = int(os.environ["RAG_EF_SEARCH"])
+    return overrides
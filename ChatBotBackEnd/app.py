@@ -1,45 +1,114 @@
 
+import asyncio
+import os
+import json
+import logging
+import time
 import uuid
-import traceback
-from typing import Optional
-from flask import Flask, request, jsonify
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS 
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 
-from RAGsystem import RAGSystem
-from text_agent import TextGenerationService
-from image_agent import PropertyIssueDetectionAgent
 from agent_router import AgentRouter
+from image_upload import (
+    ImageTooLargeError, base64_decoded_size, check_upload_size, max_request_bytes, max_upload_bytes_from_env
+)
+from model_registry import create_registry_from_env
+from observability import (
+    ACTIVE_SESSIONS, HTTP_REQUESTS, HTTP_REQUEST_SECONDS, REQUEST_ID, configure_logging, new_request_id,
+    render_metrics
+)
+from prompt_builder import ConversationMemory, memory_settings_from_env
+from session_backends import SessionBackend
+from session_store import create_session_store_from_env, history_limits_from_env, trim_history
+from worker_pools import BoundedExecutor, PoolSaturatedError
+
+# LOG_LEVEL / LOG_FORMAT; every line carries the request id
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app)  
-chat_sessions = {}  
+CORS(app, expose_headers=['X-Request-ID'])
+# Oversized bodies are refused before they are read
+max_upload_bytes = max_upload_bytes_from_env()
+app.config['MAX_CONTENT_LENGTH'] = max_request_bytes(max_upload_bytes)
+chat_sessions = create_session_store_from_env()
+history_limits = history_limits_from_env()
+memory_settings = memory_settings_from_env()
+# len() rather than stats(), which also queries a shared backend
+ACTIVE_SESSIONS.set_function(lambda: len(chat_sessions))
+
+# Models are loaded once per process and shared by every session
+registry = create_registry_from_env()
 
 class ChatSession:
-    def __init__(self):
-        self.session_id = str(uuid.uuid4())
+    def __init__(
+        self,
+        agent_router: AgentRouter,
+        backend: SessionBackend,
+        session_id: Optional[str] = None,
+        history: Optional[List[Tuple[int, BaseMessage]]] = None
+    ):
+        """Start a new session, or restore ``session_id`` from ``history`` loaded from the backend"""
+        self.session_id = session_id if history is not None else str(uuid.uuid4())
+        # Messages are appended to the backend and applied from it; seq is the
+        # last one this session has applied, appended_seq the last one it wrote
+        self.backend = backend
+        self.seq = 0
+        self.appended_seq = 0
         self.chat_history = []
+        self.trimmed_messages = 0
+        # User messages so far; unlike chat_history, never shortened by trimming
+        self.user_turns = 0
+        # Prompt-side view of the history: recent turns verbatim, older ones
+        # summarized, updated as messages arrive instead of on every turn
+        self.memory = ConversationMemory(**memory_settings)
         
-        # Initialize components
-        rag_system = RAGSystem()
-        text_gen_service = TextGenerationService()
-        image_agent = PropertyIssueDetectionAgent()
-        
-        # Initialize router with all components
-        self.agent_router = AgentRouter(
-            text_generation_service=text_gen_service,
-            image_agent=image_agent,
-            rag_system=rag_system
-        )
+        # Shared router; sessions only own their history
+        self.agent_router = agent_router
         
+        if history is not None:
+            self._apply(history)
+            return
+        self.backend.create(self.session_id)
         # Add initial system message
         self.add_message(SystemMessage(content="I am an AI assistant that helps with property-related queries."))
 
+    def _apply(self, messages: List[Tuple[int, BaseMessage]]):
+        for seq, message in messages:
+            self.chat_history.append(message)
+            self.memory.append(message)
+            self.user_turns += message.type == "human"
+            self.seq = seq
+        self.trimmed_messages += trim_history(self.chat_history, **history_limits)
+
     def add_message(self, message: BaseMessage):
-        """Add a message to the chat history"""
-        self.chat_history.append(message)
+        """Add a message to the chat history, dropping the oldest ones past the cap"""
+        self.appended_seq = self.backend.append(self.session_id, [message])[-1]
+        # Apply from the backend, so messages other workers appended since the
+        # last sync come first, in order; fall back to the message itself if
+        # the session expired in between
+        if not self.sync():
+            self._apply([(self.appended_seq, message)])
+
+    async def add_message_async(self, message: BaseMessage):
+        """add_message off the event loop, since the backend may write to disk"""
+        await asyncio.get_running_loop().run_in_executor(None, self.add_message, message)
+
+    def sync(self) -> bool:
+        """Apply messages other workers appended since this one last saw the session.
 
-    def process_message(self, message_content: str, image_data: Optional[str] = None):
+        Returns False if the session is gone from the backend (reset or expired).
+        """
+        messages = self.backend.load(self.session_id, after_seq=self.seq)
+        if messages is None:
+            return False
+        if messages:
+            self._apply(messages)
+        return True
+
+    def process_message(self, message_content: str, image_data: Optional[Union[str, bytes]] = None):
         """Process incoming message and return response"""
         try:
             # Add user message to history
@@ -49,6 +118,8 @@ class ChatSession:
             result = self.agent_router.route_message(
                 message=message_content,
                 chat_history=self.chat_history,
+                memory=self.memory,
+                user_turns=self.user_turns,
                 image_data=image_data
             )
 
@@ -61,46 +132,395 @@ class ChatSession:
             }
 
         except Exception as e:
-            traceback.print_exc()
             error_message = f"Error processing message: {str(e)}"
-            print(error_message)
+            logger.exception(error_message)
             return {
                 "error": error_message,
                 "session_id": self.session_id
             }
 
+    def process_message_stream(self, message_content: str, image_data: Optional[Union[str, bytes]] = None) -> Iterator[dict]:
+        """Process a message, yielding response chunks as events.
+
+        The AI message is added to the history only once the stream completes.
+        """
+        start = time.perf_counter()
+        try:
+            self.add_message(HumanMessage(content=message_content))
+
+            result = self.agent_router.route_message_stream(
+                message=message_content,
+                chat_history=self.chat_history,
+                memory=self.memory,
+                user_turns=self.user_turns,
+                image_data=image_data
+            )
+
+            chunks = []
+            first_token_ms = None
+            for chunk in result["stream"]:
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - start) * 1000
+                chunks.append(chunk)
+                yield {"event": "token", "data": {"token": chunk}}
+
+            response = "".join(chunks)
+            self.add_message(AIMessage(content=response))
+
+            yield {"event": "done", "data": {
+                "response": response,
+                "session_id": self.session_id,
+                "time_to_first_token_ms": first_token_ms,
+                "total_ms": (time.perf_counter() - start) * 1000
+            }}
+
+        except Exception as e:
+            error_message = f"Error processing message: {str(e)}"
+            logger.exception(error_message)
+            yield {"event": "error", "data": {
+                "error": error_message,
+                "session_id": self.session_id
+            }}
+
+    def _discard_last_user_message(self, message_content: str):
+        """Undo add_message for a request that was rejected before it was processed"""
+        last = self.chat_history[-1] if self.chat_history else None
+        if last is not None and last.type == "human" and last.content == message_content:
+            self.chat_history.pop()
+            self.memory.discard_last()
+            self.user_turns -= 1
+            self.backend.discard(self.session_id, self.appended_seq)
+
+    async def _discard_last_user_message_async(self, message_content: str):
+        await asyncio.get_running_loop().run_in_executor(None, self._discard_last_user_message, message_content)
+
+    async def process_message_async(
+        self,
+        message_content: str,
+        pools: Dict[str, BoundedExecutor],
+        image_data: Optional[Union[str, bytes]] = None
+    ):
+        """Async variant of process_message. PoolSaturatedError propagates so the
+        server can answer 503 instead of recording a failed turn."""
+        try:
+            await self.add_message_async(HumanMessage(content=message_content))
+
+            result = await self.agent_router.route_message_async(
+                message=message_content,
+                chat_history=self.chat_history,
+                memory=self.memory,
+                user_turns=self.user_turns,
+                pools=pools,
+                image_data=image_data
+            )
+
+            await self.add_message_async(AIMessage(content=result["response"]))
+
+            return {
+                "response": result["response"],
+                "session_id": self.session_id
+            }
+
+        except PoolSaturatedError:
+            await self._discard_last_user_message_async(message_content)
+            raise
+        except Exception as e:
+            error_message = f"Error processing message: {str(e)}"
+            logger.exception(error_message)
+            return {
+                "error": error_message,
+                "session_id": self.session_id
+            }
+
+    async def process_message_stream_async(
+        self,
+        message_content: str,
+        pools: Dict[str, BoundedExecutor],
+        image_data: Optional[Union[str, bytes]] = None
+    ) -> AsyncIterator[dict]:
+        """Async variant of process_message_stream. PoolSaturatedError is raised
+        before the first event is yielded."""
+        start = time.perf_counter()
+        try:
+            await self.add_message_async(HumanMessage(content=message_content))
+
+            result = await self.agent_router.route_message_stream_async(
+                message=message_content,
+                chat_history=self.chat_history,
+                memory=self.memory,
+                user_turns=self.user_turns,
+                pools=pools,
+                image_data=image_data
+            )
+
+            chunks = []
+            first_token_ms = None
+            async for chunk in result["stream"]:
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - start) * 1000
+                chunks.append(chunk)
+                yield {"event": "token", "data": {"token": chunk}}
+
+            response = "".join(chunks)
+            await self.add_message_async(AIMessage(content=response))
+
+            yield {"event": "done", "data": {
+                "response": response,
+                "session_id": self.session_id,
+                "time_to_first_token_ms": first_token_ms,
+                "total_ms": (time.perf_counter() - start) * 1000
+            }}
+
+        except PoolSaturatedError:
+            await self._discard_last_user_message_async(message_content)
+            raise
+        except Exception as e:
+            error_message = f"Error processing message: {str(e)}"
+            logger.exception(error_message)
+            yield {"event": "error", "data": {
+                "error": error_message,
+                "session_id": self.session_id
+            }}
+
+def get_or_create_session(session_id: Optional[str]) -> ChatSession:
+    """Return the live session for session_id, or start a new one.
+
+    A cached session first catches up on messages other workers added to a
+    shared backend, and a session this process has no live copy of is
+    restored from the backend.
+    """
+    session = chat_sessions.get(session_id)
+    if session is not None and not session.sync():
+        # Reset or expired on another worker
+        chat_sessions.forget(session_id)
+        session = None
+    backend = chat_sessions.backend
+    if session is None and session_id:
+        history = backend.load(session_id)
+        if history:
+            session = ChatSession(registry.get_agent_router(), backend, session_id=session_id, history=history)
+            chat_sessions.add(session, restored=True)
+    if session is None:
+        session = ChatSession(registry.get_agent_router(), backend)
+        chat_sessions.add(session)
+    return session
+
+def parse_chat_request():
+    """Message, session id and image of a /chat request.
+
+    Accepts a JSON body with a base64 image, or multipart/form-data with
+    ``message`` and ``session_id`` fields and the raw image file as ``image``.
+    """
+    if request.mimetype == 'multipart/form-data':
+        image_data = None
+        upload = request.files.get('image')
+        if upload is not None:
+            size = upload.seek(0, os.SEEK_END)
+            upload.seek(0)
+            check_upload_size(size, max_upload_bytes)
+            image_data = upload.read() or None
+        return request.form.get('message', ''), request.form.get('session_id'), image_data
+
+    data = request.json
+    image_data = data.get('image')
+    if image_data:
+        check_upload_size(base64_decoded_size(image_data), max_upload_bytes)
+    return data.get('message', ''), data.get('session_id'), image_data
+
+def image_too_large_response(e: ImageTooLargeError):
+    return jsonify({'error': str(e), 'max_upload_bytes': max_upload_bytes}), 413
+
+@app.before_request
+def start_request():
+    # Reuse the caller's id so logs can be joined across services
+    g.request_id = request.headers.get('X-Request-ID') or new_request_id()
+    g.request_started = time.perf_counter()
+    REQUEST_ID.set(g.request_id)
+
+@app.after_request
+def finish_request(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    started = g.get('request_started')
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    response.headers['X-Request-ID'] = g.get('request_id', '-')
+    return response
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({'error': 'Request body too large', 'max_upload_bytes': max_upload_bytes}), 413
+
+def format_sse(event: str, data: dict) -> str:
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
-        data = request.json
-        message = data.get('message', '')
-        session_id = data.get('session_id')
-        image_data = data.get('image')
+        message, session_id, image_data = parse_chat_request()
         
         # Get or create session
-        if session_id and session_id in chat_sessions:
-            session = chat_sessions[session_id]
-        else:
-            session = ChatSession()
-            chat_sessions[session.session_id] = session
-            session_id = session.session_id
+        session = get_or_create_session(session_id)
 
         # Process message and get response
         response = session.process_message(message, image_data)
+        if 'error' in response:
+            return jsonify({
+                'error': response['error'],
+                'session_id': session.session_id
+            }), 500
 
         return jsonify({
             'response': response.get('response'),
             'session_id': session.session_id
         })
 
+    except ImageTooLargeError as e:
+        return image_too_large_response(e)
     except Exception as e:
-        print(f"Error in chat endpoint: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error in chat endpoint: %s", e)
         return jsonify({
             'error': str(e)
         }), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same request body as /chat, but the response is streamed as Server-Sent Events"""
+    try:
+        message, session_id, image_data = parse_chat_request()
+        session = get_or_create_session(session_id)
+    except ImageTooLargeError as e:
+        return image_too_large_response(e)
+    except Exception as e:
+        logger.exception("Error in chat stream endpoint: %s", e)
+        return jsonify({
+            'error': str(e)
+        }), 500
+
+    def generate():
+        # Send the session id first so clients can keep it even if generation fails
+        yield format_sse('session', {'session_id': session.session_id})
+        for event in session.process_message_stream(message, image_data):
+            yield format_sse(event['event'], event['data'])
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/reset', methods=['POST'])
+def reset():
+    """Drop a session and its history; the next /chat starts a new one"""
+    data = request.json or {}
+    session_id = data.get('session_id')
+    if not session_id:
+        return jsonify({'error': 'session_id is required'}), 400
+
+    deleted = chat_sessions.delete(session_id)
+    return jsonify({'session_id': session_id, 'deleted': deleted})
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """Explicitly free a session"""
+    if not chat_sessions.delete(session_id):
+        return jsonify({'error': 'Session not found', 'session_id': session_id}), 404
+    return jsonify({'session_id': session_id, 'deleted': True})
+
+@app.route('/sessions/stats', methods=['GET'])
+def session_stats():
+    """Session occupancy and eviction counters"""
+    return jsonify(chat_sessions.stats())
+
+@app.route('/image/batching/stats', methods=['GET'])
+def image_batching_stats():
+    """BLIP micro-batching queue depth, batch-size histogram and wait times"""
+    image_agent = registry.get_if_loaded('image_agent')
+    if image_agent is None:
+        return jsonify({'error': 'Image agent not loaded yet'}), 503
+    return jsonify(image_agent.batching_stats())
+
+@app.route('/image/cache/stats', methods=['GET'])
+def image_cache_stats():
+    """Hit rate and latency saved by the image analysis cache"""
+    image_agent = registry.get_if_loaded('image_agent')
+    if image_agent is None:
+        return jsonify({'error': 'Image agent not loaded yet'}), 503
+    return jsonify(image_agent.cache_stats())
+
+@app.route('/image/upload/stats', methods=['GET'])
+def image_upload_stats():
+    """Upload size, decode time and peak decode memory per image"""
+    image_agent = registry.get_if_loaded('image_agent')
+    if image_agent is None:
+        return jsonify({'error': 'Image agent not loaded yet'}), 503
+    return jsonify(image_agent.upload_stats())
+
+@app.route('/rag/cache/stats', methods=['GET'])
+def rag_cache_stats():
+    """Hit/miss counters of the query-embedding and retrieval-result caches"""
+    rag_system = registry.get_if_loaded('rag_system')
+    if rag_system is None:
+        return jsonify({'error': 'RAG system not loaded yet'}), 503
+    return jsonify(rag_system.cache_stats())
+
+@app.route('/rag/context/stats', methods=['GET'])
+def rag_context_stats():
+    """Context bytes saved by MMR selection and merging, and why candidate chunks were left out"""
+    rag_system = registry.get_if_loaded('rag_system')
+    if rag_system is None:
+        return jsonify({'error': 'RAG system not loaded yet'}), 503
+    return jsonify(rag_system.context_stats.stats())
+
+@app.route('/semantic-cache/stats', methods=['GET'])
+def semantic_cache_stats():
+    """Hit rate and latency saved by the semantic answer cache"""
+    agent_router = registry.get_if_loaded('agent_router')
+    if agent_router is None or agent_router.semantic_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **agent_router.semantic_cache.stats()})
+
+@app.route('/router/stats', methods=['GET'])
+def router_stats():
+    """Per-stage latency and timeouts of image requests, and the time saved by running stages concurrently"""
+    agent_router = registry.get_if_loaded('agent_router')
+    if agent_router is None:
+        return jsonify({'error': 'Agent router not loaded yet'}), 503
+    return jsonify(agent_router.fanout_stats.stats())
+
+@app.route('/llm/stats', methods=['GET'])
+def llm_stats():
+    """LLM client calls, retries, coalesced calls, deadline misses and rate-limit waits"""
+    text_generation_service = registry.get_if_loaded('text_generation_service')
+    if text_generation_service is None:
+        return jsonify({'error': 'Text generation service not loaded yet'}), 503
+    return jsonify(text_generation_service.llm.stats())
+
+@app.route('/prompt/stats', methods=['GET'])
+def prompt_stats():
+    """Prompt token distribution and how often context or history was cut to fit"""
+    text_generation_service = registry.get_if_loaded('text_generation_service')
+    if text_generation_service is None:
+        return jsonify({'error': 'Text generation service not loaded yet'}), 503
+    return jsonify(text_generation_service.prompt_builder.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Request, stage, cache, prompt and session metrics in the Prometheus text format"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once every shared model is loaded, 503 otherwise"""
+    status = registry.status()
+    return jsonify(status), (200 if status['ready'] else 503)
+
 if __name__ == '__main__':
+    # The debug reloader imports this module twice; only warm up in the child
+    # process that actually serves requests.
+    if not registry.lazy and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        registry.warmup_in_background()
     app.run(debug=True)
 
 
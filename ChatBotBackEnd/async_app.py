@@ -0,0 +1,379 @@
+"""Async serving mode for the chat API.
+
+Runs the same endpoints as app.py on aiohttp: Gemini calls are awaited, while
+BLIP captioning and embedding + FAISS retrieval run on bounded thread pools so
+the event loop is never blocked. When too many requests are in flight the
+server answers 429, and when a pool's queue is full it answers 503.
+
+    python async_app.py --port 5000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from aiohttp import web
+
+from app import chat_sessions, format_sse, get_or_create_session, max_upload_bytes, registry
+from image_upload import ImageTooLargeError, base64_decoded_size, check_upload_size, max_request_bytes
+from observability import HTTP_REQUESTS, HTTP_REQUEST_SECONDS, REQUEST_ID, new_request_id, render_metrics
+from worker_pools import PoolSaturatedError, create_pools_from_env
+
+POOLS_KEY = web.AppKey("pools", dict)
+LIMITER_KEY = web.AppKey("limiter", object)
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimiter:
+    """Counts in-flight requests and refuses new ones past ``max_concurrent``"""
+
+    def __init__(self, max_concurrent: int):
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        # Only touched from the event loop thread, so no lock is needed
+        if self.in_flight >= self.max_concurrent:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+
+def _saturated_response(e: PoolSaturatedError) -> web.Response:
+    return web.json_response(
+        {'error': f'Server busy: {e.pool_name} pool is saturated, retry shortly'},
+        status=503,
+        headers={'Retry-After': '1'}
+    )
+
+
+@web.middleware
+async def request_middleware(request: web.Request, handler):
+    """Assign the request id and record request count and duration.
+
+    Each request runs in its own task, so setting the context variable here
+    scopes the id to this request and to the pool tasks it starts.
+    """
+    request_id = request.headers.get('X-Request-ID') or new_request_id()
+    REQUEST_ID.set(request_id)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        response.headers['X-Request-ID'] = request_id
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        route = request.match_info.route.resource
+        endpoint = route.canonical if route is not None else 'unmatched'
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+
+
+@web.middleware
+async def cors_middleware(request: web.Request, handler):
+    """Allow cross-origin requests from the frontend, like flask_cors does for app.py"""
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, DELETE, OPTIONS'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Request-ID'
+    return response
+
+
+@web.middleware
+async def backpressure_middleware(request: web.Request, handler):
+    """Reject /chat requests with 429 once the concurrency limit is reached"""
+    if not request.path.startswith('/chat'):
+        return await handler(request)
+
+    limiter = request.app[LIMITER_KEY]
+    if not limiter.try_acquire():
+        return web.json_response(
+            {'error': 'Too many concurrent requests, retry shortly'},
+            status=429,
+            headers={'Retry-After': '1'}
+        )
+    try:
+        return await handler(request)
+    finally:
+        limiter.release()
+
+
+async def _get_session(session_id):
+    # Session creation may load models on first use (MODEL_LOADING=lazy)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, get_or_create_session, session_id)
+
+
+async def _in_executor(func, *args):
+    # Session backends do blocking I/O (SQLite), which must not stall the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def _read_chat_request(request: web.Request):
+    """Message, session id and image from a JSON body or a multipart upload.
+
+    Multipart images are read in chunks and rejected as soon as they pass the limit.
+    """
+    if request.content_type != 'multipart/form-data':
+        data = await request.json()
+        image_data = data.get('image')
+        if image_data:
+            check_upload_size(base64_decoded_size(image_data), max_upload_bytes)
+        return data.get('message', ''), data.get('session_id'), image_data
+
+    fields = {}
+    image_data = None
+    reader = await request.multipart()
+    async for part in reader:
+        if part.name == 'image':
+            buffer = bytearray()
+            while True:
+                chunk = await part.read_chunk()
+                if not chunk:
+                    break
+                buffer.extend(chunk)
+                check_upload_size(len(buffer), max_upload_bytes)
+            image_data = bytes(buffer) or None
+        else:
+            fields[part.name] = await part.text()
+    return fields.get('message', ''), fields.get('session_id'), image_data
+
+
+def _image_too_large_response(e: ImageTooLargeError) -> web.Response:
+    return web.json_response({'error': str(e), 'max_upload_bytes': max_upload_bytes}, status=413)
+
+
+async def chat(request: web.Request) -> web.Response:
+    try:
+        message, session_id, image_data = await _read_chat_request(request)
+        session = await _get_session(session_id)
+
+        response = await session.process_message_async(
+            message,
+            request.app[POOLS_KEY],
+            image_data
+        )
+        if 'error' in response:
+            return web.json_response({'error': response['error'], 'session_id': session.session_id}, status=500)
+
+        return web.json_response({
+            'response': response.get('response'),
+            'session_id': session.session_id
+        })
+
+    except PoolSaturatedError as e:
+        return _saturated_response(e)
+    except ImageTooLargeError as e:
+        return _image_too_large_response(e)
+    except Exception as e:
+        logger.exception("Error in chat endpoint: %s", e)
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def chat_stream(request: web.Request) -> web.StreamResponse:
+    try:
+        message, session_id, image_data = await _read_chat_request(request)
+        session = await _get_session(session_id)
+        events = session.process_message_stream_async(
+            message,
+            request.app[POOLS_KEY],
+            image_data
+        )
+        # Pull the first event before committing to a 200 so saturation can still be a 503
+        first_event = await events.__anext__()
+    except PoolSaturatedError as e:
+        return _saturated_response(e)
+    except ImageTooLargeError as e:
+        return _image_too_large_response(e)
+    except Exception as e:
+        logger.exception("Error in chat stream endpoint: %s", e)
+        return web.json_response({'error': str(e)}, status=500)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+    await response.write(format_sse('session', {'session_id': session.session_id}).encode('utf-8'))
+    await response.write(format_sse(first_event['event'], first_event['data']).encode('utf-8'))
+    async for event in events:
+        await response.write(format_sse(event['event'], event['data']).encode('utf-8'))
+    await response.write_eof()
+    return response
+
+
+async def reset(request: web.Request) -> web.Response:
+    # Same answers as the Flask /reset: no body means no session_id
+    try:
+        data = await request.json() if request.can_read_body else {}
+    except ValueError:
+        return web.json_response({'error': 'Request body must be JSON'}, status=400)
+    session_id = data.get('session_id') if isinstance(data, dict) else None
+    if not session_id:
+        return web.json_response({'error': 'session_id is required'}, status=400)
+    return web.json_response({'session_id': session_id, 'deleted': await _in_executor(chat_sessions.delete, session_id)})
+
+
+async def delete_session(request: web.Request) -> web.Response:
+    session_id = request.match_info['session_id']
+    if not await _in_executor(chat_sessions.delete, session_id):
+        return web.json_response({'error': 'Session not found', 'session_id': session_id}, status=404)
+    return web.json_response({'session_id': session_id, 'deleted': True})
+
+
+async def session_stats(request: web.Request) -> web.Response:
+    return web.json_response(await _in_executor(chat_sessions.stats))
+
+
+async def ready(request: web.Request) -> web.Response:
+    status = registry.status()
+    return web.json_response(status, status=200 if status['ready'] else 503)
+
+
+async def image_batching_stats(request: web.Request) -> web.Response:
+    image_agent = registry.get_if_loaded('image_agent')
+    if image_agent is None:
+        return web.json_response({'error': 'Image agent not loaded yet'}, status=503)
+    return web.json_response(image_agent.batching_stats())
+
+
+async def image_cache_stats(request: web.Request) -> web.Response:
+    image_agent = registry.get_if_loaded('image_agent')
+    if image_agent is None:
+        return web.json_response({'error': 'Image agent not loaded yet'}, status=503)
+    return web.json_response(image_agent.cache_stats())
+
+
+async def image_upload_stats(request: web.Request) -> web.Response:
+    image_agent = registry.get_if_loaded('image_agent')
+    if image_agent is None:
+        return web.json_response({'error': 'Image agent not loaded yet'}, status=503)
+    return web.json_response(image_agent.upload_stats())
+
+
+async def rag_cache_stats(request: web.Request) -> web.Response:
+    rag_system = registry.get_if_loaded('rag_system')
+    if rag_system is None:
+        return web.json_response({'error': 'RAG system not loaded yet'}, status=503)
+    return web.json_response(rag_system.cache_stats())
+
+
+async def rag_context_stats(request: web.Request) -> web.Response:
+    rag_system = registry.get_if_loaded('rag_system')
+    if rag_system is None:
+        return web.json_response({'error': 'RAG system not loaded yet'}, status=503)
+    return web.json_response(rag_system.context_stats.stats())
+
+
+async def semantic_cache_stats(request: web.Request) -> web.Response:
+    agent_router = registry.get_if_loaded('agent_router')
+    if agent_router is None or agent_router.semantic_cache is None:
+        return web.json_response({'enabled': False})
+    return web.json_response({'enabled': True, **agent_router.semantic_cache.stats()})
+
+
+async def router_stats(request: web.Request) -> web.Response:
+    agent_router = registry.get_if_loaded('agent_router')
+    if agent_router is None:
+        return web.json_response({'error': 'Agent router not loaded yet'}, status=503)
+    return web.json_response(agent_router.fanout_stats.stats())
+
+
+async def llm_stats(request: web.Request) -> web.Response:
+    text_generation_service = registry.get_if_loaded('text_generation_service')
+    if text_generation_service is None:
+        return web.json_response({'error': 'Text generation service not loaded yet'}, status=503)
+    return web.json_response(text_generation_service.llm.stats())
+
+
+async def prompt_stats(request: web.Request) -> web.Response:
+    text_generation_service = registry.get_if_loaded('text_generation_service')
+    if text_generation_service is None:
+        return web.json_response({'error': 'Text generation service not loaded yet'}, status=503)
+    return web.json_response(text_generation_service.prompt_builder.stats())
+
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        body=render_metrics().encode('utf-8'),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+
+
+async def pool_stats(request: web.Request) -> web.Response:
+    """Concurrency limiter and worker pool occupancy"""
+    limiter = request.app[LIMITER_KEY]
+    return web.json_response({
+        'requests': {
+            'max_concurrent': limiter.max_concurrent,
+            'in_flight': limiter.in_flight,
+            'rejected': limiter.rejected
+        },
+        'pools': {name: pool.stats() for name, pool in request.app[POOLS_KEY].items()}
+    })
+
+
+async def _warmup(app: web.Application):
+    if not registry.lazy:
+        # Load models off the event loop; /ready reports when they are done
+        asyncio.get_running_loop().run_in_executor(None, registry.warmup)
+
+
+async def _shutdown_pools(app: web.Application):
+    for pool in app[POOLS_KEY].values():
+        pool.shutdown(wait=False)
+
+
+def create_app() -> web.Application:
+    app = web.Application(
+        middlewares=[request_middleware, cors_middleware, backpressure_middleware],
+        client_max_size=max_request_bytes(max_upload_bytes)
+    )
+    app[POOLS_KEY] = create_pools_from_env()
+    app[LIMITER_KEY] = ConcurrencyLimiter(int(os.environ.get("ASYNC_MAX_CONCURRENT_REQUESTS", 64)))
+    app.add_routes([
+        web.post('/chat', chat),
+        web.post('/chat/stream', chat_stream),
+        web.post('/reset', reset),
+        web.delete('/sessions/{session_id}', delete_session),
+        web.get('/sessions/stats', session_stats),
+        web.get('/image/batching/stats', image_batching_stats),
+        web.get('/image/cache/stats', image_cache_stats),
+        web.get('/image/upload/stats', image_upload_stats),
+        web.get('/rag/cache/stats', rag_cache_stats),
+        web.get('/rag/context/stats', rag_context_stats),
+        web.get('/semantic-cache/stats', semantic_cache_stats),
+        web.get('/router/stats', router_stats),
+        web.get('/prompt/stats', prompt_stats),
+        web.get('/llm/stats', llm_stats),
+        web.get('/ready', ready),
+        web.get('/pools/stats', pool_stats),
+        web.get('/metrics', metrics),
+    ])
+    app.on_startup.append(_warmup)
+    app.on_cleanup.append(_shutdown_pools)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the chat API in async mode")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
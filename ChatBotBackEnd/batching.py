@@ -0,0 +1,139 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+from observability import summarize
+
+
+class MicroBatchScheduler:
+    """Groups concurrent single-item calls into batched calls.
+
+    Callers ``submit`` one item and get a Future. A background thread takes the
+    first pending item, keeps collecting for up to ``max_wait_ms`` or until
+    ``max_batch_size`` items are pending, then runs ``batch_fn`` once on the
+    whole batch and resolves each caller's Future with its own result.
+
+    The thread starts on the first ``submit``, and again in a forked child,
+    where the parent's thread does not exist.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        name: str = "batch",
+        wait_samples: int = 1000
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._wait_ms = deque(maxlen=wait_samples)
+        self._requests = 0
+        self._failed_batches = 0
+        self._closed = False
+        self._worker = None
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self) -> None:
+        if self._worker_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._worker_pid != os.getpid():
+                if self._worker_pid is not None:
+                    # Forked: anything queued belonged to the parent
+                    self._queue = queue.Queue()
+                self._worker = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+                self._worker.start()
+                self._worker_pid = os.getpid()
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item for the next batch"""
+        if self._closed:
+            raise RuntimeError(f"{self.name} scheduler is shut down")
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def process(self, item: Any, timeout: float = None) -> Any:
+        """Submit one item and block until its result is ready"""
+        return self.submit(item).result(timeout=timeout)
+
+    def _collect_batch(self, first) -> list:
+        batch = [first]
+        deadline = first[2] + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                # Drain whatever is already queued even if the window has passed
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect_batch(first)
+
+            started = time.perf_counter()
+            with self._lock:
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._wait_ms.extend((started - enqueued) * 1000 for _, _, enqueued in batch)
+
+            try:
+                results = self.batch_fn([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                with self._lock:
+                    self._failed_batches += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        """Queue depth, batch-size histogram and per-request wait times"""
+        with self._lock:
+            waits = list(self._wait_ms)
+            histogram = dict(sorted(self._batch_sizes.items()))
+            requests = self._requests
+            failed = self._failed_batches
+
+        batches = sum(histogram.values())
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "requests": requests,
+            "batches": batches,
+            "failed_batches": failed,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "batch_size_histogram": histogram,
+            "wait_ms": summarize(waits),
+        }
+
+    def shutdown(self) -> None:
+        """Stop accepting work and let the worker exit after the current batch"""
+        self._closed = True
+        self._queue.put(None)
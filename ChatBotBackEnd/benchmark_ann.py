@@ -0,0 +1,148 @@
+"""Recall-vs-latency benchmark for the ANN index types in ann_index.py.
+
+Measures build time, recall@k against an exact flat baseline, p50/p99
+single-query latency and index memory, on a synthetic clustered corpus and/or
+the vectors of a built vector store.
+
+    python benchmark_ann.py --corpus synthetic --n 50000
+    python benchmark_ann.py --corpus real --vector-store vector_store_db
+    python benchmark_ann.py --param hnsw:efSearch=128 --param ivf_flat:nprobe=16 --json results.json
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+from ann_index import (
+    DEFAULT_PARAMS, SOURCE_VECTORS_NAME, build_index, effective_params, index_memory_bytes, load_index_config
+)
+
+
+def synthetic_corpus(n: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """Unit-norm vectors drawn around random centroids, roughly like sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((clusters, dim)).astype("float32")
+    vectors = centroids[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def real_corpus(vector_store_path: str) -> np.ndarray:
+    """Exact vectors of a built store: vectors.npy for ANN stores, the flat index otherwise"""
+    source_path = os.path.join(vector_store_path, SOURCE_VECTORS_NAME)
+    if os.path.exists(source_path):
+        return np.load(source_path)
+    if load_index_config(vector_store_path)["type"] != "flat":
+        raise ValueError(f"{vector_store_path} has no {SOURCE_VECTORS_NAME} to benchmark against")
+    index = faiss.read_index(os.path.join(vector_store_path, "index.faiss"))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def make_queries(corpus: np.ndarray, count: int, noise: float = 0.3, seed: int = 1) -> np.ndarray:
+    """Perturbed corpus vectors, so every query has meaningful near neighbours"""
+    rng = np.random.default_rng(seed)
+    queries = corpus[rng.integers(0, len(corpus), count)].copy()
+    queries += noise * rng.standard_normal(queries.shape).astype("float32") / np.sqrt(corpus.shape[1])
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def benchmark_index(kind: str, params: dict, corpus: np.ndarray, queries: np.ndarray,
+                    ground_truth: np.ndarray, k: int) -> dict:
+    started = time.perf_counter()
+    index = build_index(kind, corpus, params)
+    build_seconds = time.perf_counter() - started
+
+    # Single-query searches, as the RAG system issues them
+    latencies = []
+    found = np.empty((len(queries), k), dtype="int64")
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found[i] = ids[0]
+
+    recall = np.mean([
+        len(set(found[i]) & set(ground_truth[i])) / k for i in range(len(queries))
+    ])
+    latencies = np.asarray(latencies)
+    return {
+        "index": kind,
+        # As built: nlist / nbits may be clamped for small corpora
+        "params": effective_params(kind, len(corpus), params),
+        "build_seconds": round(build_seconds, 3),
+        f"recall@{k}": round(float(recall), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+        "memory_mb": round(index_memory_bytes(index) / 1e6, 2),
+    }
+
+
+def run(corpus_name: str, corpus: np.ndarray, kinds: List[str], overrides: Dict[str, dict],
+        query_count: int, k: int) -> List[dict]:
+    print(f"\n{corpus_name}: {corpus.shape[0]} vectors x {corpus.shape[1]} dims, {query_count} queries")
+    queries = make_queries(corpus, query_count)
+    flat = faiss.IndexFlatL2(corpus.shape[1])
+    flat.add(corpus)
+    _, ground_truth = flat.search(queries, k)
+
+    results = []
+    header = f"{'index':<10}{'build s':>10}{'recall@' + str(k):>11}{'p50 ms':>10}{'p99 ms':>10}{'MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for kind in kinds:
+        try:
+            result = benchmark_index(kind, overrides.get(kind, {}), corpus, queries, ground_truth, k)
+        except ValueError as e:
+            print(f"{kind:<10}skipped: {e}")
+            continue
+        result["corpus"] = corpus_name
+        results.append(result)
+        print(f"{kind:<10}{result['build_seconds']:>10.2f}{result[f'recall@{k}']:>11.3f}"
+              f"{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['memory_mb']:>9.1f}")
+    return results
+
+
+def _parse_overrides(pairs: List[str]) -> Dict[str, dict]:
+    overrides: Dict[str, dict] = {}
+    for pair in pairs:
+        kind, _, assignment = pair.partition(":")
+        key, _, value = assignment.partition("=")
+        overrides.setdefault(kind, {})[key] = float(value) if "." in value else int(value)
+    return overrides
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark recall and latency of ANN index types")
+    parser.add_argument("--corpus", choices=["synthetic", "real", "both"], default="synthetic")
+    parser.add_argument("--vector-store", default="vector_store_db")
+    parser.add_argument("--n", type=int, default=20000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=384, help="Synthetic dimension (MiniLM is 384)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--index", action="append", choices=sorted(DEFAULT_PARAMS), default=None,
+                        help="Index types to benchmark (default: all)")
+    parser.add_argument("--param", action="append", default=[], metavar="TYPE:KEY=VALUE",
+                        help="Parameter override, e.g. hnsw:efSearch=128")
+    parser.add_argument("--threads", type=int, default=1, help="FAISS OpenMP threads")
+    parser.add_argument("--json", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    kinds = args.index or list(DEFAULT_PARAMS)
+    overrides = _parse_overrides(args.param)
+
+    results = []
+    if args.corpus in ("synthetic", "both"):
+        results += run("synthetic", synthetic_corpus(args.n, args.dim), kinds, overrides, args.queries, args.k)
+    if args.corpus in ("real", "both"):
+        results += run(args.vector_store, real_corpus(args.vector_store), kinds, overrides, args.queries, args.k)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
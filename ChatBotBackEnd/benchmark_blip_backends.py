@@ -0,0 +1,173 @@
+"""Compare the BLIP backends in blip_backends.py on a fixed image set.
+
+The set is moldup.jpeg (plus any --images) and deterministic variants of it:
+mirrored, cropped, rotated, grayscale, downscaled and recompressed. Each
+backend runs in its own process so peak memory is measured in isolation.
+Reports load time, single-image latency p50/p95, batched throughput, peak RSS,
+and caption agreement with fp32 (exact match rate and mean word overlap).
+
+    python benchmark_blip_backends.py --backend fp32 --backend int8 --threads 4
+    python benchmark_blip_backends.py --images photos/ --batch-size 8 --json blip.json
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from typing import List
+
+from PIL import Image, ImageOps
+
+from blip_backends import BACKENDS, caption_with, create_blip_backend
+from image_agent import CAPTION_MODEL_NAME
+from observability import percentile
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def load_image_set(paths: List[str]) -> List[Image.Image]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [os.path.join(path, name) for name in sorted(os.listdir(path))
+                      if name.lower().endswith(IMAGE_EXTENSIONS)]
+        else:
+            files.append(path)
+    images = [Image.open(path).convert("RGB") for path in files]
+
+    base = images[0]
+    width, height = base.size
+    recompressed = io.BytesIO()
+    base.save(recompressed, format="JPEG", quality=40)
+    images += [
+        ImageOps.mirror(base),
+        base.crop((width // 10, height // 10, width * 9 // 10, height * 9 // 10)),
+        base.rotate(90, expand=True),
+        ImageOps.grayscale(base).convert("RGB"),
+        base.resize((width // 2, height // 2)),
+        Image.open(io.BytesIO(recompressed.getvalue())).convert("RGB"),
+    ]
+    return images
+
+
+def run_worker(backend_name: str, image_paths: List[str], threads: int, max_new_tokens: int,
+               batch_size: int, repeats: int) -> dict:
+    import torch
+    from transformers import BlipProcessor
+
+    # Each backend runs in its own process, so the process-wide pool is this backend's alone
+    torch.set_num_threads(threads)
+    images = load_image_set(image_paths)
+    started = time.perf_counter()
+    processor = BlipProcessor.from_pretrained(CAPTION_MODEL_NAME)
+    backend = create_blip_backend(backend_name, CAPTION_MODEL_NAME, max_new_tokens=max_new_tokens,
+                                  num_threads=threads)
+    load_seconds = time.perf_counter() - started
+
+    # Warm-up, and the captions compared across backends
+    captions = [caption_with(backend, processor, [image])[0] for image in images]
+
+    latencies = []
+    for _ in range(repeats):
+        for image in images:
+            started = time.perf_counter()
+            caption_with(backend, processor, [image])
+            latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for start in range(0, len(images), batch_size):
+            caption_with(backend, processor, images[start:start + batch_size])
+    batch_seconds = time.perf_counter() - started
+
+    return {
+        "backend": backend_name,
+        "images": len(images),
+        "load_seconds": round(load_seconds, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "images_per_second": round(repeats * len(images) / batch_seconds, 2),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "captions": captions,
+    }
+
+
+def word_overlap(a: str, b: str) -> float:
+    words_a, words_b = set(a.lower().split()), set(b.lower().split())
+    if not words_a and not words_b:
+        return 1.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def measure(backend_name: str, args) -> dict:
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", backend_name,
+        "--threads", str(args.threads), "--max-new-tokens", str(args.max_new_tokens),
+        "--batch-size", str(args.batch_size), "--repeats", str(args.repeats),
+    ]
+    for path in args.images:
+        command += ["--images", os.path.abspath(path)]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    # The worker's result is its last line; model loading may print before it
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BLIP inference backends")
+    parser.add_argument("--backend", action="append", choices=BACKENDS, default=None,
+                        help="Backends to compare (default: all)")
+    parser.add_argument("--images", action="append", default=None, help="Images or directories (default: moldup.jpeg)")
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--max-new-tokens", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", default=None, help="Write results to this JSON file")
+    parser.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.images = args.images or ["moldup.jpeg"]
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.images, args.threads, args.max_new_tokens,
+                                    args.batch_size, args.repeats)))
+        sys.exit(0)
+
+    # The stub captioner is only there for offline load tests
+    backends = args.backend or [name for name in BACKENDS if name != "stub"]
+    # fp32 is the reference for caption agreement
+    if "fp32" in backends:
+        backends = ["fp32"] + [name for name in backends if name != "fp32"]
+    results = []
+    for name in backends:
+        try:
+            results.append(measure(name, args))
+        except subprocess.CalledProcessError:
+            print(f"{name}: failed (see output above)")
+
+    reference = next((r["captions"] for r in results if r["backend"] == "fp32"), None)
+    for result in results:
+        if reference is not None:
+            pairs = list(zip(reference, result["captions"]))
+            result["exact_match"] = round(sum(a == b for a, b in pairs) / len(pairs), 3)
+            result["word_overlap"] = round(sum(word_overlap(a, b) for a, b in pairs) / len(pairs), 3)
+
+    header = (f"{'backend':<8}{'load s':>8}{'p50 ms':>9}{'p95 ms':>9}{'img/s':>8}{'peak MB':>9}"
+              f"{'exact':>7}{'overlap':>9}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['backend']:<8}{r['load_seconds']:>8.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+              f"{r['images_per_second']:>8.2f}{r['peak_rss_mb']:>9.0f}"
+              f"{r.get('exact_match', float('nan')):>7.2f}{r.get('word_overlap', float('nan')):>9.2f}")
+    if results:
+        print("\nFirst image captions: " + "; ".join(f"{r['backend']}: {r['captions'][0]!r}" for r in results))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
@@ -0,0 +1,142 @@
+"""Build time and query latency of the BM25 index in lexical_index.py.
+
+Runs on the chunks of a built store (chunks.sqlite) or on a corpus made by
+repeating source.txt until it has --n chunks. With --rag, also compares
+vector-only and hybrid (vector + BM25, fused by RRF) retrieval latency through
+RAGSystem, with the result cache bypassed.
+
+    python benchmark_lexical.py --corpus store --vector-store vector_store_db
+    python benchmark_lexical.py --corpus synthetic --n 100000 --json lexical.json
+    python benchmark_lexical.py --rag
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from typing import List
+
+import numpy as np
+
+from lexical_index import BM25Index, tokenize
+from mmap_store import CHUNKS_FILE
+
+# Exact-term questions pure embedding search tends to miss
+TERM_QUERIES = [
+    "What is a Section 21 notice?",
+    "Does my landlord need to give me an EPC?",
+    "How does deposit protection work?",
+    "Is my house an HMO?",
+    "gas safety certificate",
+    "How to Rent guide",
+]
+
+
+def store_corpus(vector_store_path: str) -> List[str]:
+    conn = sqlite3.connect(os.path.join(vector_store_path, CHUNKS_FILE))
+    try:
+        return [text for (text,) in conn.execute("SELECT text FROM chunks ORDER BY position")]
+    finally:
+        conn.close()
+
+
+def synthetic_corpus(n: int, source_path: str = "source.txt", chunk_chars: int = 500) -> List[str]:
+    with open(source_path, encoding="utf-8") as f:
+        text = f.read()
+    chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+    return [chunks[i % len(chunks)] for i in range(n)]
+
+
+def make_queries(corpus: List[str], count: int, seed: int = 0) -> List[str]:
+    """The exact-term questions plus random word pairs drawn from the corpus"""
+    rng = np.random.default_rng(seed)
+    queries = list(TERM_QUERIES)
+    while len(queries) < count:
+        tokens = tokenize(corpus[rng.integers(len(corpus))])
+        if len(tokens) >= 2:
+            start = rng.integers(len(tokens) - 1)
+            queries.append(" ".join(tokens[start:start + 2]))
+    return queries[:count]
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    latencies = np.asarray(latencies)
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+    }
+
+
+def benchmark_bm25(corpus: List[str], queries: List[str], k: int) -> dict:
+    started = time.perf_counter()
+    index = BM25Index.build(corpus)
+    build_seconds = time.perf_counter() - started
+
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "chunks": len(corpus),
+        "terms": len(index.vocab),
+        "postings": int(len(index.doc_ids)),
+        "build_seconds": round(build_seconds, 3),
+        "memory_mb": round(index.memory_bytes() / 1e6, 2),
+        **latency_summary(latencies),
+    }
+
+
+def benchmark_rag(vector_store_path: str, queries: List[str]) -> dict:
+    """Vector-only vs hybrid retrieval latency, embeddings cached so only search is timed"""
+    from RAGsystem import RAGSystem
+
+    rag_system = RAGSystem(vector_store_path)
+    if rag_system.lexical_index is None:
+        raise SystemExit("The store has no BM25 index; re-run document_processor.py")
+    for query in queries:
+        rag_system.embed_query(query)
+
+    results = {}
+    for mode, search in (
+        ("vector", lambda q: rag_system.vector_positions(q, rag_system.k)),
+        ("hybrid", rag_system.hybrid_positions),
+    ):
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            search(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+        results[mode] = latency_summary(latencies)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the BM25 inverted index")
+    parser.add_argument("--corpus", choices=["store", "synthetic"], default="store")
+    parser.add_argument("--vector-store", default="vector_store_db")
+    parser.add_argument("--n", type=int, default=50000, help="Synthetic corpus size in chunks")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=20, help="BM25 candidates per query")
+    parser.add_argument("--rag", action="store_true", help="Also time vector-only vs hybrid retrieval")
+    parser.add_argument("--json", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    corpus = store_corpus(args.vector_store) if args.corpus == "store" else synthetic_corpus(args.n)
+    queries = make_queries(corpus, args.queries)
+    results = {"bm25": benchmark_bm25(corpus, queries, args.k)}
+    bm25 = results["bm25"]
+    print(f"BM25 over {bm25['chunks']} chunks: {bm25['terms']} terms, {bm25['postings']} postings, "
+          f"{bm25['memory_mb']:.1f} MB")
+    print(f"  build {bm25['build_seconds']:.2f}s, query p50 {bm25['p50_ms']:.3f} ms, p99 {bm25['p99_ms']:.3f} ms")
+
+    if args.rag:
+        results["retrieval"] = benchmark_rag(args.vector_store, queries)
+        for mode, summary in results["retrieval"].items():
+            print(f"  {mode:<7} retrieval p50 {summary['p50_ms']:.3f} ms, p99 {summary['p99_ms']:.3f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
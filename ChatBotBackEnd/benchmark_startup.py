@@ -0,0 +1,157 @@
+"""Measure import time of app.py and per-worker memory of serve.py.
+
+Import time is taken in fresh interpreters, together with the heavy packages
+that ``import app`` pulled in. Pass ``--tree`` to measure another checkout,
+e.g. the code before lazy imports:
+
+    git worktree add /tmp/before <commit>
+    python benchmark_startup.py --tree /tmp/before/ChatBotBackEnd --skip-serve
+
+Memory is measured by starting serve.py with and without ``--no-preload``
+and reading RSS, PSS (shared pages divided between the processes that map
+them) and private memory of every worker once the server is ready. Linux only.
+
+    python benchmark_startup.py --workers 4 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+HEAVY_MODULES = ("torch", "transformers", "langchain_community", "faiss", "google.generativeai", "sentence_transformers")
+
+IMPORT_PROBE = (
+    "import json, sys, time; started = time.perf_counter(); import app; "
+    "elapsed = time.perf_counter() - started; "
+    "print(json.dumps({'seconds': elapsed, 'heavy': [m for m in sys.argv[1:] if m in sys.modules]}))"
+)
+
+
+def measure_import(tree: str, runs: int) -> dict:
+    samples = []
+    heavy = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE, *HEAVY_MODULES], cwd=tree, check=True,
+            capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        samples.append(result["seconds"])
+        heavy = result["heavy"]
+    return {
+        "runs": runs,
+        "median_seconds": statistics.median(samples),
+        "min_seconds": min(samples),
+        "heavy_modules_loaded": heavy,
+    }
+
+
+def _memory(pid: int) -> dict:
+    """RSS / PSS / private memory of a process in MB, from /proc"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1]) / 1024
+    return {
+        "rss_mb": fields.get("Rss", 0.0),
+        "pss_mb": fields.get("Pss", 0.0),
+        "private_mb": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0),
+    }
+
+
+def _children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def _wait_ready(base_url: str, workers: int, process: subprocess.Popen, timeout: float) -> float:
+    """Seconds until /ready answered 200 on enough consecutive polls to have reached every worker"""
+    started = time.perf_counter()
+    streak = 0
+    while streak < 4 * workers:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve.py exited with code {process.returncode}")
+        if time.perf_counter() - started > timeout:
+            raise RuntimeError(f"serve.py not ready after {timeout:.0f}s")
+        try:
+            ok = requests.get(f"{base_url}/ready", timeout=2).status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        streak = streak + 1 if ok else 0
+        if not ok:
+            time.sleep(0.5)
+    return time.perf_counter() - started
+
+
+def measure_serve(tree: str, workers: int, preload: bool, port: int, env_overrides: dict, timeout: float) -> dict:
+    command = [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port)]
+    if not preload:
+        command.append("--no-preload")
+    env = {**os.environ, "LLM_BACKEND": os.environ.get("LLM_BACKEND", "fake"), **env_overrides}
+    process = subprocess.Popen(command, cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready_seconds = _wait_ready(f"http://127.0.0.1:{port}", workers, process, timeout)
+        per_worker = [_memory(pid) for pid in _children(process.pid)]
+        parent = _memory(process.pid)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    def mean(key: str) -> float:
+        return sum(worker[key] for worker in per_worker) / len(per_worker) if per_worker else 0.0
+
+    return {
+        "preload": preload,
+        "workers": len(per_worker),
+        "ready_seconds": ready_seconds,
+        "parent": parent,
+        "worker_mean": {key: mean(key) for key in ("rss_mb", "pss_mb", "private_mb")},
+        "total_pss_mb": parent["pss_mb"] + sum(worker["pss_mb"] for worker in per_worker),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark app.py import time and serve.py worker memory")
+    parser.add_argument("--tree", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="Directory containing app.py (default: this checkout)")
+    parser.add_argument("--import-runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--skip-serve", action="store_true", help="Only measure import time")
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra environment for serve.py, e.g. BLIP_BACKEND=int8")
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--json", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {"import": measure_import(args.tree, args.import_runs)}
+    print(f"import app: {results['import']['median_seconds']:.2f}s median of {args.import_runs}, "
+          f"heavy modules loaded: {', '.join(results['import']['heavy_modules_loaded']) or 'none'}")
+
+    if not args.skip_serve:
+        overrides = dict(item.split("=", 1) for item in args.server_env)
+        results["serve"] = []
+        print(f"\n{'mode':<12}{'ready s':>9}{'RSS/worker':>12}{'PSS/worker':>12}{'private/worker':>16}{'total PSS':>11}")
+        for preload in (False, True):
+            result = measure_serve(args.tree, args.workers, preload, args.port, overrides, args.ready_timeout)
+            results["serve"].append(result)
+            worker = result["worker_mean"]
+            print(f"{'preload' if preload else 'per-worker':<12}{result['ready_seconds']:>9.1f}"
+                  f"{worker['rss_mb']:>12.0f}{worker['pss_mb']:>12.0f}{worker['private_mb']:>16.0f}"
+                  f"{result['total_pss_mb']:>11.0f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Compare cold start and per-worker memory of the legacy and pickle-free store formats.
+
+Starts N worker processes per format, all holding the store at the same time,
+and reports how long loading took plus RSS, PSS (shared pages divided between
+the processes that map them) and private memory per worker. Linux only.
+
+    python benchmark_store_format.py --vector-store vector_store_db --workers 4
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def _memory() -> dict:
+    """RSS / PSS / private memory of this process in MB, from /proc"""
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024
+    except FileNotFoundError:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    fields["Rss"] = int(line.split()[1]) / 1024
+    return {
+        "rss_mb": fields.get("Rss", 0.0),
+        "pss_mb": fields.get("Pss", 0.0),
+        "private_mb": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0),
+    }
+
+
+def run_worker(store_format: str, vector_store_path: str) -> None:
+    """Load the store, run one search, report, then hold it until told to exit"""
+    from langchain_community.vectorstores import FAISS
+    from mmap_store import MmapVectorStore
+
+    before = _memory()
+    started = time.perf_counter()
+    if store_format == "legacy":
+        store = FAISS.load_local(vector_store_path, None, allow_dangerous_deserialization=True)
+    else:
+        store = MmapVectorStore(vector_store_path)
+    load_seconds = time.perf_counter() - started
+
+    query = np.random.default_rng(0).standard_normal(store.index.d).astype("float32")
+    started = time.perf_counter()
+    store.similarity_search_by_vector(query.tolist(), k=5)
+    first_search_ms = (time.perf_counter() - started) * 1000
+
+    print(json.dumps({"load_seconds": load_seconds, "first_search_ms": first_search_ms}), flush=True)
+    # Measure only once every worker is loaded, so PSS reflects the sharing
+    sys.stdin.readline()
+    after = _memory()
+    print(json.dumps({
+        **after,
+        "store_rss_mb": after["rss_mb"] - before["rss_mb"],
+        "store_private_mb": after["private_mb"] - before["private_mb"],
+    }), flush=True)
+    sys.stdin.readline()
+
+
+def measure(store_format: str, vector_store_path: str, workers: int) -> dict:
+    procs = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", store_format,
+             "--vector-store", os.path.abspath(vector_store_path)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        for _ in range(workers)
+    ]
+    loads = [json.loads(proc.stdout.readline()) for proc in procs]
+    for proc in procs:
+        proc.stdin.write("\n")
+        proc.stdin.flush()
+    memories = [json.loads(proc.stdout.readline()) for proc in procs]
+    for proc in procs:
+        proc.stdin.write("\n")
+        proc.stdin.close()
+        proc.wait()
+
+    def mean(rows, key):
+        return sum(row[key] for row in rows) / len(rows)
+
+    return {
+        "format": store_format,
+        "workers": workers,
+        "load_seconds": mean(loads, "load_seconds"),
+        "first_search_ms": mean(loads, "first_search_ms"),
+        "rss_mb": mean(memories, "rss_mb"),
+        "pss_mb": mean(memories, "pss_mb"),
+        "store_rss_mb": mean(memories, "store_rss_mb"),
+        "store_private_mb": mean(memories, "store_private_mb"),
+    }
+
+
+def make_legacy_copy(vector_store_path: str) -> str:
+    """Write a save_local (pickled) copy of the store to a temporary directory"""
+    from mmap_store import load_vector_store
+
+    legacy_path = tempfile.mkdtemp(prefix="legacy_store_")
+    load_vector_store(vector_store_path, None).save_local(legacy_path)
+    return legacy_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark vector store formats")
+    parser.add_argument("--vector-store", default="vector_store_db", help="Store in the pickle-free format")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--json", default=None, help="Write results to this JSON file")
+    parser.add_argument("--worker", choices=["legacy", "mmap"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.vector_store)
+        sys.exit(0)
+
+    legacy_path = make_legacy_copy(args.vector_store)
+    try:
+        results = [
+            measure("legacy", legacy_path, args.workers),
+            measure("mmap", args.vector_store, args.workers),
+        ]
+    finally:
+        shutil.rmtree(legacy_path, ignore_errors=True)
+
+    header = f"{'format':<8}{'load s':>9}{'1st search ms':>15}{'RSS MB':>9}{'PSS MB':>9}{'store RSS MB':>14}{'store private MB':>18}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['format']:<8}{r['load_seconds']:>9.3f}{r['first_search_ms']:>15.2f}{r['rss_mb']:>9.1f}"
+              f"{r['pss_mb']:>9.1f}{r['store_rss_mb']:>14.1f}{r['store_private_mb']:>18.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,246 @@
+"""Interchangeable BLIP captioning backends for CPU hosts.
+
+    fp32  the Hugging Face model as loaded (eager PyTorch)
+    int8  the same model with its Linear layers dynamically quantized to int8
+    onnx  the vision encoder and text decoder exported to ONNX and run with
+          ONNX Runtime, decoded greedily
+    stub  no model at all: a fixed caption chosen from the image's pixels,
+          for load tests and offline development
+
+Every backend takes preprocessed ``pixel_values``, returns caption token ids
+for the shared BlipProcessor to decode and stops after ``max_new_tokens``
+tokens. The PyTorch backends generate under ``torch.inference_mode()``.
+
+torch and transformers are imported only when a real backend is built, so
+the stub backend starts without them. ``num_threads`` sizes the ONNX Runtime
+session only: torch's intra-op pool is process-wide, so it is set once per
+process by the entry point (``serve.py --torch-threads``).
+"""
+import hashlib
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, List, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import torch
+    from transformers import BlipProcessor
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("fp32", "int8", "onnx", "stub")
+DEFAULT_ONNX_DIR = "blip_onnx"
+
+
+class TorchBlipBackend:
+    """Eager PyTorch generation, optionally with int8 dynamically quantized Linear layers"""
+
+    def __init__(self, model_name: str, device: str = "cpu", quantize: bool = False, max_new_tokens: int = 30):
+        import torch
+        from transformers import BlipForConditionalGeneration
+
+        model = BlipForConditionalGeneration.from_pretrained(model_name).eval()
+        if quantize:
+            if device != "cpu":
+                raise ValueError("int8 dynamic quantization only runs on CPU")
+            # Weights of every Linear layer become int8; activations are quantized on the fly
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.name = "int8" if quantize else "fp32"
+        self.device = device
+        self.model = model.to(device)
+        self.max_new_tokens = max_new_tokens
+
+    def generate(self, pixel_values: "torch.Tensor") -> "torch.Tensor":
+        import torch
+
+        with torch.inference_mode():
+            return self.model.generate(
+                pixel_values=pixel_values.to(self.device),
+                max_new_tokens=self.max_new_tokens,
+                num_beams=1
+            )
+
+
+def _export_modules(model):
+    """Wrap BLIP's vision encoder and text decoder as tensor-in, tensor-out modules"""
+    import torch
+
+    class VisionEncoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.vision_model = model.vision_model
+
+        def forward(self, pixel_values):
+            return self.vision_model(pixel_values=pixel_values, return_dict=False)[0]
+
+    class TextDecoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.text_decoder = model.text_decoder
+
+        def forward(self, input_ids, attention_mask, encoder_hidden_states):
+            return self.text_decoder(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                encoder_hidden_states=encoder_hidden_states,
+                return_dict=False
+            )[0]
+
+    return VisionEncoder(), TextDecoder()
+
+
+def export_onnx(model_name: str, output_dir: str) -> None:
+    """Export BLIP's vision encoder and text decoder (no KV cache) to ONNX"""
+    import torch
+    from transformers import BlipForConditionalGeneration
+
+    model = BlipForConditionalGeneration.from_pretrained(model_name).eval()
+    os.makedirs(output_dir, exist_ok=True)
+    image_size = model.config.vision_config.image_size
+    pixel_values = torch.zeros(1, 3, image_size, image_size)
+    with torch.inference_mode():
+        image_embeds = model.vision_model(pixel_values=pixel_values, return_dict=False)[0]
+    input_ids = torch.full((1, 2), model.config.text_config.bos_token_id, dtype=torch.long)
+    vision_encoder, text_decoder = _export_modules(model)
+
+    torch.onnx.export(
+        vision_encoder, (pixel_values,), os.path.join(output_dir, "vision_encoder.onnx"),
+        input_names=["pixel_values"], output_names=["image_embeds"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+        opset_version=17
+    )
+    torch.onnx.export(
+        text_decoder, (input_ids, torch.ones_like(input_ids), image_embeds),
+        os.path.join(output_dir, "text_decoder.onnx"),
+        input_names=["input_ids", "attention_mask", "encoder_hidden_states"], output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "encoder_hidden_states": {0: "batch"},
+            "logits": {0: "batch", 1: "sequence"},
+        },
+        opset_version=17
+    )
+    logger.info("Exported BLIP to %s", output_dir)
+
+
+class OnnxBlipBackend:
+    """ONNX Runtime inference with a greedy decoding loop in numpy.
+
+    The graphs are exported on first use into ``onnx_dir``. Needs the optional
+    ``onnxruntime`` and ``onnx`` packages.
+    """
+
+    def __init__(self, model_name: str, onnx_dir: str = DEFAULT_ONNX_DIR, max_new_tokens: int = 30,
+                 num_threads: Optional[int] = None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("BLIP_BACKEND=onnx needs onnxruntime: pip install onnxruntime onnx") from e
+        from transformers import BlipConfig
+
+        if not all(os.path.exists(os.path.join(onnx_dir, name))
+                   for name in ("vision_encoder.onnx", "text_decoder.onnx")):
+            export_onnx(model_name, onnx_dir)
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        self.vision = ort.InferenceSession(os.path.join(onnx_dir, "vision_encoder.onnx"), options, providers=providers)
+        self.decoder = ort.InferenceSession(os.path.join(onnx_dir, "text_decoder.onnx"), options, providers=providers)
+
+        text_config = BlipConfig.from_pretrained(model_name).text_config
+        self.bos_token_id = text_config.bos_token_id
+        self.eos_token_id = text_config.sep_token_id
+        self.pad_token_id = text_config.pad_token_id
+        self.name = "onnx"
+        self.max_new_tokens = max_new_tokens
+
+    def generate(self, pixel_values: "torch.Tensor") -> "torch.Tensor":
+        import torch
+
+        image_embeds = self.vision.run(None, {"pixel_values": pixel_values.cpu().numpy().astype("float32")})[0]
+        batch = image_embeds.shape[0]
+        input_ids = np.full((batch, 1), self.bos_token_id, dtype="int64")
+        finished = np.zeros(batch, dtype=bool)
+        for _ in range(self.max_new_tokens):
+            logits = self.decoder.run(None, {
+                "input_ids": input_ids,
+                "attention_mask": np.ones_like(input_ids),
+                "encoder_hidden_states": image_embeds,
+            })[0]
+            next_tokens = np.where(finished, self.pad_token_id, logits[:, -1].argmax(axis=-1))
+            input_ids = np.concatenate([input_ids, next_tokens[:, None]], axis=1)
+            finished |= next_tokens == self.eos_token_id
+            if finished.all():
+                break
+        return torch.from_numpy(input_ids)
+
+
+class StubBlipBackend:
+    """Deterministic stand-in for BLIP that loads no weights.
+
+    Each image gets one of a few property-inspection captions, picked from a
+    hash of a tiny thumbnail, so the same photo always gets the same caption
+    and the issue matcher still has something realistic to classify.
+    ``delay_ms`` is slept once per batch to mimic captioning cost.
+    """
+
+    CAPTIONS = (
+        "a wall covered in black mold",
+        "a brown water stain on the ceiling",
+        "a cracked window with a broken frame",
+        "exposed electrical wires hanging from the wall",
+        "a damp patch with peeling paint under a window",
+        "a clean and tidy living room",
+    )
+
+    def __init__(self, max_new_tokens: int = 30, delay_ms: float = 50.0):
+        self.name = "stub"
+        self.max_new_tokens = max_new_tokens
+        self.delay_ms = delay_ms
+
+    def caption(self, images) -> List[str]:
+        time.sleep(self.delay_ms / 1000)
+        captions = []
+        for image in images:
+            thumbnail = image.convert("L").resize((8, 8)).tobytes()
+            index = int(hashlib.sha256(thumbnail).hexdigest(), 16) % len(self.CAPTIONS)
+            captions.append(self.CAPTIONS[index])
+        return captions
+
+
+def create_blip_backend(name: str, model_name: str, device: str = "cpu", max_new_tokens: int = 30,
+                        num_threads: Optional[int] = None, onnx_dir: str = DEFAULT_ONNX_DIR):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown BLIP backend '{name}', expected one of {BACKENDS}")
+    if name == "stub":
+        return StubBlipBackend(max_new_tokens, float(os.environ.get("BLIP_STUB_DELAY_MS", 50)))
+    if name == "onnx":
+        return OnnxBlipBackend(model_name, onnx_dir, max_new_tokens, num_threads)
+    return TorchBlipBackend(model_name, device, quantize=name == "int8", max_new_tokens=max_new_tokens)
+
+
+def create_blip_backend_from_env(model_name: str, device: str = "cpu"):
+    """Backend chosen by BLIP_BACKEND, with BLIP_THREADS, BLIP_MAX_NEW_TOKENS and BLIP_ONNX_DIR"""
+    threads = os.environ.get("BLIP_THREADS")
+    return create_blip_backend(
+        os.environ.get("BLIP_BACKEND", "fp32").lower(),
+        model_name,
+        device=device,
+        max_new_tokens=int(os.environ.get("BLIP_MAX_NEW_TOKENS", 30)),
+        num_threads=int(threads) if threads else None,
+        onnx_dir=os.environ.get("BLIP_ONNX_DIR", DEFAULT_ONNX_DIR)
+    )
+
+
+def caption_with(backend, processor: Optional["BlipProcessor"], images) -> List[str]:
+    """Caption a batch of PIL images with any backend"""
+    if isinstance(backend, StubBlipBackend):
+        return backend.caption(images)
+    inputs = processor(images=images, return_tensors="pt")
+    return processor.batch_decode(backend.generate(inputs["pixel_values"]), skip_special_tokens=True)
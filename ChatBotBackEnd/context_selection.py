@@ -0,0 +1,263 @@
+"""Post-retrieval selection of the chunks that go into the prompt.
+
+Chunks are split with a 50-character overlap, so a plain top-k often holds
+neighbouring chunks that repeat each other, or near-identical passages from
+different parts of the guide. Instead of a fixed k, RAGSystem over-fetches
+candidates and ``select_context``:
+
+1. picks diverse passages greedily by maximal marginal relevance (MMR),
+   using the candidates' index vectors, skipping near-duplicates of passages
+   already picked. With hybrid retrieval, relevance is the fused (RRF) score
+   rather than cosine similarity, so exact-term BM25 hits keep their place
+2. stops at a similarity cutoff (which BM25 hits are exempt from), a
+   character budget or a chunk cap
+3. merges picked chunks from the same region of a document (adjacent index
+   positions, or text that overlaps) into one passage, dropping the repeated
+   text
+
+The best candidate is always kept. Every selection records how many bytes
+of context it saved against the plain top-k.
+"""
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional, Sequence
+
+import numpy as np
+
+from observability import REGISTRY, summarize
+
+BYTE_BUCKETS = (256, 512, 1024, 2048, 3072, 4096, 6144, 8192, 16384)
+
+CONTEXT_BYTES = REGISTRY.histogram(
+    "chatbot_context_bytes", "Retrieved context per request: plain top-k (baseline) and after selection (selected)",
+    ("kind",), buckets=BYTE_BUCKETS
+)
+CONTEXT_CHUNKS_DROPPED = REGISTRY.counter(
+    "chatbot_context_chunks_dropped_total", "Candidate chunks left out of the context or merged into a neighbour, by reason", ("reason",)
+)
+
+
+@dataclass
+class Candidate:
+    position: int
+    text: str
+    metadata: dict = field(default_factory=dict)
+
+
+@dataclass
+class Passage:
+    """One selected passage; ``positions`` lists the chunks merged into it"""
+    text: str
+    metadata: dict
+    positions: List[int]
+    relevance: float
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_select(
+    query_vector: np.ndarray,
+    candidate_vectors: np.ndarray,
+    lengths: Sequence[int],
+    mmr_lambda: float = 0.7,
+    max_chunks: int = 5,
+    min_similarity: float = 0.25,
+    max_chars: int = 2500,
+    duplicate_similarity: float = 0.95,
+    relevance: Optional[np.ndarray] = None,
+    cutoff_exempt: Optional[np.ndarray] = None
+) -> dict:
+    """Greedy MMR over cosine similarities; returns picked indices and drop counts.
+
+    ``relevance`` (in [0, 1], e.g. normalised fused scores) replaces cosine
+    similarity to the query for ranking; the ``min_similarity`` cutoff is
+    always on cosine similarity, except for candidates in ``cutoff_exempt``.
+    The candidate-candidate similarity matrix is computed once, and the
+    running maximum similarity to the picked set is updated with one vector
+    operation per pick.
+    """
+    vectors = _normalize(np.asarray(candidate_vectors, dtype="float32"))
+    query_similarity = vectors @ _normalize(np.asarray(query_vector, dtype="float32"))
+    relevance = query_similarity if relevance is None else np.asarray(relevance, dtype="float32")
+    similarity = vectors @ vectors.T
+    count = len(relevance)
+
+    available = query_similarity >= min_similarity
+    if cutoff_exempt is not None:
+        available |= np.asarray(cutoff_exempt, dtype=bool)
+    if count:
+        available[int(np.argmax(relevance))] = True
+    dropped = {"cutoff": int(count - available.sum()), "duplicate": 0, "budget": 0}
+    # Highest similarity of each candidate to the picked set (-1 until something is picked)
+    redundancy = np.full(count, -1.0, dtype="float32")
+    picked: List[int] = []
+    chars = 0
+    while len(picked) < max_chunks and available.any():
+        scores = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        available[best] = False
+        if picked and redundancy[best] >= duplicate_similarity:
+            dropped["duplicate"] += 1
+            continue
+        if picked and chars + lengths[best] > max_chars:
+            dropped["budget"] += int(available.sum()) + 1
+            break
+        picked.append(best)
+        chars += lengths[best]
+        redundancy = np.maximum(redundancy, similarity[best])
+    return {"picked": picked, "relevance": relevance, "dropped": dropped}
+
+
+def text_overlap(left: str, right: str, max_overlap: int = 200, min_overlap: int = 16) -> int:
+    """Length of the longest suffix of ``left`` that is a prefix of ``right``"""
+    for size in range(min(len(left), len(right), max_overlap), min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _same_region(a: dict, b: dict) -> bool:
+    if a.get("source") != b.get("source"):
+        return False
+    if "page" in a and "page" in b:
+        return abs(a["page"] - b["page"]) <= 1
+    return True
+
+
+def merge_passages(candidates: Sequence[Candidate], picked: Sequence[int], relevance: np.ndarray) -> List[Passage]:
+    """Join picked chunks that are neighbours in the same document, in document order.
+
+    Chunks are appended to the index in document order, so adjacent index
+    positions from the same source are consecutive pieces of text. Passages
+    come back in order of their most relevant chunk.
+    """
+    ranked = {index: rank for rank, index in enumerate(picked)}
+    groups: List[List[int]] = []
+    for index in sorted(picked, key=lambda i: candidates[i].position):
+        if groups:
+            previous = candidates[groups[-1][-1]]
+            current = candidates[index]
+            if _same_region(previous.metadata, current.metadata) and (
+                current.position - previous.position == 1 or text_overlap(previous.text, current.text)
+            ):
+                groups[-1].append(index)
+                continue
+        groups.append([index])
+
+    ranked_passages = []
+    for group in groups:
+        text = candidates[group[0]].text
+        for index in group[1:]:
+            following = candidates[index].text
+            if following in text:
+                continue
+            overlap = text_overlap(text, following)
+            text = text + following[overlap:] if overlap else text + "\n" + following
+        best = min(group, key=ranked.get)
+        ranked_passages.append((ranked[best], Passage(
+            text=text,
+            metadata=candidates[group[0]].metadata,
+            positions=[candidates[index].position for index in group],
+            relevance=float(relevance[best]),
+        )))
+    return [passage for _, passage in sorted(ranked_passages, key=lambda item: item[0])]
+
+
+def _joined_bytes(texts: Sequence[str]) -> int:
+    return len("\n\n".join(texts).encode("utf-8"))
+
+
+class ContextSelectionStats:
+    """Rolling bytes saved per request and counts of dropped and merged chunks"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._saved_bytes: Deque[int] = deque(maxlen=window)
+        self._baseline_bytes: Deque[int] = deque(maxlen=window)
+        self._selected_bytes: Deque[int] = deque(maxlen=window)
+        self._dropped = {"cutoff": 0, "duplicate": 0, "budget": 0, "merged": 0}
+        self.requests = 0
+
+    def record(self, baseline_bytes: int, selected_bytes: int, dropped: dict) -> None:
+        CONTEXT_BYTES.observe(baseline_bytes, kind="baseline")
+        CONTEXT_BYTES.observe(selected_bytes, kind="selected")
+        for reason, count in dropped.items():
+            if count:
+                CONTEXT_CHUNKS_DROPPED.inc(count, reason=reason)
+        with self._lock:
+            self.requests += 1
+            self._baseline_bytes.append(baseline_bytes)
+            self._selected_bytes.append(selected_bytes)
+            self._saved_bytes.append(baseline_bytes - selected_bytes)
+            for reason, count in dropped.items():
+                self._dropped[reason] += count
+
+    def stats(self) -> dict:
+        with self._lock:
+            baseline = sum(self._baseline_bytes)
+            return {
+                "requests": self.requests,
+                "baseline_bytes": summarize(self._baseline_bytes),
+                "selected_bytes": summarize(self._selected_bytes),
+                "saved_bytes": summarize(self._saved_bytes),
+                "saved_ratio": (baseline - sum(self._selected_bytes)) / baseline if baseline else 0.0,
+                "chunks_dropped": dict(self._dropped),
+            }
+
+
+def select_context(
+    query_vector: np.ndarray,
+    candidates: Sequence[Candidate],
+    candidate_vectors: np.ndarray,
+    k: int,
+    settings: dict,
+    stats: Optional[ContextSelectionStats] = None,
+    relevance: Optional[np.ndarray] = None,
+    cutoff_exempt: Optional[np.ndarray] = None
+) -> List[Passage]:
+    """Pick, cut off and merge candidates (best first); ``k`` is the plain top-k this replaces.
+
+    ``relevance`` and ``cutoff_exempt`` are passed to mmr_select.
+    """
+    if not candidates:
+        return []
+    result = mmr_select(
+        query_vector,
+        candidate_vectors,
+        [len(candidate.text) for candidate in candidates],
+        mmr_lambda=settings["mmr_lambda"],
+        max_chunks=settings["max_chunks"],
+        min_similarity=settings["min_similarity"],
+        max_chars=settings["max_chars"],
+        duplicate_similarity=settings["duplicate_similarity"],
+        relevance=relevance,
+        cutoff_exempt=cutoff_exempt,
+    )
+    passages = merge_passages(candidates, result["picked"], result["relevance"])
+    if stats is not None:
+        dropped = dict(result["dropped"], merged=len(result["picked"]) - len(passages))
+        stats.record(
+            _joined_bytes([candidate.text for candidate in candidates[:k]]),
+            _joined_bytes([passage.text for passage in passages]),
+            dropped,
+        )
+    return passages
+
+
+def context_selection_settings_from_env(k: int = 5) -> Optional[dict]:
+    """Selection settings from RAG_CONTEXT_* / RAG_MMR_LAMBDA; None when RAG_CONTEXT_SELECTION=0"""
+    if os.environ.get("RAG_CONTEXT_SELECTION", "1").lower() in ("0", "false", "no"):
+        return None
+    return {
+        "candidates": int(os.environ.get("RAG_CONTEXT_CANDIDATES", 4 * k)),
+        "mmr_lambda": float(os.environ.get("RAG_MMR_LAMBDA", 0.7)),
+        "max_chunks": int(os.environ.get("RAG_CONTEXT_MAX_CHUNKS", k)),
+        "min_similarity": float(os.environ.get("RAG_CONTEXT_MIN_SIMILARITY", 0.25)),
+        "max_chars": int(os.environ.get("RAG_CONTEXT_MAX_CHARS", 2500)),
+        "duplicate_similarity": float(os.environ.get("RAG_CONTEXT_DUPLICATE_SIMILARITY", 0.95)),
+    }
@@ -1,30 +1,113 @@
-from typing import Optional
-import PyPDF2
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
 from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
 from langchain_community.docstore.in_memory import InMemoryDocstore
 import faiss
+import uuid
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extract text content from a PDF file."""
+import numpy as np
+
+from ann_index import (
+    MIN_TRAINING_VECTORS, SOURCE_VECTORS_NAME, build_index, effective_params, load_index_config, resolve_params,
+    save_index_config
+)
+from embedding_stage import EmbeddingStage, add_embedded_documents
+from lexical_index import BM25Index
+from model_registry import EMBEDDING_MODEL_NAME
+from mmap_store import load_vector_store, save_vector_store
+from pdf_pages import count_pages, extract_page_range
+
+PAGES_PER_SHARD = 16
+
+def iter_pdf_pages(
+    pdf_path: str,
+    executor: Optional[Executor] = None,
+    pages_per_shard: int = PAGES_PER_SHARD,
+    max_pending_shards: int = 8
+) -> Iterator[Document]:
+    """
+    Yield one Document per PDF page, in page order, with source/page metadata.
+
+    With an executor (e.g. a ProcessPoolExecutor), page ranges of
+    ``pages_per_shard`` are extracted in parallel. At most
+    ``max_pending_shards`` shards are in flight, so memory stays bounded no
+    matter how long the document is.
+    """
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ''
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        return text
+        num_pages = count_pages(pdf_path)
+        shards = [(start, min(start + pages_per_shard, num_pages))
+                  for start in range(0, num_pages, pages_per_shard)]
+
+        if executor is None or len(shards) <= 1:
+            results = (extract_page_range(pdf_path, start, stop) for start, stop in shards)
+        else:
+            results = _ordered_shard_results(executor, pdf_path, shards, max_pending_shards)
+
+        for pages in results:
+            for page_number, text in pages:
+                yield Document(page_content=text, metadata={"source": pdf_path, "page": page_number + 1})
     except Exception as e:
         raise Exception(f"Error extracting text from PDF: {e}")
 
+def _ordered_shard_results(
+    executor: Executor,
+    pdf_path: str,
+    shards: List[Tuple[int, int]],
+    max_pending_shards: int
+) -> Iterator[List[Tuple[int, str]]]:
+    pending = deque()
+    shard_iter = iter(shards)
+    for start, stop in shard_iter:
+        pending.append(executor.submit(extract_page_range, pdf_path, start, stop))
+        if len(pending) >= max_pending_shards:
+            break
+    while pending:
+        yield pending.popleft().result()
+        for start, stop in shard_iter:
+            pending.append(executor.submit(extract_page_range, pdf_path, start, stop))
+            break
+
+def extract_text_from_pdf(pdf_path: str, executor: Optional[Executor] = None) -> str:
+    """Extract text content from a PDF file."""
+    return ''.join(page.page_content for page in iter_pdf_pages(pdf_path, executor))
+
+def iter_document_pages(path: str, executor: Optional[Executor] = None) -> Iterator[Document]:
+    """Yield per-page Documents for a PDF, or a single Document for a text / markdown file"""
+    if path.lower().endswith(".pdf"):
+        yield from iter_pdf_pages(path, executor)
+        return
+    with open(path, encoding="utf-8") as f:
+        yield Document(page_content=f.read(), metadata={"source": path})
+
+def iter_chunks(
+    pages: Iterator[Document],
+    text_splitter: RecursiveCharacterTextSplitter
+) -> Iterator[Document]:
+    """Split pages as they arrive; chunks keep each page's metadata"""
+    for page in pages:
+        yield from text_splitter.split_documents([page])
+
 def process_and_store_document(
     source_path: str, 
     output_text_path: str = "source.txt",
     vector_store_path: Optional[str] = "vector_store_db",
     chunk_size: int = 500,
-    chunk_overlap: int = 50
+    chunk_overlap: int = 50,
+    batch_size: int = 64,
+    num_threads: Optional[int] = None,
+    embedding_cache_path: Optional[str] = None,
+    index_type: str = "flat",
+    index_params: Optional[dict] = None
 ) -> FAISS:
     """
     Process a document by extracting text, saving to file, and creating a vector store.
@@ -35,52 +118,392 @@ def process_and_store_document(
         vector_store_path: Path where to save the vector store (None to skip saving)
         chunk_size: Size of text chunks for splitting
         chunk_overlap: Overlap between chunks
+        batch_size: Chunks per embedding batch
+        num_threads: Torch threads used for embedding (None keeps the default)
+        embedding_cache_path: SQLite file caching chunk embeddings across runs
+        index_type: flat, ivf_flat, hnsw or ivf_pq
+        index_params: Overrides for the index type's build and search parameters
     
     Returns:
         FAISS vector store instance
     """
-    # Extract text from PDF
-    raw_text = extract_text_from_pdf(source_path)
-
-    # Save extracted text to file
-    with open(output_text_path, "w", encoding="utf-8") as f:
-        f.write(raw_text)
-    print(f"Text written to {output_text_path} successfully!")
-
     # Create text chunks
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         length_function=len,
     )
-    docs = text_splitter.split_documents([Document(page_content=raw_text)])
+
+    # Extract pages in parallel, writing the text out and splitting as pages arrive
+    docs = []
+    with ProcessPoolExecutor() as executor, open(output_text_path, "w", encoding="utf-8") as f:
+        for page in iter_pdf_pages(source_path, executor):
+            f.write(page.page_content)
+            docs.extend(text_splitter.split_documents([page]))
+    print(f"Text written to {output_text_path} successfully!")
 
     # Initialize embeddings
     embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2"
+        model_name=EMBEDDING_MODEL_NAME
     )
-
-    # Create FAISS index based on sample
-    embedding_dim = len(embeddings.embed_query("test"))
-    index = faiss.IndexFlatL2(embedding_dim)
+    stage = EmbeddingStage(embeddings, batch_size, num_threads, cache_path=embedding_cache_path)
 
     # Create and populate vector store
-    vector_store = FAISS(
-        embedding_function=embeddings,
-        index=index,
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={},
-    )
-    vector_store.add_documents(docs)
+    vector_store = _empty_vector_store(embeddings, stage.dimension)
+    vectors = stage.embed([doc.page_content for doc in docs])
+    add_embedded_documents(vector_store, docs, vectors, [str(uuid.uuid4()) for _ in docs])
+    print_embedding_report(stage.throughput_report())
+    requested = resolve_params(index_type, index_params)
+    kind, params = _finalize_index(vector_store, index_type, requested)
 
     # Save vector store if path is provided
     if vector_store_path:
-        vector_store.save_local(vector_store_path)
+        _save_vector_store(vector_store, vector_store_path, kind, params, vectors,
+                           requested if kind == index_type else None)
         print(f"Vector store saved to {vector_store_path}")
 
     return vector_store
 
+MANIFEST_NAME = "ingest_manifest.json"
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md")
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def document_key(path: str, corpus_root: Optional[str] = None) -> str:
+    """Name of a document in the manifest and its chunk ids: relative to corpus_root, else absolute.
+
+    Independent of the working directory, so ingesting from elsewhere doesn't
+    change every chunk id; with a corpus root the store survives moving the corpus.
+    """
+    path = os.path.abspath(path)
+    if corpus_root is None:
+        return path
+    return os.path.relpath(path, os.path.abspath(corpus_root)).replace(os.sep, "/")
+
+def _chunk_ids(source: str, chunks: List[Document]) -> List[str]:
+    """Content-hash ids for a document's chunks, stable across runs.
+
+    Identical chunks within one document get an occurrence suffix so ids stay unique.
+    """
+    ids = []
+    seen: Dict[str, int] = {}
+    for chunk in chunks:
+        base = hashlib.sha256(f"{source}\0{chunk.page_content}".encode("utf-8")).hexdigest()[:32]
+        occurrence = seen.get(base, 0)
+        seen[base] = occurrence + 1
+        ids.append(base if occurrence == 0 else f"{base}-{occurrence}")
+    return ids
+
+def resolve_sources(sources: Union[str, List[str]]) -> List[str]:
+    """Expand directories and manifest files (.json list or one path per line) into document paths"""
+    if isinstance(sources, str):
+        sources = [sources]
+
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                paths.extend(
+                    os.path.join(root, name) for name in sorted(files)
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS)
+                )
+        elif source.lower().endswith(".json"):
+            with open(source, encoding="utf-8") as f:
+                paths.extend(json.load(f))
+        elif source.lower().endswith(".lst"):
+            with open(source, encoding="utf-8") as f:
+                paths.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        else:
+            paths.append(source)
+
+    return sorted({os.path.normpath(path) for path in paths})
+
+def _load_manifest(vector_store_path: str) -> Optional[dict]:
+    manifest_path = os.path.join(vector_store_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _empty_vector_store(embeddings: HuggingFaceEmbeddings, embedding_dim: int) -> FAISS:
+    return FAISS(
+        embedding_function=embeddings,
+        index=faiss.IndexFlatL2(embedding_dim),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+
+def _finalize_index(vector_store: FAISS, kind: str, params: dict) -> Tuple[str, dict]:
+    """Replace the store's flat working index with the requested ANN index type.
+
+    Returns the type and parameters actually built. Falls back to flat when
+    there are too few vectors to train an IVF index.
+    """
+    if kind == "flat":
+        return kind, params
+    flat = vector_store.index
+    if kind in ("ivf_flat", "ivf_pq") and flat.ntotal < MIN_TRAINING_VECTORS:
+        print(f"Only {flat.ntotal} chunks, too few to train {kind}; keeping a flat index")
+        return "flat", {}
+    params = effective_params(kind, flat.ntotal, params)
+    vector_store.index = build_index(kind, flat.reconstruct_n(0, flat.ntotal), params)
+    print(f"Built {kind} index over {flat.ntotal} vectors with {params}")
+    return kind, params
+
+def _save_vector_store(
+    vector_store: FAISS,
+    vector_store_path: str,
+    kind: str,
+    params: dict,
+    source_vectors: Optional[np.ndarray] = None,
+    requested: Optional[dict] = None
+) -> None:
+    """Save the store (pickle-free format) with its index config and BM25 index; ANN
+    stores also keep the exact vectors so later ingestion runs can update and retrain them"""
+    save_vector_store(vector_store, vector_store_path)
+    save_index_config(vector_store_path, kind, params, requested)
+    _save_lexical_index(vector_store, vector_store_path)
+    source_path = os.path.join(vector_store_path, SOURCE_VECTORS_NAME)
+    if kind == "flat":
+        if os.path.exists(source_path):
+            os.remove(source_path)
+    else:
+        np.save(source_path, source_vectors)
+
+def _save_lexical_index(vector_store: FAISS, vector_store_path: str) -> None:
+    """Rebuild the BM25 index over every chunk, doc id = position in the FAISS index.
+
+    Rebuilding from scratch keeps ids aligned after deletions renumber the index,
+    and costs far less than the embedding it accompanies.
+    """
+    started = time.perf_counter()
+    lexical_index = BM25Index.build(
+        vector_store.docstore.search(vector_store.index_to_docstore_id[position]).page_content
+        for position in range(vector_store.index.ntotal)
+    )
+    lexical_index.save(vector_store_path)
+    print(f"Built BM25 index: {len(lexical_index.vocab)} terms, {len(lexical_index.doc_ids)} postings, "
+          f"{time.perf_counter() - started:.2f}s")
+
+def _load_working_index(vector_store: FAISS, vector_store_path: str, kind: str) -> None:
+    """Swap a saved ANN index for an exact flat one built from the stored vectors"""
+    if kind == "flat":
+        return
+    vectors = np.load(os.path.join(vector_store_path, SOURCE_VECTORS_NAME))
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    vector_store.index = flat
+
+def ingest_documents(
+    sources: Union[str, List[str]],
+    vector_store_path: str = "vector_store_db",
+    chunk_size: int = 500,
+    chunk_overlap: int = 50,
+    max_workers: Optional[int] = None,
+    batch_size: int = 64,
+    num_threads: Optional[int] = None,
+    embedding_cache_path: Optional[str] = None,
+    index_type: Optional[str] = None,
+    index_params: Optional[dict] = None,
+    corpus_root: Optional[str] = None
+) -> dict:
+    """
+    Incrementally sync a vector store with a set of documents.
+
+    Each file and chunk is content-hashed. Unchanged files are skipped without
+    re-reading, only new or changed chunks are embedded and appended to the
+    existing FAISS index, and vectors of deleted documents or chunks are removed.
+    State is kept in ``ingest_manifest.json`` inside the vector store directory.
+
+    Args:
+        sources: Document paths, directories, or manifest files (.json list or .lst, one path per line)
+        vector_store_path: Directory of the FAISS store to update (created if missing)
+        chunk_size: Size of text chunks for splitting
+        chunk_overlap: Overlap between chunks
+        max_workers: Processes used for PDF page extraction (default: CPU count)
+        batch_size: Chunks per embedding batch
+        num_threads: Torch threads used for embedding (None keeps the default)
+        embedding_cache_path: SQLite file caching chunk embeddings across runs
+        index_type: flat, ivf_flat, hnsw or ivf_pq (None keeps the store's current type)
+        index_params: Overrides for the index type's build and search parameters; with
+            index_type None they are applied over the store's recorded parameters
+        corpus_root: Directory documents are named relative to (default: absolute paths)
+
+    Returns:
+        Report with document and chunk counts (skipped, added, removed)
+    """
+    paths = resolve_sources(sources)
+    embeddings = HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME
+    )
+    stage = EmbeddingStage(embeddings, batch_size, num_threads, cache_path=embedding_cache_path)
+
+    manifest = _load_manifest(vector_store_path)
+    split_settings = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    index_config = load_index_config(vector_store_path)
+    if manifest is not None and os.path.exists(vector_store_path):
+        vector_store = load_vector_store(vector_store_path, embeddings)
+        # Updates always happen on an exact flat index; the ANN index is rebuilt at the end
+        _load_working_index(vector_store, vector_store_path, index_config["type"])
+    else:
+        if os.path.exists(vector_store_path):
+            # A store built by process_and_store_document has no manifest, so its
+            # chunks can't be matched up; start from an empty index instead.
+            print(f"No {MANIFEST_NAME} in {vector_store_path}, rebuilding from scratch")
+        manifest = {"documents": {}}
+        vector_store = _empty_vector_store(embeddings, stage.dimension)
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+    )
+    settings_changed = manifest.get("settings") != split_settings
+    old_documents = manifest["documents"]
+    new_documents = {}
+    report = {
+        "documents_unchanged": 0,
+        "documents_updated": 0,
+        "documents_removed": 0,
+        "chunks_skipped": 0,
+        "chunks_added": 0,
+        "chunks_removed": 0,
+    }
+    ids_to_remove = []
+
+    # One process pool shared by every PDF, so extraction of many documents stays parallel.
+    # The embedding model is already loaded here, and the pool starts its workers
+    # lazily, so they are spawned rather than forked: a fork would copy the model
+    # and torch's thread pools (which can deadlock) into processes that need only
+    # PyPDF2, which is all pdf_pages.py imports
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        for path in paths:
+            key = document_key(path, corpus_root)
+            file_hash = _file_hash(path)
+            previous = old_documents.get(key)
+            if previous and previous["file_hash"] == file_hash and not settings_changed:
+                new_documents[key] = previous
+                report["documents_unchanged"] += 1
+                report["chunks_skipped"] += len(previous["chunk_ids"])
+                continue
+
+            chunks = list(iter_chunks(iter_document_pages(path, executor), text_splitter))
+            chunk_ids = _chunk_ids(key, chunks)
+            old_ids = set(previous["chunk_ids"]) if previous else set()
+            new_ids = set(chunk_ids)
+
+            docs_to_add = []
+            ids_to_add = []
+            for chunk, chunk_id in zip(chunks, chunk_ids):
+                if chunk_id in old_ids:
+                    report["chunks_skipped"] += 1
+                else:
+                    docs_to_add.append(chunk)
+                    ids_to_add.append(chunk_id)
+            ids_to_remove.extend(old_ids - new_ids)
+
+            # Embed per document so only one document's chunks are held at a time
+            vectors = stage.embed([doc.page_content for doc in docs_to_add])
+            add_embedded_documents(vector_store, docs_to_add, vectors, ids_to_add)
+            report["chunks_added"] += len(docs_to_add)
+
+            new_documents[key] = {"file_hash": file_hash, "chunk_ids": chunk_ids}
+            report["documents_updated"] += 1
+    finally:
+        executor.shutdown()
+
+    for key, previous in old_documents.items():
+        if key not in new_documents:
+            ids_to_remove.extend(previous["chunk_ids"])
+            report["documents_removed"] += 1
+
+    if ids_to_remove:
+        vector_store.delete(ids_to_remove)
+        report["chunks_removed"] = len(ids_to_remove)
+
+    if index_type is None:
+        # Rebuild with what was asked for, not what the corpus allowed last time,
+        # plus any parameters given for this run
+        index_type = index_config["type"]
+        index_params = {**index_config.get("requested", index_config["params"]), **(index_params or {})}
+    flat = vector_store.index
+    source_vectors = flat.reconstruct_n(0, flat.ntotal)
+    requested = resolve_params(index_type, index_params)
+    kind, params = _finalize_index(vector_store, index_type, requested)
+    _save_vector_store(vector_store, vector_store_path, kind, params, source_vectors,
+                       requested if kind == index_type else None)
+    with open(os.path.join(vector_store_path, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump({"settings": split_settings, "documents": new_documents}, f, indent=2)
+
+    report["total_chunks"] = vector_store.index.ntotal
+    report["embedding"] = stage.throughput_report()
+    report["index"] = {"type": kind, "params": params}
+    return report
+
+def print_embedding_report(embedding: dict) -> None:
+    print(f"  Embedding: {embedding['embedded']} embedded, {embedding['cached']} from cache, "
+          f"{embedding['seconds']:.1f}s ({embedding['chunks_per_second']:.1f} chunks/s)")
+
+def print_ingest_report(report: dict) -> None:
+    print("Ingestion report")
+    print(f"  Documents: {report['documents_updated']} updated, "
+          f"{report['documents_unchanged']} unchanged, {report['documents_removed']} removed")
+    print(f"  Chunks:    {report['chunks_added']} added, "
+          f"{report['chunks_skipped']} skipped, {report['chunks_removed']} removed")
+    print(f"  Total chunks in store: {report['total_chunks']} ({report['index']['type']} index)")
+    print_embedding_report(report["embedding"])
+
+def _parse_index_params(pairs: List[str]) -> dict:
+    params = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        params[key] = float(value) if "." in value else int(value)
+    return params
+
 if __name__ == "__main__":
-    # Example usage
-    pdf_path = "DLUHC_How_to_rent_Oct2023.pdf"
-    vector_store = process_and_store_document(pdf_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Incrementally ingest documents into the vector store")
+    parser.add_argument(
+        "sources", nargs="*", default=["DLUHC_How_to_rent_Oct2023.pdf"],
+        help="Documents, directories, or manifest files (.json list / .lst one path per line)"
+    )
+    parser.add_argument("--vector-store", default="vector_store_db")
+    parser.add_argument(
+        "--corpus-root", default=None,
+        help="Directory documents are named relative to in the manifest and chunk ids (default: absolute paths)"
+    )
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None, help="PDF extraction processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks per embedding batch")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads used for embedding")
+    parser.add_argument("--embedding-cache", default=None, help="SQLite file caching chunk embeddings across runs")
+    parser.add_argument(
+        "--index-type", choices=["flat", "ivf_flat", "hnsw", "ivf_pq"], default=None,
+        help="ANN index to build (default: keep the store's current type, flat for new stores)"
+    )
+    parser.add_argument(
+        "--index-param", action="append", default=[], metavar="KEY=VALUE",
+        help="Index parameter, e.g. nlist=256, nprobe=16, M=32, efSearch=64, m=16, nbits=8"
+             " (without --index-type, applied over the store's recorded parameters)"
+    )
+    args = parser.parse_args()
+
+    print_ingest_report(ingest_documents(
+        args.sources,
+        vector_store_path=args.vector_store,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        max_workers=args.workers,
+        batch_size=args.batch_size,
+        num_threads=args.threads,
+        embedding_cache_path=args.embedding_cache,
+        index_type=args.index_type,
+        index_params=_parse_index_params(args.index_param),
+        corpus_root=args.corpus_root
+    ))
\ No newline at end of file
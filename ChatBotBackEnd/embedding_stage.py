@@ -0,0 +1,150 @@
+import hashlib
+import sqlite3
+import time
+from typing import List, Optional
+
+import numpy as np
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+
+class EmbeddingCache:
+    """On-disk float32 embeddings keyed by a hash of the model name and chunk text.
+
+    Keying on the text alone (not its source or position) means re-running
+    ingestion with a different chunk_size only embeds chunks whose text is new.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (chunk_hash TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, hashes: List[str], dim: int) -> dict:
+        found = {}
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for chunk_hash, blob in self._conn.execute(
+                f"SELECT chunk_hash, vector FROM embeddings WHERE chunk_hash IN ({placeholders})", batch
+            ):
+                vector = np.frombuffer(blob, dtype="float32")
+                if vector.shape[0] == dim:
+                    found[chunk_hash] = vector
+        return found
+
+    def put_many(self, hashes: List[str], vectors: np.ndarray) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (chunk_hash, vector) VALUES (?, ?)",
+            ((chunk_hash, vector.tobytes()) for chunk_hash, vector in zip(hashes, vectors))
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class EmbeddingStage:
+    """Batched embedding of chunks for index builds.
+
+    Calls the underlying SentenceTransformer directly with an explicit batch
+    size and returns a contiguous float32 matrix that can go straight into
+    ``faiss.Index.add`` without a per-vector Python list.
+    """
+
+    def __init__(
+        self,
+        embeddings: HuggingFaceEmbeddings,
+        batch_size: int = 64,
+        num_threads: Optional[int] = None,
+        normalize: bool = False,
+        cache_path: Optional[str] = None,
+        progress_every: int = 20
+    ):
+        self.embeddings = embeddings
+        self.model = embeddings.client
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.progress_every = progress_every
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        self.report = {"chunks": 0, "cached": 0, "embedded": 0, "seconds": 0.0}
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def _chunk_hash(self, text: str) -> str:
+        key = f"{self.embeddings.model_name}\0{int(self.normalize)}\0{text}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = np.empty((len(texts), self.dimension), dtype="float32")
+        started = time.perf_counter()
+        step = self.batch_size * self.progress_every
+        # Encode in slices so progress can be reported on long builds
+        for start in range(0, len(texts), step):
+            vectors[start:start + step] = self.model.encode(
+                texts[start:start + step],
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=self.normalize,
+                show_progress_bar=False
+            )
+            done = min(start + step, len(texts))
+            if done < len(texts):
+                elapsed = time.perf_counter() - started
+                print(f"  Embedded {done}/{len(texts)} chunks ({done / elapsed:.1f} chunks/s)")
+        return vectors
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, reusing cached vectors, and return an (n, dim) float32 matrix"""
+        started = time.perf_counter()
+        vectors = np.empty((len(texts), self.dimension), dtype="float32")
+        missing = list(range(len(texts)))
+
+        if self.cache is not None and texts:
+            hashes = [self._chunk_hash(text) for text in texts]
+            cached = self.cache.get_many(hashes, self.dimension)
+            missing = []
+            for i, chunk_hash in enumerate(hashes):
+                if chunk_hash in cached:
+                    vectors[i] = cached[chunk_hash]
+                else:
+                    missing.append(i)
+
+        if missing:
+            encoded = self._encode([texts[i] for i in missing])
+            vectors[missing] = encoded
+            if self.cache is not None:
+                self.cache.put_many([hashes[i] for i in missing], encoded)
+
+        self.report["chunks"] += len(texts)
+        self.report["cached"] += len(texts) - len(missing)
+        self.report["embedded"] += len(missing)
+        self.report["seconds"] += time.perf_counter() - started
+        return vectors
+
+    def throughput_report(self) -> dict:
+        seconds = self.report["seconds"]
+        return {
+            **self.report,
+            "chunks_per_second": self.report["chunks"] / seconds if seconds else 0.0,
+        }
+
+
+def add_embedded_documents(vector_store: FAISS, docs: List[Document], vectors: np.ndarray, ids: List[str]) -> None:
+    """Append pre-computed vectors and their documents to a LangChain FAISS store"""
+    if not docs:
+        return
+    start = vector_store.index.ntotal
+    vector_store.index.add(np.ascontiguousarray(vectors, dtype="float32"))
+    vector_store.docstore.add(dict(zip(ids, docs)))
+    vector_store.index_to_docstore_id.update({start + i: doc_id for i, doc_id in enumerate(ids)})
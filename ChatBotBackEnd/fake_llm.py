@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import os
+import time
+from typing import AsyncIterator, Iterator, List
+
+
+class FakeResponse:
+    """Mimics the parts of a Gemini response object the services use"""
+
+    def __init__(self, chunks: List[str], first_token_delay: float = 0.0, token_delay: float = 0.0):
+        self._chunks = chunks
+        self._first_token_delay = first_token_delay
+        self._token_delay = token_delay
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def __iter__(self) -> Iterator["FakeChunk"]:
+        for i, chunk in enumerate(self._chunks):
+            time.sleep(self._first_token_delay if i == 0 else self._token_delay)
+            yield FakeChunk(chunk)
+
+
+class AsyncFakeResponse(FakeResponse):
+    """Async-iterable variant returned by generate_content_async(stream=True)"""
+
+    async def __aiter__(self) -> AsyncIterator["FakeChunk"]:
+        for i, chunk in enumerate(self._chunks):
+            await asyncio.sleep(self._first_token_delay if i == 0 else self._token_delay)
+            yield FakeChunk(chunk)
+
+
+class FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Deterministic, offline stand-in for genai.GenerativeModel.
+
+    The answer is derived from a hash of the prompt, so identical prompts always
+    get identical answers. Delays are configurable so time-to-first-token and
+    total latency can be measured without network access.
+    """
+
+    WORDS = (
+        "Under the tenancy agreement your landlord must keep the property safe "
+        "and free from hazards, protect your deposit in a government approved "
+        "scheme and give proper notice before ending the tenancy. Report any "
+        "repairs in writing and keep copies of all correspondence."
+    ).split()
+
+    def __init__(
+        self,
+        first_token_delay: float = 0.2,
+        token_delay: float = 0.02,
+        response_words: int = 40
+    ):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.response_words = response_words
+
+    def _chunks(self, prompt: str) -> List[str]:
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        offset = seed % len(self.WORDS)
+        words = [self.WORDS[(offset + i) % len(self.WORDS)] for i in range(self.response_words)]
+        return [word + " " for word in words[:-1]] + [words[-1] + "."]
+
+    def generate_content(self, prompt: str, stream: bool = False) -> FakeResponse:
+        chunks = self._chunks(prompt)
+        if stream:
+            return FakeResponse(chunks, self.first_token_delay, self.token_delay)
+        time.sleep(self.first_token_delay + self.token_delay * (len(chunks) - 1))
+        return FakeResponse(chunks)
+
+    async def generate_content_async(self, prompt: str, stream: bool = False) -> FakeResponse:
+        chunks = self._chunks(prompt)
+        if stream:
+            return AsyncFakeResponse(chunks, self.first_token_delay, self.token_delay)
+        await asyncio.sleep(self.first_token_delay + self.token_delay * (len(chunks) - 1))
+        return FakeResponse(chunks)
+
+
+def create_fake_model_from_env() -> FakeGenerativeModel:
+    """Build a FakeGenerativeModel configured by FAKE_LLM_* environment variables"""
+    return FakeGenerativeModel(
+        first_token_delay=float(os.environ.get("FAKE_LLM_FIRST_TOKEN_DELAY", 0.2)),
+        token_delay=float(os.environ.get("FAKE_LLM_TOKEN_DELAY", 0.02)),
+        response_words=int(os.environ.get("FAKE_LLM_RESPONSE_WORDS", 40))
+    )
@@ -0,0 +1,129 @@
+"""Run independent request stages concurrently, each under its own deadline.
+
+An image request needs both BLIP's analysis of the photo and a RAG lookup of
+the question; neither depends on the other, so the router starts both at once
+and waits at most a per-stage timeout for each. A late or failing optional
+stage is dropped from the context instead of failing the request.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Executor, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Awaitable, Callable, Deque, Dict
+
+from observability import summarize
+from worker_pools import PoolSaturatedError
+
+logger = logging.getLogger(__name__)
+
+
+def _timed(fn: Callable, *args) -> tuple:
+    started = time.perf_counter()
+    return fn(*args), (time.perf_counter() - started) * 1000
+
+
+def submit_stage(executor: Executor, fn: Callable, *args) -> Future:
+    """Start a stage on the executor; its Future resolves to (value, elapsed_ms)"""
+    return executor.submit(contextvars.copy_context().run, _timed, fn, *args)
+
+
+def wait_stage(future: Future, deadline: float, critical: bool = False) -> dict:
+    """Wait for a stage until ``deadline`` (a perf_counter time).
+
+    Returns {"status": ok | timeout | error, "value", "ms"}. A stage that times
+    out keeps running in the background and its result is discarded. Errors
+    degrade the stage too, unless it is ``critical``, in which case they raise.
+    """
+    try:
+        value, elapsed_ms = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+        return {"status": "ok", "value": value, "ms": elapsed_ms}
+    except FutureTimeoutError:
+        return {"status": "timeout", "value": None, "ms": None}
+    except Exception as e:
+        if critical:
+            raise
+        logger.warning("Stage failed: %s", e)
+        return {"status": "error", "value": None, "ms": None}
+
+
+async def run_stage_async(awaitable: Awaitable, timeout: float, critical: bool = False) -> dict:
+    """Async counterpart of wait_stage for work awaited on a BoundedExecutor.
+
+    A full pool degrades the stage (status ``saturated``) unless it is
+    ``critical``; then PoolSaturatedError propagates and the server answers 503.
+    """
+    started = time.perf_counter()
+    try:
+        value = await asyncio.wait_for(awaitable, timeout)
+        return {"status": "ok", "value": value, "ms": (time.perf_counter() - started) * 1000}
+    except asyncio.TimeoutError:
+        return {"status": "timeout", "value": None, "ms": None}
+    except PoolSaturatedError:
+        if critical:
+            raise
+        return {"status": "saturated", "value": None, "ms": None}
+    except Exception as e:
+        if critical:
+            raise
+        logger.warning("Stage failed: %s", e)
+        return {"status": "error", "value": None, "ms": None}
+
+
+def stage_timings(stages: Dict[str, dict], wall_ms: float) -> dict:
+    """Per-request summary: each stage's status and duration, and what overlapping them saved"""
+    sequential_ms = sum(stage["ms"] or 0.0 for stage in stages.values())
+    return {
+        "stages": {name: {"status": stage["status"], "ms": stage["ms"]} for name, stage in stages.items()},
+        "wall_ms": wall_ms,
+        "sequential_ms": sequential_ms,
+        "overlap_saved_ms": max(0.0, sequential_ms - wall_ms),
+    }
+
+
+class FanoutStats:
+    """Rolling per-stage latencies and outcomes of fanned-out requests"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._stage_ms: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self._stage_status: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._wall_ms: Deque[float] = deque(maxlen=window)
+        self._saved_ms: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+
+    def record(self, timings: dict) -> None:
+        with self._lock:
+            self.requests += 1
+            self._wall_ms.append(timings["wall_ms"])
+            self._saved_ms.append(timings["overlap_saved_ms"])
+            for name, stage in timings["stages"].items():
+                self._stage_status[name][stage["status"]] += 1
+                if stage["ms"] is not None:
+                    self._stage_ms[name].append(stage["ms"])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "wall_ms": summarize(self._wall_ms),
+                "overlap_saved_ms": summarize(self._saved_ms),
+                "stages": {
+                    name: {"ms": summarize(self._stage_ms[name]), "status": dict(statuses)}
+                    for name, statuses in self._stage_status.items()
+                },
+            }
+
+
+def fanout_settings_from_env() -> dict:
+    """AgentRouter fan-out settings from ROUTER_* variables"""
+    return {
+        "image_timeout_seconds": float(os.environ.get("ROUTER_IMAGE_TIMEOUT_SECONDS", 30)),
+        "retrieval_timeout_seconds": float(os.environ.get("ROUTER_RETRIEVAL_TIMEOUT_SECONDS", 5)),
+        "caption_reretrieval": os.environ.get("ROUTER_CAPTION_RERETRIEVAL", "0").lower() in ("1", "true", "yes"),
+        "fanout_workers": int(os.environ.get("ROUTER_FANOUT_WORKERS", 8)),
+    }
@@ -1,82 +1,187 @@
 # ⬅️ Import modules
 from PIL import Image
-import torch
-from transformers import BlipProcessor, BlipForConditionalGeneration
-import base64
-import io
+import logging
+import os
+import time
 from pathlib import Path
-from typing import Union
+from typing import List, Union
+
+from batching import MicroBatchScheduler
+from blip_backends import caption_with, create_blip_backend_from_env
+from image_cache import content_hash, create_image_cache_from_env, perceptual_hash
+from image_upload import (
+    UploadMetrics, check_upload_size, decode_image, image_bytes_from_base64, max_upload_bytes_from_env
+)
+from issue_matcher import create_issue_matcher_from_env
+from model_registry import EMBEDDING_MODEL_NAME
+from observability import record_cache_lookup, span
+
+logger = logging.getLogger(__name__)
+
+CAPTION_MODEL_NAME = "Salesforce/blip-image-captioning-base"
+
+
+def _default_device() -> str:
+    # torch is only imported for the real BLIP backends; the stub runs without it
+    if os.environ.get("BLIP_BACKEND", "fp32").lower() == "stub":
+        return "cpu"
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
 
 class PropertyIssueDetectionAgent:
-    def __init__(self):
-        print("Initializing Property Issue Detection Agent...")
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"Using device: {self.device}")
-        
-        print("Loading BLIP model...")
-        self.processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-        self.model = BlipForConditionalGeneration.from_pretrained(
-            "Salesforce/blip-image-captioning-base"
-        ).to(self.device)
-        print("Property Issue Detection Agent initialized successfully")
-
-    def analyze_image(self, image_data: str, user_query: str) -> dict:
+    def __init__(self, max_batch_size: int = None, batch_window_ms: float = None, embeddings=None):
+        logger.info("Initializing Property Issue Detection Agent...")
+        self.device = _default_device()
+        logger.info("Using device: %s", self.device)
+
+        logger.info("Loading BLIP model...")
+        # BLIP_BACKEND picks fp32, int8 (dynamic quantization), onnx (ONNX Runtime)
+        # or stub (no model, for offline load tests)
+        self.backend = create_blip_backend_from_env(CAPTION_MODEL_NAME, self.device)
+        logger.info("Using BLIP backend: %s (max %d new tokens)", self.backend.name, self.backend.max_new_tokens)
+        self.processor = None
+        self.input_size = 384
+        if self.backend.name != "stub":
+            from transformers import BlipProcessor
+
+            self.processor = BlipProcessor.from_pretrained(CAPTION_MODEL_NAME)
+            # Images are decoded straight to the processor's input resolution
+            size = self.processor.image_processor.size
+            self.input_size = min(size.get("height", 384), size.get("width", 384))
+        self.max_upload_bytes = max_upload_bytes_from_env()
+        self.upload_metrics = UploadMetrics()
+        # Issues are matched by embedding similarity to the phrases in
+        # issue_taxonomy.json; share the RAG system's MiniLM model when given it
+        if embeddings is None:
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+
+            embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+        self.issue_matcher = create_issue_matcher_from_env(embeddings)
+        logger.info("Loaded issue taxonomy %s (%d issue types)", self.issue_matcher.version, len(self.issue_matcher.issues))
+
+        # Re-sent photos reuse their earlier caption and issues
+        self.analysis_cache = create_image_cache_from_env(self.analysis_version)
+
+        # Concurrent analyze_image calls are captioned together in one generate call.
+        # BLIP_MAX_BATCH_SIZE=1 disables batching.
+        if max_batch_size is None:
+            max_batch_size = int(os.environ.get("BLIP_MAX_BATCH_SIZE", 8))
+        if batch_window_ms is None:
+            batch_window_ms = float(os.environ.get("BLIP_BATCH_WINDOW_MS", 10))
+        self.batch_scheduler = None
+        if max_batch_size > 1:
+            self.batch_scheduler = MicroBatchScheduler(
+                self.caption_images,
+                max_batch_size=max_batch_size,
+                max_wait_ms=batch_window_ms,
+                name="blip"
+            )
+        logger.info("Property Issue Detection Agent initialized successfully")
+
+    def _image_bytes(self, image_data: Union[bytes, str, Path]) -> bytes:
+        """Raw image bytes from an upload, a base64 string (optionally a data URL) or a path"""
+        if isinstance(image_data, str):
+            image_data = image_bytes_from_base64(image_data)
+        elif isinstance(image_data, Path):
+            image_data = image_data.read_bytes()
+        elif not isinstance(image_data, bytes):
+            raise ValueError("Unsupported image format")
+        check_upload_size(len(image_data), self.max_upload_bytes)
+        return image_data
+
+    def _load_image(self, image_bytes: bytes) -> Image.Image:
+        """Decode image bytes straight to the processor's input resolution"""
+        with span("image.decode"):
+            image, info = decode_image(image_bytes, self.input_size)
+        self.upload_metrics.record(info)
+        logger.debug("Image decoded: %d bytes, %s -> %s, %.1f ms, peak ~%.1f MB", info["upload_bytes"],
+                     info["original_size"], info["final_size"], info["decode_ms"], info["peak_bytes"] / 1e6)
+        return image
+
+    def analysis_version(self) -> str:
+        """Identifies what produced an analysis; cached analyses from other versions are ignored"""
+        # Quantized and ONNX backends can word captions slightly differently
+        return (f"{CAPTION_MODEL_NAME}:{self.backend.name}:{self.backend.max_new_tokens}"
+                f":taxonomy-{self.issue_matcher.version}")
+
+    def caption_images(self, images: List[Image.Image]) -> List[str]:
+        """Caption a batch of images with a single BLIP generate call"""
+        with span("image.caption_batch"):
+            return caption_with(self.backend, self.processor, images)
+
+    def _detect_issues(self, caption: str) -> List[dict]:
+        """Match the caption against the issue taxonomy"""
+        with span("image.issues"):
+            return self.issue_matcher.match(caption)
+
+    def analyze_image(self, image_data: Union[bytes, str, Path], user_query: str) -> dict:
         """Analyze image and return caption and detected issues"""
         try:
-            # Decode base64 image
-            if isinstance(image_data, str):
-                if "base64," in image_data:
-                    image_data = image_data.split("base64,")[1]
-                image_bytes = base64.b64decode(image_data)
-                image = Image.open(io.BytesIO(image_bytes))
-            elif isinstance(image_data, (str, Path)):
-                image = Image.open(image_data)
-            else:
-                raise ValueError("Unsupported image format")
-
-            # Process with BLIP
-            inputs = self.processor(images=image, return_tensors="pt").to(self.device)
-            outputs = self.model.generate(**inputs)
-            caption = self.processor.decode(outputs[0], skip_special_tokens=True)
-            
-            # Extract potential issues from the caption
-            detected_issues = []
-            if 'mold' in caption.lower():
-                detected_issues.append({
-                    'issue': 'Mold detected',
-                    'severity': 'High',
-                    'description': 'Presence of mold indicates potential health hazard and moisture problems'
-                })
-            if 'damage' in caption.lower():
-                detected_issues.append({
-                    'issue': 'Structural damage',
-                    'severity': 'High',
-                    'description': 'Visible damage that may require immediate attention'
-                })
-            if 'crack' in caption.lower():
-                detected_issues.append({
-                    'issue': 'Cracks present',
-                    'severity': 'High',
-                    'description': 'Cracks may indicate structural issues or settling'
-                })
-            
-            return {
-                "description": caption,
-                "detected_issues": detected_issues
-            }
-
+            with span("image.analyze"):
+                return self._analyze_image(image_data)
         except Exception as e:
-            print(f"Error processing image: {e}")
+            logger.error("Error processing image: %s", e)
             raise
 
+    def _analyze_image(self, image_data: Union[bytes, str, Path]) -> dict:
+        image_bytes = self._image_bytes(image_data)
+        sha256 = None
+        if self.analysis_cache is not None:
+            # Exact re-uploads are answered before the image is even decoded
+            sha256 = content_hash(image_bytes)
+            cached = self.analysis_cache.lookup(sha256)
+            if cached is not None or not self.analysis_cache.perceptual:
+                record_cache_lookup("image_analysis", cached is not None)
+            if cached is not None:
+                return cached
+
+        started = time.perf_counter()
+        image = self._load_image(image_bytes)
+        phash = None
+        if self.analysis_cache is not None and self.analysis_cache.perceptual:
+            phash = perceptual_hash(image)
+            cached = self.analysis_cache.lookup_similar(sha256, phash)
+            record_cache_lookup("image_analysis", cached is not None)
+            if cached is not None:
+                return cached
+
+        # Process with BLIP, batched with any other pending images
+        with span("image.caption"):
+            if self.batch_scheduler is not None:
+                caption = self.batch_scheduler.process(image)
+            else:
+                caption = self.caption_images([image])[0]
+
+        result = {
+            "description": caption,
+            "detected_issues": self._detect_issues(caption)
+        }
+        if self.analysis_cache is not None:
+            self.analysis_cache.store(sha256, result, (time.perf_counter() - started) * 1000, phash)
+        return result
+
+    def batching_stats(self) -> dict:
+        """Queue depth, batch-size histogram and wait times of the BLIP batcher"""
+        if self.batch_scheduler is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.batch_scheduler.stats()}
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the image analysis cache"""
+        if self.analysis_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.analysis_cache.stats()}
+
+    def upload_stats(self) -> dict:
+        """Upload size, decode time and peak decode memory per image"""
+        return {"max_upload_bytes": self.max_upload_bytes, **self.upload_metrics.stats()}
+
 if __name__ == "__main__":
     agent = PropertyIssueDetectionAgent()
-    result = agent.analyze_image("moldup.jpeg")
+    result = agent.analyze_image(Path("moldup.jpeg"), "")
 
     print("\n--- Results ---")
     print("Description:", result["description"])
     print("Detected issues:", result["detected_issues"])
-
-
-
-
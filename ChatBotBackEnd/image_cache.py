@@ -0,0 +1,196 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from PIL import Image
+
+from retrieval_cache import SQLiteCacheBackend
+
+
+def content_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = 8) -> int:
+    """64-bit difference hash: sign of horizontal gradients on a tiny grayscale copy.
+
+    Re-encoding, resizing or mild recompression of a photo changes only a few
+    bits, so near-identical uploads are a small Hamming distance apart.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class ImageAnalysisCache:
+    """Caption + detected issues keyed by image content, with LRU and TTL eviction.
+
+    Entries are keyed by the SHA-256 of the uploaded bytes. With
+    ``perceptual=True``, a miss on the exact hash falls back to the nearest
+    cached perceptual hash within ``max_distance`` bits, so a re-saved or
+    resized copy of the same photo also hits. Every key includes
+    ``version_fn()`` (captioning model + issue taxonomy), so a model or
+    taxonomy change never serves an analysis made by the old one.
+
+    The optional SQLite backend persists exact-hash entries; perceptual
+    matching only scans entries held in memory.
+    """
+
+    def __init__(
+        self,
+        version_fn: Callable[[], str],
+        max_entries: int = 512,
+        ttl_seconds: Optional[float] = 24 * 3600,
+        backend: Optional[SQLiteCacheBackend] = None,
+        perceptual: bool = False,
+        max_distance: int = 4,
+        clock: Callable[[], float] = time.time
+    ):
+        self.version_fn = version_fn
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.perceptual = perceptual
+        self.max_distance = max_distance
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> entry ({"analysis", "phash", "created", "analysis_ms"}); oldest access first
+        self._entries = OrderedDict()
+        self._version = None
+        self._counters = {
+            "hits": 0,
+            "perceptual_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "invalidated": 0,
+            "evicted": 0,
+        }
+        self._latency_saved_ms = 0.0
+
+    def _key(self, sha256: str) -> str:
+        return f"{self._version}:{sha256}"
+
+    def _check_version_locked(self) -> None:
+        version = self.version_fn()
+        if version != self._version:
+            # Disk entries stay, but are keyed by the old version and never match
+            self._counters["invalidated"] += len(self._entries)
+            self._entries.clear()
+            self._version = version
+
+    def _is_expired(self, entry: dict, now: float) -> bool:
+        return self.ttl_seconds is not None and now - entry["created"] > self.ttl_seconds
+
+    def _hit_locked(self, key: str, entry: dict, counter: str) -> dict:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._counters[counter] += 1
+        self._latency_saved_ms += entry["analysis_ms"]
+        return entry["analysis"]
+
+    def lookup(self, sha256: str) -> Optional[dict]:
+        """Return the cached analysis for an exact content hash, or None"""
+        with self._lock:
+            self._check_version_locked()
+            key = self._key(sha256)
+            entry = self._entries.get(key)
+            now = self._clock()
+            if entry is not None:
+                if not self._is_expired(entry, now):
+                    return self._hit_locked(key, entry, "hits")
+                del self._entries[key]
+                self._counters["expired"] += 1
+
+        entry = self.backend.get("image_analysis", key) if self.backend else None
+        with self._lock:
+            if entry is not None and not self._is_expired(entry, now):
+                analysis = self._hit_locked(key, entry, "disk_hits")
+                self._evict_locked()
+                return analysis
+            if not self.perceptual:
+                self._counters["misses"] += 1
+        return None
+
+    def lookup_similar(self, sha256: str, phash: int) -> Optional[dict]:
+        """Return the analysis of the closest near-duplicate image, or None.
+
+        Call after ``lookup`` missed; a hit is also stored under ``sha256``.
+        """
+        with self._lock:
+            self._check_version_locked()
+            now = self._clock()
+            best_key, best_distance = None, self.max_distance + 1
+            for key, entry in self._entries.items():
+                if entry["phash"] is None or self._is_expired(entry, now):
+                    continue
+                distance = hamming_distance(phash, entry["phash"])
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                self._counters["misses"] += 1
+                return None
+            entry = self._entries[best_key]
+            self._entries.move_to_end(best_key)
+            analysis = self._hit_locked(self._key(sha256), dict(entry), "perceptual_hits")
+            self._evict_locked()
+            return analysis
+
+    def store(self, sha256: str, analysis: dict, analysis_ms: float, phash: Optional[int] = None) -> None:
+        entry = {"analysis": analysis, "phash": phash, "created": self._clock(), "analysis_ms": analysis_ms}
+        with self._lock:
+            self._check_version_locked()
+            key = self._key(sha256)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict_locked()
+        if self.backend:
+            self.backend.put("image_analysis", key, entry)
+
+    def _evict_locked(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evicted"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self._counters["hits"] + self._counters["perceptual_hits"] + self._counters["disk_hits"]
+            lookups = hits + self._counters["misses"]
+            return {
+                "version": self._version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "perceptual": self.perceptual,
+                **self._counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "latency_saved_ms": self._latency_saved_ms,
+            }
+
+
+def create_image_cache_from_env(version_fn: Callable[[], str]) -> Optional[ImageAnalysisCache]:
+    """ImageAnalysisCache configured by IMAGE_CACHE_* variables, or None if disabled"""
+    if os.environ.get("IMAGE_CACHE_ENABLED", "1").lower() in ("0", "false", "no"):
+        return None
+    cache_path = os.environ.get("IMAGE_CACHE_PATH")
+    ttl_seconds = float(os.environ.get("IMAGE_CACHE_TTL_SECONDS", 24 * 3600))
+    return ImageAnalysisCache(
+        version_fn,
+        max_entries=int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", 512)),
+        ttl_seconds=ttl_seconds or None,
+        backend=SQLiteCacheBackend(cache_path) if cache_path else None,
+        perceptual=os.environ.get("IMAGE_CACHE_PERCEPTUAL", "0").lower() in ("1", "true", "yes"),
+        max_distance=int(os.environ.get("IMAGE_CACHE_PHASH_DISTANCE", 4))
+    )
@@ -0,0 +1,123 @@
+import base64
+import io
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Tuple, Union
+
+from PIL import Image
+
+from observability import summarize
+
+DEFAULT_MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an uploaded image exceeds the configured size limit"""
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"Image is {size} bytes, the limit is {limit} bytes")
+        self.size = size
+        self.limit = limit
+
+
+def max_upload_bytes_from_env() -> int:
+    return int(os.environ.get("IMAGE_MAX_UPLOAD_BYTES", DEFAULT_MAX_UPLOAD_BYTES))
+
+
+def check_upload_size(size: int, limit: int) -> None:
+    if size > limit:
+        raise ImageTooLargeError(size, limit)
+
+
+def base64_decoded_size(image_data: str) -> int:
+    """Size of the bytes a base64 string (optionally a data URL) decodes to, without decoding it"""
+    prefix = image_data.find("base64,")
+    start = prefix + len("base64,") if prefix >= 0 else 0
+    return (len(image_data) - start) * 3 // 4
+
+
+def max_request_bytes(max_upload_bytes: int) -> int:
+    """Request body limit that admits a base64-encoded image of the maximum size plus form fields"""
+    return max_upload_bytes * 4 // 3 + 64 * 1024
+
+
+def image_bytes_from_base64(image_data: str) -> bytes:
+    """Decode a base64 string, optionally a data URL"""
+    if "base64," in image_data:
+        image_data = image_data.split("base64,", 1)[1]
+    return base64.b64decode(image_data)
+
+
+def decode_image(source: Union[bytes, str, Path], target_size: int) -> Tuple[Image.Image, dict]:
+    """Decode an image, reduced as early as possible to what the model needs.
+
+    JPEGs are decoded in draft mode, which lets libjpeg scale by 1/2, 1/4 or
+    1/8 while decoding, so a 12 MP phone photo never exists at full size.
+    The result is then resized so its shorter side is ``target_size``. The
+    model's processor resizes to a square of that size, so neither side is
+    ever upscaled afterwards.
+
+    Returns the RGB image and decode metrics. ``peak_bytes`` estimates the
+    decode's peak memory as the encoded bytes plus the largest bitmap held.
+    """
+    started = time.perf_counter()
+    if isinstance(source, bytes):
+        upload_bytes = len(source)
+        image = Image.open(io.BytesIO(source))
+    else:
+        upload_bytes = os.path.getsize(source)
+        image = Image.open(source)
+    original_size = image.size
+
+    # Only JPEG (and a few others) support draft; a no-op elsewhere
+    image.draft("RGB", (target_size, target_size))
+    image = image.convert("RGB")
+    decoded_size = image.size
+    peak_bitmap = decoded_size[0] * decoded_size[1] * 3
+
+    scale = target_size / min(decoded_size)
+    if scale < 1:
+        image = image.resize(
+            (max(target_size, round(decoded_size[0] * scale)), max(target_size, round(decoded_size[1] * scale))),
+            Image.BICUBIC,
+            reducing_gap=2.0
+        )
+
+    return image, {
+        "upload_bytes": upload_bytes,
+        "original_size": list(original_size),
+        "decoded_size": list(decoded_size),
+        "final_size": list(image.size),
+        "decode_ms": (time.perf_counter() - started) * 1000,
+        "peak_bytes": upload_bytes + peak_bitmap,
+    }
+
+
+class UploadMetrics:
+    """Rolling per-request upload size, decode time and peak decode memory"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._records: Deque[dict] = deque(maxlen=window)
+        self.images = 0
+
+    def record(self, info: dict) -> None:
+        with self._lock:
+            self._records.append(info)
+            self.images += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            records = list(self._records)
+            images = self.images
+
+        return {
+            "images": images,
+            "upload_bytes": summarize(record["upload_bytes"] for record in records),
+            "decode_ms": summarize(record["decode_ms"] for record in records),
+            "peak_bytes": summarize(record["peak_bytes"] for record in records),
+            "last": records[-1] if records else None,
+        }
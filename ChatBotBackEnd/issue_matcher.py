@@ -0,0 +1,153 @@
+"""Match image captions to the property-issue taxonomy in issue_taxonomy.json.
+
+Every example phrase is embedded once at startup with the MiniLM model. A
+caption is embedded and compared with all phrases in one matrix multiply; an
+issue is detected when its best phrase scores at least the issue's threshold.
+Adding issue types is a config change, and matching stays one matmul however
+many there are.
+
+    python issue_matcher.py "a bathroom ceiling covered in black mold"
+    python issue_matcher.py --benchmark-labels 500
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_TAXONOMY_PATH = "issue_taxonomy.json"
+
+
+def load_taxonomy(path: str = DEFAULT_TAXONOMY_PATH) -> dict:
+    with open(path, encoding="utf-8") as f:
+        taxonomy = json.load(f)
+    for issue in taxonomy["issues"]:
+        if not issue.get("phrases"):
+            raise ValueError(f"Issue '{issue['id']}' in {path} has no example phrases")
+    return taxonomy
+
+
+def taxonomy_version(taxonomy: dict) -> str:
+    """Content hash of the taxonomy, so any edit invalidates cached analyses"""
+    canonical = json.dumps(taxonomy, sort_keys=True).encode("utf-8")
+    return f"{taxonomy.get('version', 0)}-{hashlib.sha256(canonical).hexdigest()[:12]}"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class IssueTaxonomyMatcher:
+    """Scores captions against every issue's example phrases by cosine similarity"""
+
+    def __init__(self, taxonomy: dict, embeddings, phrase_vectors: Optional[np.ndarray] = None):
+        self.taxonomy = taxonomy
+        self.embeddings = embeddings
+        self.version = taxonomy_version(taxonomy)
+        self.issues = taxonomy["issues"]
+        default_threshold = taxonomy.get("default_threshold", 0.5)
+        self.thresholds = np.asarray(
+            [issue.get("threshold", default_threshold) for issue in self.issues], dtype="float32"
+        )
+
+        # Phrases are laid out issue by issue, so each issue's scores are a
+        # contiguous slice that np.maximum.reduceat can collapse
+        phrases = [phrase for issue in self.issues for phrase in issue["phrases"]]
+        self._issue_starts = np.cumsum([0] + [len(issue["phrases"]) for issue in self.issues[:-1]])
+        if not self.issues:
+            # reduceat needs at least one slice; with no issues nothing can match
+            self._phrase_vectors = None
+            return
+        if phrase_vectors is None:
+            phrase_vectors = np.asarray(embeddings.embed_documents(phrases), dtype="float32")
+        self._phrase_vectors = _normalize(phrase_vectors)
+
+    @classmethod
+    def from_path(cls, embeddings, path: str = DEFAULT_TAXONOMY_PATH) -> "IssueTaxonomyMatcher":
+        return cls(load_taxonomy(path), embeddings)
+
+    def scores(self, captions: Sequence[str]) -> np.ndarray:
+        """(captions x issues) matrix of each issue's best phrase similarity"""
+        if self._phrase_vectors is None:
+            return np.zeros((len(captions), 0), dtype="float32")
+        caption_vectors = _normalize(np.asarray(self.embeddings.embed_documents(list(captions)), dtype="float32"))
+        similarities = caption_vectors @ self._phrase_vectors.T
+        return np.maximum.reduceat(similarities, self._issue_starts, axis=1)
+
+    def match_many(self, captions: Sequence[str]) -> List[List[dict]]:
+        """Detected issues per caption, strongest first"""
+        if not captions:
+            return []
+        results = []
+        for row in self.scores(captions):
+            detected = np.flatnonzero(row >= self.thresholds)
+            detected = detected[np.argsort(-row[detected])]
+            results.append([
+                {
+                    "issue": self.issues[i]["issue"],
+                    "severity": self.issues[i]["severity"],
+                    "description": self.issues[i]["description"],
+                    "confidence": round(float(row[i]), 3),
+                }
+                for i in detected
+            ])
+        return results
+
+    def match(self, caption: str) -> List[dict]:
+        return self.match_many([caption])[0]
+
+
+def create_issue_matcher_from_env(embeddings) -> IssueTaxonomyMatcher:
+    """Matcher over the taxonomy at ISSUE_TAXONOMY_PATH"""
+    return IssueTaxonomyMatcher.from_path(embeddings, os.environ.get("ISSUE_TAXONOMY_PATH", DEFAULT_TAXONOMY_PATH))
+
+
+def _benchmark(embeddings, label_counts: List[int], phrases_per_label: int = 5, repeats: int = 200) -> None:
+    """Time matching one pre-embedded caption against taxonomies of growing size"""
+    dim = len(embeddings.embed_query("dimension probe"))
+    rng = np.random.default_rng(0)
+    caption = rng.standard_normal((1, dim)).astype("float32")
+
+    class _Fixed:
+        def embed_documents(self, texts):
+            return caption
+
+    for count in label_counts:
+        taxonomy = {"issues": [
+            {"id": str(i), "issue": str(i), "severity": "Low", "description": "", "phrases": [""] * phrases_per_label}
+            for i in range(count)
+        ]}
+        vectors = rng.standard_normal((count * phrases_per_label, dim)).astype("float32")
+        matcher = IssueTaxonomyMatcher(taxonomy, _Fixed(), phrase_vectors=vectors)
+        started = time.perf_counter()
+        for _ in range(repeats):
+            matcher.match("")
+        print(f"{count:>6} issues ({count * phrases_per_label} phrases): "
+              f"{(time.perf_counter() - started) / repeats * 1000:.3f} ms per caption")
+
+
+if __name__ == "__main__":
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from model_registry import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Score captions against the issue taxonomy")
+    parser.add_argument("captions", nargs="*")
+    parser.add_argument("--taxonomy", default=DEFAULT_TAXONOMY_PATH)
+    parser.add_argument("--benchmark-labels", type=int, nargs="*", default=None, metavar="N",
+                        help="Time matching against synthetic taxonomies of N issues (excludes caption embedding)")
+    args = parser.parse_args()
+
+    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    if args.benchmark_labels is not None:
+        _benchmark(embeddings, args.benchmark_labels or [10, 100, 500, 1000])
+    if args.captions:
+        matcher = IssueTaxonomyMatcher.from_path(embeddings, args.taxonomy)
+        for caption, row in zip(args.captions, matcher.scores(args.captions)):
+            print(f"\n{caption}")
+            for i in np.argsort(-row):
+                marker = "*" if row[i] >= matcher.thresholds[i] else " "
+                print(f"  {marker} {row[i]:.3f} (threshold {matcher.thresholds[i]:.2f})  {matcher.issues[i]['id']}")
@@ -0,0 +1,156 @@
+"""In-process BM25 inverted index over the chunks of a vector store.
+
+Postings are stored in CSR form, so the index is a handful of flat numpy
+arrays: ``offsets[t]:offsets[t + 1]`` slices ``doc_ids`` / ``term_freqs`` for
+term ``t``. Doc ids are index positions, the same ids the FAISS index returns,
+so lexical and vector hits can be fused without a lookup table.
+
+The arrays are saved as .npy files next to the FAISS index and memory-mapped
+at load time, like the index itself.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+VOCAB_FILE = "lexical_vocab.json"
+ARRAY_FILES = ("offsets", "doc_ids", "term_freqs", "doc_lengths")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Kept short on purpose: words like "notice" or "section" carry meaning here
+STOPWORDS = frozenset(
+    "a an and are as at be by can do for from has have if in is it its of on or "
+    "that the their this to was were will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric tokens, so "Section 21" -> ["section", "21"]"""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _array_path(vector_store_path: str, name: str) -> str:
+    return os.path.join(vector_store_path, f"lexical_{name}.npy")
+
+
+def has_lexical_index(vector_store_path: str) -> bool:
+    return os.path.exists(os.path.join(vector_store_path, VOCAB_FILE))
+
+
+class BM25Index:
+    """Okapi BM25 over CSR postings, scored with numpy per query term"""
+
+    def __init__(self, vocab: Sequence[str], offsets: np.ndarray, doc_ids: np.ndarray,
+                 term_freqs: np.ndarray, doc_lengths: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.vocab = list(vocab)
+        self.term_ids: Dict[str, int] = {term: i for i, term in enumerate(self.vocab)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(doc_lengths)
+        avg_length = float(doc_lengths.mean()) if self.num_docs else 1.0
+        # The length-normalisation term only depends on the document, so compute it once
+        self._length_norm = (k1 * (1 - b + b * doc_lengths / max(avg_length, 1e-9))).astype("float32")
+
+    @classmethod
+    def build(cls, texts: Iterable[str], **kwargs) -> "BM25Index":
+        """Build the index; the i-th text gets doc id i"""
+        term_ids: Dict[str, int] = {}
+        postings_terms: List[int] = []
+        postings_docs: List[int] = []
+        postings_freqs: List[int] = []
+        doc_lengths: List[int] = []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                postings_terms.append(term_ids.setdefault(term, len(term_ids)))
+                postings_docs.append(doc_id)
+                postings_freqs.append(freq)
+
+        terms = np.asarray(postings_terms, dtype="int64")
+        # Stable sort keeps each term's postings in ascending doc order
+        order = np.argsort(terms, kind="stable")
+        offsets = np.zeros(len(term_ids) + 1, dtype="int64")
+        np.cumsum(np.bincount(terms, minlength=len(term_ids)), out=offsets[1:])
+        return cls(
+            vocab=list(term_ids),
+            offsets=offsets,
+            doc_ids=np.asarray(postings_docs, dtype="int32")[order],
+            term_freqs=np.asarray(postings_freqs, dtype="float32")[order],
+            doc_lengths=np.asarray(doc_lengths, dtype="float32"),
+            **kwargs
+        )
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for a query"""
+        scores = np.zeros(self.num_docs, dtype="float32")
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:stop]
+            freqs = self.term_freqs[start:stop]
+            df = stop - start
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            # Each doc appears once per term's postings, so plain fancy-index += is safe
+            scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + self._length_norm[docs])
+        return scores
+
+    def search(self, query: str, k: int) -> List[int]:
+        """Doc ids of the top-k documents with a non-zero score, best first"""
+        scores = self.scores(query)
+        k = min(k, self.num_docs)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [int(doc_id) for doc_id in top if scores[doc_id] > 0]
+
+    def memory_bytes(self) -> int:
+        return int(sum(getattr(self, name).nbytes for name in ARRAY_FILES))
+
+    def save(self, vector_store_path: str) -> None:
+        os.makedirs(vector_store_path, exist_ok=True)
+        for name in ARRAY_FILES:
+            np.save(_array_path(vector_store_path, name), np.asarray(getattr(self, name)))
+        # The vocabulary is written last: its presence marks a complete index
+        with open(os.path.join(vector_store_path, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f)
+
+    @classmethod
+    def load(cls, vector_store_path: str, mmap: bool = True, **kwargs) -> "BM25Index":
+        with open(os.path.join(vector_store_path, VOCAB_FILE), encoding="utf-8") as f:
+            vocab = json.load(f)
+        arrays = {
+            name: np.load(_array_path(vector_store_path, name), mmap_mode="r" if mmap else None)
+            for name in ARRAY_FILES
+        }
+        return cls(vocab, **arrays, **kwargs)
+
+
+def fused_scores(rankings: Sequence[Sequence[int]], weights: Sequence[float], rrf_k: int = 60) -> Dict[int, float]:
+    """Weighted RRF scores: score(d) = sum_i weight_i / (rrf_k + rank_i(d)), ranks from 1"""
+    fused: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        if weight <= 0:
+            continue
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (rrf_k + rank)
+    return fused
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], weights: Sequence[float],
+                           rrf_k: int = 60) -> List[int]:
+    """Fuse ranked id lists by fused_scores, best first"""
+    fused = fused_scores(rankings, weights, rrf_k)
+    # Ties keep the order of first appearance, so the vector ranking wins them
+    return sorted(fused, key=fused.get, reverse=True)
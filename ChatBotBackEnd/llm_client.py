@@ -0,0 +1,525 @@
+"""Provider-agnostic LLM client with deadlines, retries, limits and coalescing.
+
+``LLMClient`` wraps a provider (Gemini, or the offline fake) and adds:
+
+- a deadline per call, covering queueing, every attempt and backoff sleeps
+- retries of transient failures with full-jitter exponential backoff
+- a client-side token-bucket rate limit and a cap on concurrent calls
+- single-flight: concurrent calls with an identical prompt share one
+  provider call and its answer
+
+Providers keep one model object (and so one HTTP/gRPC channel) for the life
+of the process. Streams are retried only until their first chunk arrives,
+and are never coalesced, because every caller consumes its own stream.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional
+
+from fake_llm import FakeGenerativeModel, create_fake_model_from_env
+from observability import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LLM_CALLS = REGISTRY.counter(
+    "chatbot_llm_calls_total", "LLM client calls by provider and outcome (ok, error, deadline)", ("provider", "outcome")
+)
+LLM_RETRIES = REGISTRY.counter("chatbot_llm_retries_total", "Provider attempts that were retried", ("provider",))
+LLM_COALESCED = REGISTRY.counter(
+    "chatbot_llm_coalesced_total", "Calls answered by an identical in-flight call", ("provider",)
+)
+
+# google.api_core exception names worth retrying; matched by name so the
+# client does not import Google's libraries when running the fake provider
+RETRYABLE_ERROR_NAMES = {
+    "ServiceUnavailable", "TooManyRequests", "ResourceExhausted", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "Aborted",
+}
+
+
+class LLMError(Exception):
+    """Base class for errors raised by LLMClient"""
+
+
+class LLMDeadlineExceeded(LLMError):
+    """The call's deadline passed before the provider answered"""
+
+
+class TransientLLMError(LLMError):
+    """A provider failure that is worth retrying"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    return (
+        isinstance(error, (TransientLLMError, TimeoutError, ConnectionError))
+        or type(error).__name__ in RETRYABLE_ERROR_NAMES
+    )
+
+
+class GeminiProvider:
+    """Google Gemini through google.generativeai; one GenerativeModel per process"""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str = "gemini-1.5-flash", api_key: Optional[str] = None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or os.environ["GEMINI_API_KEY"])
+        self.model = genai.GenerativeModel(model_name)
+
+    @staticmethod
+    def _texts(chunks) -> Iterator[str]:
+        for chunk in chunks:
+            # Chunks without text parts (e.g. safety metadata) raise on .text
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        return self.model.generate_content(prompt, request_options={"timeout": timeout}).text
+
+    def stream(self, prompt: str, timeout: float) -> Iterator[str]:
+        return self._texts(self.model.generate_content(prompt, stream=True, request_options={"timeout": timeout}))
+
+    async def generate_async(self, prompt: str, timeout: float) -> str:
+        response = await self.model.generate_content_async(prompt, request_options={"timeout": timeout})
+        return response.text
+
+    async def stream_async(self, prompt: str, timeout: float) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(
+            prompt, stream=True, request_options={"timeout": timeout}
+        )
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+
+class FakeProvider:
+    """Offline provider around FakeGenerativeModel.
+
+    ``failure_rate`` makes that share of calls raise TransientLLMError before
+    answering, to exercise retries without a network.
+    """
+
+    name = "fake"
+
+    def __init__(self, model: Optional[FakeGenerativeModel] = None, failure_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.model = model or create_fake_model_from_env()
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+
+    def _maybe_fail(self) -> None:
+        if self.failure_rate and self._rng.random() < self.failure_rate:
+            raise TransientLLMError("Injected fake LLM failure")
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        self._maybe_fail()
+        return self.model.generate_content(prompt).text
+
+    def stream(self, prompt: str, timeout: float) -> Iterator[str]:
+        self._maybe_fail()
+        return (chunk.text for chunk in self.model.generate_content(prompt, stream=True))
+
+    async def generate_async(self, prompt: str, timeout: float) -> str:
+        self._maybe_fail()
+        return (await self.model.generate_content_async(prompt)).text
+
+    async def stream_async(self, prompt: str, timeout: float) -> AsyncIterator[str]:
+        self._maybe_fail()
+        async for chunk in await self.model.generate_content_async(prompt, stream=True):
+            yield chunk.text
+
+
+class TokenBucket:
+    """Rate limiter allowing ``rate`` calls per second with bursts of ``burst``.
+
+    ``reserve`` takes a token immediately and returns how long the caller must
+    wait before using it, so waiting callers are served in arrival order.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def refund(self) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+
+class LLMClient:
+    def __init__(
+        self,
+        provider,
+        timeout_seconds: float = 30.0,
+        max_retries: int = 3,
+        backoff_base_seconds: float = 0.5,
+        backoff_max_seconds: float = 8.0,
+        rate_per_second: float = 0.0,
+        rate_burst: int = 1,
+        max_concurrency: int = 0,
+        coalesce: bool = True
+    ):
+        self.provider = provider
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.rate_limiter = TokenBucket(rate_per_second, rate_burst) if rate_per_second > 0 else None
+        self.max_concurrency = max_concurrency
+        # Sync calls (Flask threads) and async calls (aiohttp) are limited separately;
+        # a process serves one or the other
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        self._async_slots = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        self.coalesce = coalesce
+        self._in_flight: Dict[str, Future] = {}
+        self._in_flight_async: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "deadline_exceeded": 0,
+        }
+        self._rate_limit_wait_seconds = 0.0
+
+    # -- shared helpers -----------------------------------------------------
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def _deadline(self, timeout: Optional[float]) -> float:
+        return time.monotonic() + (self.timeout_seconds if timeout is None else timeout)
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded("LLM call deadline exceeded")
+        return remaining
+
+    @staticmethod
+    def _deadline_passed(deadline: float) -> bool:
+        # asyncio timers may fire up to one clock tick early
+        return time.monotonic() >= deadline - 0.01
+
+    def _rate_limit_wait(self, deadline: float) -> float:
+        """Seconds to wait for a rate-limit token, or raise if that passes the deadline"""
+        if self.rate_limiter is None:
+            return 0.0
+        wait = self.rate_limiter.reserve()
+        if wait >= deadline - time.monotonic():
+            self.rate_limiter.refund()
+            raise LLMDeadlineExceeded("LLM rate limit wait exceeds the call deadline")
+        with self._lock:
+            self._rate_limit_wait_seconds += wait
+        return wait
+
+    def _backoff(self, attempt: int, error: Exception, deadline: float) -> float:
+        """Full-jitter delay before the next attempt; re-raises when out of retries or time"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            raise error
+        delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt))
+        if delay >= deadline - time.monotonic():
+            raise error
+        self._count("retries")
+        LLM_RETRIES.inc(provider=self.provider.name)
+        logger.warning("LLM attempt %d failed (%s); retrying in %.2fs", attempt + 1, error, delay)
+        return delay
+
+    def _record_outcome(self, error: Optional[BaseException]) -> None:
+        if error is None:
+            outcome = "ok"
+        elif isinstance(error, LLMDeadlineExceeded):
+            outcome = "deadline"
+            self._count("deadline_exceeded")
+        else:
+            outcome = "error"
+            self._count("errors")
+        LLM_CALLS.inc(provider=self.provider.name, outcome=outcome)
+
+    @staticmethod
+    def _key(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    # -- sync ---------------------------------------------------------------
+
+    def _acquire_slot(self, deadline: float) -> None:
+        time.sleep(self._rate_limit_wait(deadline))
+        if self._slots is not None and not self._slots.acquire(timeout=self._remaining(deadline)):
+            raise LLMDeadlineExceeded("Timed out waiting for an LLM concurrency slot")
+
+    def _release_slot(self) -> None:
+        if self._slots is not None:
+            self._slots.release()
+
+    def _call(self, prompt: str, deadline: float) -> str:
+        attempt = 0
+        while True:
+            self._acquire_slot(deadline)
+            try:
+                self._count("attempts")
+                return self.provider.generate(prompt, self._remaining(deadline))
+            except LLMDeadlineExceeded:
+                raise
+            except Exception as e:
+                delay = self._backoff(attempt, e, deadline)
+            finally:
+                self._release_slot()
+            time.sleep(delay)
+            attempt += 1
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """Complete a prompt, retrying transient failures until the deadline"""
+        deadline = self._deadline(timeout)
+        self._count("calls")
+        error = None
+        try:
+            if not self.coalesce:
+                return self._call(prompt, deadline)
+
+            key = self._key(prompt)
+            with self._lock:
+                future = self._in_flight.get(key)
+                leader = future is None
+                if leader:
+                    future = self._in_flight[key] = Future()
+            if not leader:
+                self._count("coalesced")
+                LLM_COALESCED.inc(provider=self.provider.name)
+                try:
+                    return future.result(timeout=self._remaining(deadline))
+                except FutureTimeoutError:
+                    raise LLMDeadlineExceeded("LLM call deadline exceeded") from None
+
+            try:
+                result = self._call(prompt, deadline)
+                future.set_result(result)
+                return result
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._record_outcome(error)
+
+    def stream(self, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        """Yield response chunks; failures before the first chunk are retried"""
+        deadline = self._deadline(timeout)
+        self._count("calls")
+        error = None
+        attempt = 0
+        try:
+            while True:
+                self._acquire_slot(deadline)
+                try:
+                    self._count("attempts")
+                    chunks = iter(self.provider.stream(prompt, self._remaining(deadline)))
+                    first = next(chunks, None)
+                except LLMDeadlineExceeded:
+                    self._release_slot()
+                    raise
+                except Exception as e:
+                    self._release_slot()
+                    delay = self._backoff(attempt, e, deadline)
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+
+                try:
+                    if first is not None:
+                        yield first
+                    yield from chunks
+                finally:
+                    self._release_slot()
+                return
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._record_outcome(error)
+
+    # -- async --------------------------------------------------------------
+
+    async def _acquire_slot_async(self, deadline: float) -> None:
+        await asyncio.sleep(self._rate_limit_wait(deadline))
+        if self._async_slots is not None:
+            try:
+                await asyncio.wait_for(self._async_slots.acquire(), self._remaining(deadline))
+            except asyncio.TimeoutError:
+                raise LLMDeadlineExceeded("Timed out waiting for an LLM concurrency slot") from None
+
+    def _release_slot_async(self) -> None:
+        if self._async_slots is not None:
+            self._async_slots.release()
+
+    async def _call_async(self, prompt: str, deadline: float) -> str:
+        attempt = 0
+        while True:
+            await self._acquire_slot_async(deadline)
+            try:
+                self._count("attempts")
+                remaining = self._remaining(deadline)
+                return await asyncio.wait_for(self.provider.generate_async(prompt, remaining), remaining)
+            except LLMDeadlineExceeded:
+                raise
+            except Exception as e:
+                # asyncio.TimeoutError is the builtin TimeoutError (3.11+), so it
+                # is only our deadline if the deadline has actually passed; a
+                # timeout raised by the provider itself is retried
+                if isinstance(e, asyncio.TimeoutError) and self._deadline_passed(deadline):
+                    raise LLMDeadlineExceeded("LLM call deadline exceeded") from None
+                delay = self._backoff(attempt, e, deadline)
+            finally:
+                self._release_slot_async()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def generate_async(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """Async variant of generate"""
+        deadline = self._deadline(timeout)
+        self._count("calls")
+        error = None
+        try:
+            if not self.coalesce:
+                return await self._call_async(prompt, deadline)
+
+            key = self._key(prompt)
+            task = self._in_flight_async.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._call_async(prompt, deadline))
+                self._in_flight_async[key] = task
+                task.add_done_callback(lambda done: self._forget_async(key, done))
+            else:
+                self._count("coalesced")
+                LLM_COALESCED.inc(provider=self.provider.name)
+            # Shielded, so one caller giving up doesn't cancel the call for the others
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), self._remaining(deadline))
+            except asyncio.TimeoutError:
+                raise LLMDeadlineExceeded("LLM call deadline exceeded") from None
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._record_outcome(error)
+
+    def _forget_async(self, key: str, task: asyncio.Task) -> None:
+        self._in_flight_async.pop(key, None)
+        # Mark the error as retrieved even if every waiter already gave up
+        if not task.cancelled():
+            task.exception()
+
+    async def stream_async(self, prompt: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Async variant of stream"""
+        deadline = self._deadline(timeout)
+        self._count("calls")
+        error = None
+        attempt = 0
+        try:
+            while True:
+                await self._acquire_slot_async(deadline)
+                try:
+                    self._count("attempts")
+                    remaining = self._remaining(deadline)
+                    chunks = self.provider.stream_async(prompt, remaining).__aiter__()
+                    try:
+                        first = await asyncio.wait_for(chunks.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        first = None
+                except LLMDeadlineExceeded:
+                    self._release_slot_async()
+                    raise
+                except Exception as e:
+                    self._release_slot_async()
+                    # See _call_async: only a timeout at the deadline is final
+                    if isinstance(e, asyncio.TimeoutError) and self._deadline_passed(deadline):
+                        raise LLMDeadlineExceeded("No response from the LLM before the deadline") from None
+                    delay = self._backoff(attempt, e, deadline)
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+
+                try:
+                    if first is not None:
+                        yield first
+                    async for chunk in chunks:
+                        yield chunk
+                finally:
+                    self._release_slot_async()
+                return
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._record_outcome(error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "provider": self.provider.name,
+                "timeout_seconds": self.timeout_seconds,
+                "max_retries": self.max_retries,
+                "rate_per_second": self.rate_limiter.rate if self.rate_limiter else None,
+                "max_concurrency": self.max_concurrency or None,
+                "coalesce": self.coalesce,
+                "in_flight": len(self._in_flight) + len(self._in_flight_async),
+                **self._counters,
+                "rate_limit_wait_seconds": self._rate_limit_wait_seconds,
+            }
+
+
+def create_llm_client_from_env() -> LLMClient:
+    """LLMClient for LLM_BACKEND (``gemini`` or ``fake``), configured by LLM_* variables"""
+    backend = os.environ.get("LLM_BACKEND", "gemini").lower()
+    if backend == "fake":
+        provider = FakeProvider(failure_rate=float(os.environ.get("FAKE_LLM_FAILURE_RATE", 0)))
+    elif backend == "gemini":
+        provider = GeminiProvider(os.environ.get("GEMINI_MODEL", "gemini-1.5-flash"))
+    else:
+        raise ValueError(f"Unknown LLM_BACKEND '{backend}', expected 'gemini' or 'fake'")
+    return LLMClient(
+        provider,
+        timeout_seconds=float(os.environ.get("LLM_TIMEOUT_SECONDS", 30)),
+        max_retries=int(os.environ.get("LLM_MAX_RETRIES", 3)),
+        backoff_base_seconds=float(os.environ.get("LLM_BACKOFF_BASE_SECONDS", 0.5)),
+        backoff_max_seconds=float(os.environ.get("LLM_BACKOFF_MAX_SECONDS", 8)),
+        rate_per_second=float(os.environ.get("LLM_RATE_LIMIT_PER_SECOND", 0)),
+        rate_burst=int(os.environ.get("LLM_RATE_LIMIT_BURST", 5)),
+        max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 0)),
+        coalesce=os.environ.get("LLM_COALESCE", "1").lower() not in ("0", "false", "no")
+    )
@@ -0,0 +1,297 @@
+"""Concurrent load test for the chat API, built on test_client.ChatClient.
+
+N virtual users each play scripted multi-turn conversations against the
+server, attaching a photo to a configurable share of turns and streaming a
+configurable share of replies. Throughput and p50/p95/p99 latency are reported
+per endpoint and per routing path (text or image), and written as JSON so
+runs can be compared over time.
+
+Against a running server:
+
+    python load_test.py --users 16 --conversations 5 --image-ratio 0.25
+
+Fully offline (spawns a server with the fake LLM and the stub captioner):
+
+    python load_test.py --spawn flask --users 8 --json load.json
+    python load_test.py --spawn async --users 32 --stream-ratio 0.5
+
+The spawned server still embeds queries with MiniLM, so the embedding model
+must already be in the local Hugging Face cache.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+from observability import percentile
+from test_client import ChatClient
+
+CONVERSATIONS = [
+    [
+        "My landlord hasn't protected my deposit. What can I do?",
+        "How long do they have to do it after I pay?",
+        "Can I get compensation if they never did?",
+    ],
+    [
+        "There is mould spreading across my bedroom wall.",
+        "Who is responsible for fixing it, me or the landlord?",
+        "What if they ignore my repair request?",
+        "Can I withhold rent until it is fixed?",
+    ],
+    [
+        "What documents should my landlord give me before I move in?",
+        "Do I need to get a gas safety certificate?",
+        "What is an EPC and what rating is acceptable?",
+    ],
+    [
+        "How much notice does my landlord need to give me to leave?",
+        "Is a Section 21 notice valid if my deposit wasn't protected?",
+    ],
+    [
+        "The ceiling in my bathroom is leaking.",
+        "How quickly should the landlord respond to urgent repairs?",
+        "Can the council help if nothing happens?",
+    ],
+]
+
+ENDPOINTS = {"chat": "/chat", "stream": "/chat/stream", "reset": "/reset"}
+
+# Runs app.py's Flask app threaded, without the debug reloader, after loading models
+FLASK_SERVER = (
+    "import sys, app; app.registry.warmup(); "
+    "app.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True, debug=False)"
+)
+
+
+def latency_summary(records: List[dict], duration_s: float) -> dict:
+    latencies = sorted(record["ms"] for record in records if record["ok"])
+    first_tokens = sorted(record["ttft_ms"] for record in records if record.get("ttft_ms") is not None)
+    summary = {
+        "requests": len(records),
+        "errors": sum(1 for record in records if not record["ok"]),
+        "throughput_rps": len(latencies) / duration_s if duration_s else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1] if latencies else 0.0,
+    }
+    if first_tokens:
+        summary["ttft_p50_ms"] = percentile(first_tokens, 0.50)
+        summary["ttft_p95_ms"] = percentile(first_tokens, 0.95)
+        summary["ttft_p99_ms"] = percentile(first_tokens, 0.99)
+    return summary
+
+
+class VirtualUser:
+    """One simulated tenant: plays conversations in order and records every request.
+
+    Each user has its own seeded RNG, so the sequence of text/image and
+    stream/non-stream turns is the same on every run with the same seed.
+    """
+
+    def __init__(self, user_id: int, args: argparse.Namespace, records: List[dict], lock: threading.Lock):
+        self.user_id = user_id
+        self.args = args
+        self.records = records
+        self.lock = lock
+        self.rng = random.Random(args.seed * 1000 + user_id)
+        self.client = ChatClient(args.base_url, verbose=False)
+
+    def _record(self, endpoint: str, path: str, started: float, ok: bool, ttft_ms: Optional[float] = None) -> None:
+        record = {
+            "user": self.user_id,
+            "endpoint": endpoint,
+            "path": path,
+            "ms": (time.perf_counter() - started) * 1000,
+            "ok": ok,
+            "ttft_ms": ttft_ms,
+        }
+        with self.lock:
+            self.records.append(record)
+
+    def _turn(self, message: str) -> None:
+        image_path = self.args.image if self.rng.random() < self.args.image_ratio else None
+        path = "image" if image_path else "text"
+        started = time.perf_counter()
+        if self.rng.random() < self.args.stream_ratio:
+            result = self.client.chat_stream(message, image_path)
+            ok = result is not None and "error" not in result
+            self._record("stream", path, started, ok, result.get("client_time_to_first_token_ms") if ok else None)
+        else:
+            result = self.client.chat(message, image_path)
+            self._record("chat", path, started, result is not None and result.get("response") is not None)
+
+    def _reset(self) -> None:
+        if self.client.session_id is None:
+            return
+        started = time.perf_counter()
+        session_id = self.client.session_id
+        self.client.reset_session()
+        # reset_session only clears the id when the server accepted the reset
+        self._record("reset", "session", started, self.client.session_id != session_id)
+        self.client.session_id = None
+
+    def run(self, deadline: Optional[float]) -> None:
+        # Users start on different scripts so the server sees a mix of questions
+        for n in range(self.args.conversations):
+            script = CONVERSATIONS[(self.user_id + n) % len(CONVERSATIONS)]
+            for message in script:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    self._reset()
+                    return
+                self._turn(message)
+                if self.args.think_ms:
+                    time.sleep(self.rng.uniform(0.5, 1.5) * self.args.think_ms / 1000)
+            self._reset()
+
+
+def run_load_test(args: argparse.Namespace) -> dict:
+    records: List[dict] = []
+    lock = threading.Lock()
+    users = [VirtualUser(i, args, records, lock) for i in range(args.users)]
+
+    started = time.perf_counter()
+    deadline = started + args.duration if args.duration else None
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        for future in [executor.submit(user.run, deadline) for user in users]:
+            future.result()
+    duration_s = time.perf_counter() - started
+
+    by_endpoint: Dict[str, List[dict]] = defaultdict(list)
+    by_path: Dict[str, List[dict]] = defaultdict(list)
+    for record in records:
+        by_endpoint[record["endpoint"]].append(record)
+        if record["endpoint"] != "reset":
+            by_path[record["path"]].append(record)
+
+    chat_records = [record for record in records if record["endpoint"] != "reset"]
+    return {
+        "duration_s": duration_s,
+        "overall": latency_summary(chat_records, duration_s),
+        "endpoints": {ENDPOINTS[name]: latency_summary(group, duration_s) for name, group in sorted(by_endpoint.items())},
+        "paths": {name: latency_summary(group, duration_s) for name, group in sorted(by_path.items())},
+    }
+
+
+def fetch_server_stats(base_url: str) -> dict:
+    """Server-side counters worth keeping next to the client-side latencies"""
+    stats = {}
+    for name in ("router", "prompt", "llm", "image/cache", "image/batching", "rag/cache", "rag/context", "sessions"):
+        try:
+            response = requests.get(f"{base_url}/{name}/stats", timeout=5)
+            if response.ok:
+                stats[name] = response.json()
+        except requests.exceptions.RequestException:
+            pass
+    return stats
+
+
+def spawn_server(kind: str, port: int, env_overrides: Dict[str, str], timeout: float) -> subprocess.Popen:
+    """Start app.py or async_app.py with the fake LLM and stub captioner; return once /ready is 200"""
+    env = {
+        **os.environ,
+        "LLM_BACKEND": "fake",
+        "BLIP_BACKEND": "stub",
+        "MODEL_LOADING": "eager",
+        "HF_HUB_OFFLINE": os.environ.get("HF_HUB_OFFLINE", "1"),
+        **env_overrides,
+    }
+    here = os.path.dirname(os.path.abspath(__file__))
+    if kind == "async":
+        command = [sys.executable, "async_app.py", "--port", str(port)]
+    else:
+        command = [sys.executable, "-c", FLASK_SERVER, str(port)]
+    process = subprocess.Popen(command, cwd=here, env=env, stdout=subprocess.DEVNULL)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{kind} server exited with code {process.returncode} before becoming ready")
+        try:
+            if requests.get(f"{base_url}/ready", timeout=2).status_code == 200:
+                return process
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"{kind} server not ready after {timeout:.0f}s")
+
+
+def print_report(results: dict) -> None:
+    print(f"\n{results['overall']['requests']} chat requests in {results['duration_s']:.1f}s "
+          f"({results['overall']['throughput_rps']:.1f} req/s, {results['overall']['errors']} errors)")
+    header = f"{'':<14}{'requests':>9}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    for title, groups in (("endpoint", results["endpoints"]), ("path", results["paths"])):
+        print(f"\nBy {title}:\n{header}")
+        for name, summary in groups.items():
+            print(f"{name:<14}{summary['requests']:>9}{summary['errors']:>8}{summary['throughput_rps']:>8.1f}"
+                  f"{summary['p50_ms']:>9.0f}{summary['p95_ms']:>9.0f}{summary['p99_ms']:>9.0f}")
+            if "ttft_p50_ms" in summary:
+                print(f"{'  first token':<14}{'':>25}{summary['ttft_p50_ms']:>9.0f}"
+                      f"{summary['ttft_p95_ms']:>9.0f}{summary['ttft_p99_ms']:>9.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the chat API with concurrent scripted users")
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent virtual users")
+    parser.add_argument("--conversations", type=int, default=3, help="Conversations per user")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Stop starting new turns after this many seconds")
+    parser.add_argument("--image-ratio", type=float, default=0.2, help="Share of turns that attach the image")
+    parser.add_argument("--stream-ratio", type=float, default=0.0, help="Share of turns sent to /chat/stream")
+    parser.add_argument("--image", default="moldup.jpeg", help="Photo attached to image turns")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between a user's turns")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn", choices=("flask", "async"), default=None,
+                        help="Start an offline server (fake LLM, stub captioner) for the run")
+    parser.add_argument("--port", type=int, default=5055, help="Port of the spawned server")
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra environment for the spawned server, e.g. FAKE_LLM_TOKEN_DELAY=0")
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--json", default=None, help="Write results to this file")
+    args = parser.parse_args()
+
+    process = None
+    if args.spawn:
+        overrides = dict(item.split("=", 1) for item in args.server_env)
+        print(f"Starting {args.spawn} server on port {args.port} (fake LLM, stub captioner)...")
+        process = spawn_server(args.spawn, args.port, overrides, args.ready_timeout)
+        args.base_url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        print(f"Running {args.users} users x {args.conversations} conversations against {args.base_url}")
+        results = run_load_test(args)
+        results["server_stats"] = fetch_server_stats(args.base_url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    print_report(results)
+    if args.json:
+        config = {key: value for key, value in vars(args).items() if key != "json"}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "host": platform.node(),
+                "config": config,
+                **results,
+            }, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
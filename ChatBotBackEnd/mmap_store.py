@@ -0,0 +1,175 @@
+"""Pickle-free on-disk vector store format.
+
+A store directory holds:
+
+    index.faiss    the FAISS index, memory-mapped read-only at serving time
+    chunks.sqlite  one row per index position: chunk id, text and JSON metadata
+
+Serving processes map the index file instead of reading it into their heap, so
+every worker shares the same physical pages, and chunk texts are fetched from
+SQLite only for the positions a search returns. Nothing is unpickled.
+
+    python mmap_store.py convert vector_store_db [--remove-pickle]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from typing import List
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.sqlite"
+LEGACY_PICKLE_FILE = "index.pkl"
+
+
+def is_mmap_store(vector_store_path: str) -> bool:
+    return os.path.exists(os.path.join(vector_store_path, CHUNKS_FILE))
+
+
+def _mmap_flags() -> int:
+    # IO_FLAG_MMAP_IFC (newer FAISS) also maps flat code arrays, not only IVF lists
+    return faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def write_chunk_table(vector_store: FAISS, path: str) -> None:
+    """Write one row per index position (id, text, metadata JSON) to a new SQLite file"""
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(
+            "CREATE TABLE chunks (position INTEGER PRIMARY KEY, doc_id TEXT NOT NULL,"
+            " text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        rows = []
+        for position in range(vector_store.index.ntotal):
+            doc_id = vector_store.index_to_docstore_id[position]
+            doc = vector_store.docstore.search(doc_id)
+            rows.append((position, doc_id, doc.page_content, json.dumps(doc.metadata)))
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+
+def save_vector_store(vector_store: FAISS, vector_store_path: str) -> None:
+    """Save a LangChain FAISS store in the pickle-free format"""
+    os.makedirs(vector_store_path, exist_ok=True)
+    index_path = os.path.join(vector_store_path, INDEX_FILE)
+    faiss.write_index(vector_store.index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    write_chunk_table(vector_store, os.path.join(vector_store_path, CHUNKS_FILE))
+
+    # A leftover pickle would be stale now
+    legacy_path = os.path.join(vector_store_path, LEGACY_PICKLE_FILE)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+
+def load_vector_store(vector_store_path: str, embeddings) -> FAISS:
+    """Load a store fully into memory as a LangChain FAISS store, for updating it.
+
+    Reads the pickle-free format, or falls back to a legacy save_local store.
+    """
+    if not is_mmap_store(vector_store_path):
+        return FAISS.load_local(vector_store_path, embeddings, allow_dangerous_deserialization=True)
+
+    index = faiss.read_index(os.path.join(vector_store_path, INDEX_FILE))
+    conn = sqlite3.connect(os.path.join(vector_store_path, CHUNKS_FILE))
+    try:
+        rows = conn.execute("SELECT position, doc_id, text, metadata FROM chunks ORDER BY position").fetchall()
+    finally:
+        conn.close()
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=text, metadata=json.loads(metadata))
+        for _, doc_id, text, metadata in rows
+    })
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id={position: doc_id for position, doc_id, _, _ in rows},
+    )
+
+
+class MmapVectorStore:
+    """Read-only store over a memory-mapped FAISS index and a lazily read chunk table"""
+
+    def __init__(self, vector_store_path: str, embeddings=None):
+        self.vector_store_path = vector_store_path
+        self.embeddings = embeddings
+        index_path = os.path.join(vector_store_path, INDEX_FILE)
+        try:
+            self.index = faiss.read_index(index_path, _mmap_flags())
+            self.memory_mapped = True
+        except RuntimeError:
+            # Index types FAISS can't map (e.g. HNSW graphs) are read normally
+            self.index = faiss.read_index(index_path, faiss.IO_FLAG_READ_ONLY)
+            self.memory_mapped = False
+        self._chunks_uri = f"file:{os.path.abspath(os.path.join(vector_store_path, CHUNKS_FILE))}?mode=ro"
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections aren't shareable across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._chunks_uri, uri=True)
+            self._local.conn = conn
+        return conn
+
+    def get_chunks(self, positions: List[int]) -> List[Document]:
+        """Fetch chunks by index position, preserving the given order"""
+        if not positions:
+            return []
+        placeholders = ",".join("?" * len(positions))
+        rows = self._connection().execute(
+            f"SELECT position, text, metadata FROM chunks WHERE position IN ({placeholders})", positions
+        ).fetchall()
+        by_position = {
+            position: Document(page_content=text, metadata=json.loads(metadata))
+            for position, text, metadata in rows
+        }
+        return [by_position[position] for position in positions if position in by_position]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4):
+        vector = np.asarray(embedding, dtype="float32").reshape(1, -1)
+        scores, positions = self.index.search(vector, k)
+        hits = [(int(p), float(s)) for p, s in zip(positions[0], scores[0]) if p >= 0]
+        docs = self.get_chunks([p for p, _ in hits])
+        return list(zip(docs, [s for _, s in hits]))
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
+
+
+def convert_vector_store(vector_store_path: str, remove_pickle: bool = False) -> None:
+    """Convert a legacy save_local store (index.faiss + index.pkl) in place"""
+    vector_store = FAISS.load_local(vector_store_path, None, allow_dangerous_deserialization=True)
+    write_chunk_table(vector_store, os.path.join(vector_store_path, CHUNKS_FILE))
+    if remove_pickle:
+        os.remove(os.path.join(vector_store_path, LEGACY_PICKLE_FILE))
+    print(f"Converted {vector_store_path}: {vector_store.index.ntotal} chunks written to {CHUNKS_FILE}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the pickle-free vector store format")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert = subparsers.add_parser("convert", help="Add chunks.sqlite to a legacy store")
+    convert.add_argument("vector_store", nargs="?", default="vector_store_db")
+    convert.add_argument("--remove-pickle", action="store_true", help="Delete index.pkl afterwards")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        convert_vector_store(args.vector_store, remove_pickle=args.remove_pickle)
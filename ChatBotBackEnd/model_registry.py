@@ -0,0 +1,168 @@
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Optional
+
+from fanout import fanout_settings_from_env
+
+if TYPE_CHECKING:
+    from agent_router import AgentRouter
+    from image_agent import PropertyIssueDetectionAgent
+    from RAGsystem import RAGSystem
+    from text_agent import TextGenerationService
+
+logger = logging.getLogger(__name__)
+
+# Shared by RAG retrieval, ingestion and the issue matcher; defined here so
+# importing it doesn't pull in langchain or torch
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+# Each component's module (and so torch, transformers, langchain or the Gemini
+# SDK) is imported only when the component is first built, keeping
+# ``import app`` fast
+def _build_rag_system():
+    from RAGsystem import RAGSystem
+
+    return RAGSystem()
+
+
+def _build_text_generation_service():
+    from text_agent import TextGenerationService
+
+    return TextGenerationService()
+
+
+def _build_image_agent(embeddings):
+    from image_agent import PropertyIssueDetectionAgent
+
+    return PropertyIssueDetectionAgent(embeddings=embeddings)
+
+
+class ModelRegistry:
+    """Process-wide holder for the heavy components shared by every chat session.
+
+    Each component (MiniLM + FAISS via RAGSystem, the Gemini client and BLIP) is
+    built at most once per process. With ``lazy=True`` nothing is loaded until a
+    component is first requested; otherwise call ``warmup()`` at startup. A
+    prefork server (serve.py) warms up in the parent so forked workers share
+    the loaded weights.
+    """
+
+    COMPONENTS = ("rag_system", "text_generation_service", "image_agent")
+
+    def __init__(self, lazy: bool = False):
+        self.lazy = lazy
+        self._factories: Dict[str, Callable[[], object]] = {
+            "rag_system": _build_rag_system,
+            "text_generation_service": _build_text_generation_service,
+            "image_agent": lambda: _build_image_agent(self._shared_embeddings()),
+        }
+        self._instances: Dict[str, object] = {}
+        self._errors: Dict[str, str] = {}
+        self._locks = {name: threading.Lock() for name in self.COMPONENTS}
+        self._router_lock = threading.Lock()
+        self._agent_router: Optional["AgentRouter"] = None
+
+    def _get(self, name: str):
+        """Return the named component, loading it on first use"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        # One lock per component so BLIP loading doesn't block RAG loading
+        with self._locks[name]:
+            instance = self._instances.get(name)
+            if instance is None:
+                logger.info("Loading shared component: %s", name)
+                try:
+                    instance = self._factories[name]()
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    raise
+                self._errors.pop(name, None)
+                self._instances[name] = instance
+        return instance
+
+    def _shared_embeddings(self):
+        """The RAG system's MiniLM model, reused by the issue matcher; None if RAG can't load"""
+        try:
+            return self.rag_system.embeddings
+        except Exception:
+            return None
+
+    def get_if_loaded(self, name: str):
+        """Return the named component (or "agent_router") without triggering a load, or None"""
+        if name == "agent_router":
+            return self._agent_router
+        return self._instances.get(name)
+
+    @property
+    def rag_system(self) -> "RAGSystem":
+        return self._get("rag_system")
+
+    @property
+    def text_generation_service(self) -> "TextGenerationService":
+        return self._get("text_generation_service")
+
+    @property
+    def image_agent(self) -> "PropertyIssueDetectionAgent":
+        return self._get("image_agent")
+
+    def get_agent_router(self) -> "AgentRouter":
+        """Return the shared AgentRouter, building it from the shared components"""
+        if self._agent_router is not None:
+            return self._agent_router
+
+        with self._router_lock:
+            if self._agent_router is None:
+                from agent_router import AgentRouter
+                from semantic_cache import create_semantic_cache_from_env
+
+                rag_system = self.rag_system
+                self._agent_router = AgentRouter(
+                    text_generation_service=self.text_generation_service,
+                    image_agent=self.image_agent,
+                    rag_system=rag_system,
+                    semantic_cache=create_semantic_cache_from_env(rag_system),
+                    **fanout_settings_from_env()
+                )
+        return self._agent_router
+
+    def warmup(self, names: Optional[Iterable[str]] = None) -> bool:
+        """Load the named components (default: all) now. Returns True if every component is loaded."""
+        for name in names or self.COMPONENTS:
+            try:
+                self._get(name)
+            except Exception as e:
+                logger.error("Error warming up %s: %s", name, e)
+        return self.is_ready()
+
+    def warmup_in_background(self) -> threading.Thread:
+        """Run warmup() on a daemon thread so the server can start accepting requests"""
+        thread = threading.Thread(target=self.warmup, name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self) -> bool:
+        return all(name in self._instances for name in self.COMPONENTS)
+
+    def status(self) -> dict:
+        """Report which components are loaded, for the readiness endpoint"""
+        return {
+            "ready": self.is_ready(),
+            "lazy": self.lazy,
+            "components": {
+                name: {
+                    "loaded": name in self._instances,
+                    "error": self._errors.get(name)
+                }
+                for name in self.COMPONENTS
+            }
+        }
+
+
+def create_registry_from_env() -> ModelRegistry:
+    """Build a registry configured by MODEL_LOADING (``eager`` or ``lazy``)"""
+    lazy = os.environ.get("MODEL_LOADING", "eager").lower() == "lazy"
+    return ModelRegistry(lazy=lazy)
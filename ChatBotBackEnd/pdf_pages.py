@@ -0,0 +1,21 @@
+"""PDF page extraction run in ingestion worker processes.
+
+Workers are spawned, so each one imports the module its task function lives
+in. Keeping these functions here means a worker imports PyPDF2 alone, not
+document_processor's LangChain, FAISS and torch dependencies.
+"""
+from typing import List, Tuple
+
+import PyPDF2
+
+
+def extract_page_range(pdf_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Extract pages [start, stop) of a PDF. Runs in a worker process."""
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [(i, pdf_reader.pages[i].extract_text() or '') for i in range(start, stop)]
+
+
+def count_pages(pdf_path: str) -> int:
+    with open(pdf_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
@@ -0,0 +1,298 @@
+import os
+import re
+import threading
+from collections import deque
+from typing import Callable, Deque, List, Optional, Sequence, Tuple, Union
+
+from langchain_core.messages import BaseMessage
+
+from observability import summarize
+
+PROMPT_TEMPLATE = """
+Context information: {context}
+{summary}
+Previous conversation:
+{history}
+
+Current user message: {user_message}
+
+Please provide a helpful response based on the above information.Stick to property related topics only and dont deviate.
+"""
+SUMMARY_TEMPLATE = "\nSummary of earlier conversation:\n{summary}\n"
+NO_CONTEXT = "No additional context available"
+# A truncated chunk shorter than this is more noise than help
+MIN_TRUNCATED_CHUNK_TOKENS = 64
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English).
+
+    Calling the model's tokenizer would cost a network round trip per prompt;
+    the budget only needs to be approximately right.
+    """
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, at a word boundary where possible"""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > max_chars // 2 else cut) + " ..."
+
+
+def compact_message(role: str, text: str, max_chars: int = 200) -> str:
+    """Extractive one-line summary of a message: its first sentence, capped in length"""
+    first_sentence = re.split(r"(?<=[.!?])\s", " ".join(text.split()), maxsplit=1)[0]
+    if len(first_sentence) > max_chars:
+        first_sentence = first_sentence[:max_chars].rsplit(" ", 1)[0] + " ..."
+    return f"{role}: {first_sentence}"
+
+
+def _role(message: BaseMessage) -> str:
+    return "User" if message.type == "human" else "Assistant"
+
+
+class ConversationMemory:
+    """Incrementally maintained prompt view of one conversation.
+
+    The last ``recent_messages`` messages are kept verbatim, each rendered and
+    token-counted once when it arrives. Older messages are compacted into
+    summary lines as they leave the window; the summary keeps the newest lines
+    that fit in ``summary_max_tokens`` and its text is cached between turns.
+    """
+
+    def __init__(
+        self,
+        recent_messages: int = 6,
+        summary_max_tokens: int = 300,
+        summarize_fn: Callable[[str, str], str] = compact_message
+    ):
+        self.recent_messages = recent_messages
+        self.summary_max_tokens = summary_max_tokens
+        self.summarize_fn = summarize_fn
+        # (role, content, rendered line, tokens), oldest first
+        self.recent: Deque[Tuple[str, str, str, int]] = deque()
+        self._summary_lines: Deque[Tuple[str, int]] = deque()
+        self._summary_tokens = 0
+        self._summary_text: Optional[str] = None
+        self.summarized_messages = 0
+        # What the last append rolled into the summary, so discard_last can put it back
+        self._rolled_over: List[Tuple[str, str, str, int]] = []
+        self._summary_before: Optional[Tuple[Deque[Tuple[str, int]], int, int]] = None
+
+    @classmethod
+    def from_history(cls, chat_history: Sequence[BaseMessage], **kwargs) -> "ConversationMemory":
+        memory = cls(**kwargs)
+        for message in chat_history:
+            memory.append(message)
+        return memory
+
+    def append(self, message: BaseMessage) -> None:
+        # The system message is covered by the prompt template
+        if message.type == "system":
+            return
+        role = _role(message)
+        line = f"{role}: {message.content}"
+        self.recent.append((role, message.content, line, estimate_tokens(line)))
+        self._rolled_over = []
+        self._summary_before = None
+        if len(self.recent) > self.recent_messages:
+            self._summary_before = (deque(self._summary_lines), self._summary_tokens, self.summarized_messages)
+        while len(self.recent) > self.recent_messages:
+            old = self.recent.popleft()
+            self._rolled_over.append(old)
+            self._add_summary_line(self.summarize_fn(old[0], old[1]))
+
+    def discard_last(self) -> None:
+        """Drop the newest message (e.g. a user message whose request was rejected).
+
+        Whatever that message pushed out of the recent window returns to it,
+        and the summary goes back to what it was before.
+        """
+        if not self.recent:
+            return
+        self.recent.pop()
+        self.recent.extendleft(reversed(self._rolled_over))
+        if self._summary_before is not None:
+            self._summary_lines, self._summary_tokens, self.summarized_messages = self._summary_before
+            self._summary_text = None
+        self._rolled_over = []
+        self._summary_before = None
+
+    def _add_summary_line(self, line: str) -> None:
+        tokens = estimate_tokens(line) + 1
+        self._summary_lines.append((line, tokens))
+        self._summary_tokens += tokens
+        while self._summary_tokens > self.summary_max_tokens and self._summary_lines:
+            _, dropped = self._summary_lines.popleft()
+            self._summary_tokens -= dropped
+        self._summary_text = None
+        self.summarized_messages += 1
+
+    @property
+    def summary(self) -> str:
+        if self._summary_text is None:
+            self._summary_text = "\n".join(line for line, _ in self._summary_lines)
+        return self._summary_text
+
+    @property
+    def summary_tokens(self) -> int:
+        return self._summary_tokens
+
+
+class PromptBuilder:
+    """Assembles prompts within a token budget and records their size.
+
+    The template and the current message are always included. Of what is
+    left, up to ``history_share`` goes to the conversation (newest turns
+    first, then the summary of older ones) and the rest to context chunks,
+    taken in relevance order; the first chunk that doesn't fit is truncated
+    and the remaining ones are dropped.
+    """
+
+    def __init__(self, max_tokens: int = 3000, history_share: float = 0.35, window: int = 1000):
+        self.max_tokens = max_tokens
+        self.history_share = history_share
+        self._lock = threading.Lock()
+        self._prompt_tokens: Deque[int] = deque(maxlen=window)
+        self._counters = {
+            "requests": 0,
+            "over_budget": 0,
+            "chunks_offered": 0,
+            "chunks_used": 0,
+            "chunks_truncated": 0,
+            "history_messages_omitted": 0,
+            "context_tokens": 0,
+            "history_tokens": 0,
+            "summary_tokens": 0,
+        }
+
+    def build(
+        self,
+        user_message: str,
+        memory: ConversationMemory,
+        context: Optional[Union[str, Sequence[str]]] = None
+    ) -> Tuple[str, dict]:
+        """Return the prompt and a breakdown of its token usage"""
+        chunks = [context] if isinstance(context, str) else list(context or [])
+        chunks = [chunk for chunk in chunks if chunk]
+
+        fixed_tokens = estimate_tokens(PROMPT_TEMPLATE.format(
+            context="", summary="", history="", user_message=user_message
+        ))
+        remaining = max(0, self.max_tokens - fixed_tokens)
+
+        # Newest turns first; the current user message is already in memory but
+        # is rendered separately
+        entries = list(memory.recent)
+        if entries and entries[-1][0] == "User" and entries[-1][1] == user_message:
+            entries.pop()
+        history_budget = int(remaining * self.history_share)
+        history_lines: List[str] = []
+        history_tokens = 0
+        for _, _, line, tokens in reversed(entries):
+            if history_tokens + tokens + 1 > history_budget:
+                break
+            history_lines.append(line)
+            history_tokens += tokens + 1
+        history_lines.reverse()
+        omitted = len(entries) - len(history_lines)
+
+        summary = ""
+        summary_tokens = 0
+        if memory.summary and omitted == 0:
+            summary_tokens = estimate_tokens(SUMMARY_TEMPLATE.format(summary=memory.summary))
+            if history_tokens + summary_tokens <= history_budget:
+                summary = SUMMARY_TEMPLATE.format(summary=memory.summary)
+            else:
+                summary_tokens = 0
+
+        context_budget = remaining - history_tokens - summary_tokens
+        used_chunks: List[str] = []
+        context_tokens = 0
+        truncated = 0
+        for chunk in chunks:
+            tokens = estimate_tokens(chunk) + 1
+            if context_tokens + tokens <= context_budget:
+                used_chunks.append(chunk)
+                context_tokens += tokens
+                continue
+            left = context_budget - context_tokens
+            if left >= MIN_TRUNCATED_CHUNK_TOKENS:
+                used_chunks.append(truncate_to_tokens(chunk, left - 2))
+                context_tokens += estimate_tokens(used_chunks[-1]) + 1
+                truncated = 1
+            break
+
+        prompt = PROMPT_TEMPLATE.format(
+            context="\n\n".join(used_chunks) if used_chunks else NO_CONTEXT,
+            summary=summary,
+            history="\n".join(history_lines),
+            user_message=user_message
+        )
+        info = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "budget": self.max_tokens,
+            "context_tokens": context_tokens,
+            "history_tokens": history_tokens,
+            "summary_tokens": summary_tokens,
+            "chunks_offered": len(chunks),
+            "chunks_used": len(used_chunks),
+            "chunks_truncated": truncated,
+            "history_messages_omitted": omitted,
+        }
+        self._record(info, over_budget=fixed_tokens > self.max_tokens)
+        return prompt, info
+
+    def _record(self, info: dict, over_budget: bool) -> None:
+        with self._lock:
+            self._prompt_tokens.append(info["prompt_tokens"])
+            self._counters["requests"] += 1
+            self._counters["over_budget"] += int(over_budget)
+            for key in ("chunks_offered", "chunks_used", "chunks_truncated", "history_messages_omitted",
+                        "context_tokens", "history_tokens", "summary_tokens"):
+                self._counters[key] += info[key]
+
+    def stats(self) -> dict:
+        """Prompt size distribution and how often context or history had to be cut"""
+        with self._lock:
+            sizes = list(self._prompt_tokens)
+            counters = dict(self._counters)
+
+        requests = counters["requests"]
+        return {
+            "max_tokens": self.max_tokens,
+            "history_share": self.history_share,
+            "requests": requests,
+            "over_budget": counters["over_budget"],
+            "prompt_tokens": summarize(sizes),
+            "mean_tokens_per_request": {
+                key: counters[key] / requests if requests else 0.0
+                for key in ("context_tokens", "history_tokens", "summary_tokens")
+            },
+            "chunks": {
+                "offered": counters["chunks_offered"],
+                "used": counters["chunks_used"],
+                "truncated": counters["chunks_truncated"],
+            },
+            "history_messages_omitted": counters["history_messages_omitted"],
+        }
+
+
+def create_prompt_builder_from_env() -> PromptBuilder:
+    """PromptBuilder configured by PROMPT_MAX_TOKENS and PROMPT_HISTORY_SHARE"""
+    return PromptBuilder(
+        max_tokens=int(os.environ.get("PROMPT_MAX_TOKENS", 3000)),
+        history_share=float(os.environ.get("PROMPT_HISTORY_SHARE", 0.35))
+    )
+
+
+def memory_settings_from_env() -> dict:
+    """ConversationMemory settings from PROMPT_RECENT_MESSAGES and PROMPT_SUMMARY_MAX_TOKENS"""
+    return {
+        "recent_messages": int(os.environ.get("PROMPT_RECENT_MESSAGES", 6)),
+        "summary_max_tokens": int(os.environ.get("PROMPT_SUMMARY_MAX_TOKENS", 300)),
+    }
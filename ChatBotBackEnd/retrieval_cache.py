@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form used as cache key: lowercase, single spaces, no trailing punctuation"""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!. ")
+
+
+def vector_store_version(path: str) -> str:
+    """Content hash of every file in the vector store directory.
+
+    Rebuilding the store with document_processor.py changes the hash, which
+    invalidates anything cached against the old version.
+    """
+    digest = hashlib.sha256()
+    if not os.path.isdir(path):
+        return "missing"
+    for name in sorted(os.listdir(path)):
+        file_path = os.path.join(path, name)
+        if not os.path.isfile(file_path):
+            continue
+        digest.update(name.encode("utf-8"))
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+class SQLiteCacheBackend:
+    """Optional on-disk backing store shared by every cache level.
+
+    Values are stored as JSON, so only plain data (lists, dicts, strings,
+    numbers) can be cached. The least recently used rows beyond
+    ``max_entries`` per namespace are deleted periodically.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._pid = os.getpid()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, accessed REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork; a prefork worker opens its own
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?", (time.time(), namespace, key)
+            )
+            conn.commit()
+        return json.loads(row[0])
+
+    def put(self, namespace: str, key: str, value: Any) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, accessed) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), time.time())
+            )
+            self._writes += 1
+            # Trimming needs a count, so only do it every so often
+            if self._writes % 1000 == 0:
+                self._trim_locked(namespace)
+            conn.commit()
+
+    def _trim_locked(self, namespace: str) -> None:
+        self._connection().execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            " SELECT key FROM cache WHERE namespace = ? ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (namespace, namespace, self.max_entries)
+        )
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+            conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU cache with optional write-through disk backing"""
+
+    def __init__(self, namespace: str, max_entries: int = 1024, backend: Optional[SQLiteCacheBackend] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+
+        value = self.backend.get(self.namespace, key) if self.backend else None
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+            self._put_locked(key, value)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._put_locked(key, value)
+        if self.backend:
+            self.backend.put(self.namespace, key, value)
+
+    def _put_locked(self, key: str, value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.backend:
+            self.backend.delete(self.namespace, key)
+
+    def clear(self) -> None:
+        """Drop in-memory entries (disk entries stay, keyed by their old version)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": (self._hits + self._disk_hits) / lookups if lookups else 0.0,
+            }
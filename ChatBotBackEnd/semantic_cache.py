@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import faiss
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Maps past first-turn questions to their answers by embedding similarity.
+
+    Question embeddings are L2-normalised and kept in a small inner-product FAISS
+    index, so a search score is the cosine similarity. A lookup hits when the
+    nearest cached question scores at least ``similarity_threshold``, the entry
+    is younger than ``ttl_seconds`` and it was answered against the current
+    version of the source documents. Stale entries are removed as they are found.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[str], List[float]],
+        version_fn: Callable[[], Optional[str]] = lambda: None,
+        similarity_threshold: float = 0.92,
+        ttl_seconds: Optional[float] = 24 * 3600,
+        max_entries: int = 1000,
+        clock: Callable[[], float] = time.time
+    ):
+        self.embed_fn = embed_fn
+        self.version_fn = version_fn
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._index = None
+        self._entries: Dict[int, dict] = {}  # insertion order == age order
+        self._next_id = 0
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "expired": 0,
+            "invalidated": 0,
+            "evicted": 0,
+        }
+        self._latency_saved_ms = 0.0
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn(question), dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _remove_locked(self, entry_ids: List[int], reason: str) -> None:
+        if not entry_ids:
+            return
+        self._index.remove_ids(np.asarray(entry_ids, dtype="int64"))
+        for entry_id in entry_ids:
+            del self._entries[entry_id]
+        self._counters[reason] += len(entry_ids)
+
+    def _is_stale(self, entry: dict, now: float, version: Optional[str]) -> Optional[str]:
+        if self.ttl_seconds is not None and now - entry["created"] > self.ttl_seconds:
+            return "expired"
+        if entry["source_version"] != version:
+            return "invalidated"
+        return None
+
+    def lookup(self, question: str) -> Optional[dict]:
+        """Return the cached entry (question, answer, context, similarity) or None"""
+        vector = self._embed(question)
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                self._counters["misses"] += 1
+                return None
+
+            now = self._clock()
+            version = self.version_fn()
+            # Look a few neighbours deep so one stale entry doesn't hide a fresh one
+            scores, ids = self._index.search(vector, min(4, self._index.ntotal))
+            stale = {"expired": [], "invalidated": []}
+            hit = None
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id < 0 or score < self.similarity_threshold:
+                    break
+                entry = self._entries[int(entry_id)]
+                reason = self._is_stale(entry, now, version)
+                if reason:
+                    stale[reason].append(int(entry_id))
+                    continue
+                hit = {**entry, "similarity": float(score)}
+                break
+
+            for reason, entry_ids in stale.items():
+                self._remove_locked(entry_ids, reason)
+
+            if hit is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            self._latency_saved_ms += hit["latency_ms"]
+            return hit
+
+    def store(self, question: str, answer: str, context: Optional[str] = None, latency_ms: float = 0.0) -> None:
+        """Cache an answer; latency_ms is the generation time a future hit will save"""
+        vector = self._embed(question)
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+
+            now = self._clock()
+            if self.ttl_seconds is not None:
+                expired = [i for i, e in self._entries.items() if now - e["created"] > self.ttl_seconds]
+                self._remove_locked(expired, "expired")
+            overflow = len(self._entries) + 1 - self.max_entries
+            if overflow > 0:
+                self._remove_locked(list(self._entries)[:overflow], "evicted")
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.asarray([entry_id], dtype="int64"))
+            self._entries[entry_id] = {
+                "question": question,
+                "answer": answer,
+                "context": context,
+                "latency_ms": latency_ms,
+                "created": now,
+                "source_version": self.version_fn(),
+            }
+            self._counters["stores"] += 1
+
+    def invalidate_all(self) -> None:
+        with self._lock:
+            self._remove_locked(list(self._entries), "invalidated")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "entries": len(self._entries),
+                "similarity_threshold": self.similarity_threshold,
+                "ttl_seconds": self.ttl_seconds,
+                **self._counters,
+                "hit_rate": self._counters["hits"] / lookups if lookups else 0.0,
+                "latency_saved_ms": self._latency_saved_ms,
+            }
+
+
+def create_semantic_cache_from_env(rag_system) -> Optional[SemanticAnswerCache]:
+    """Build the cache if SEMANTIC_CACHE_ENABLED is set; it reuses the RAG system's
+    MiniLM embeddings and treats the vector store version as the source version"""
+    if os.environ.get("SEMANTIC_CACHE_ENABLED", "").lower() not in ("1", "true", "yes"):
+        return None
+    ttl = float(os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", 24 * 3600))
+    return SemanticAnswerCache(
+        embed_fn=rag_system.embed_query,
+        version_fn=lambda: rag_system.index_version,
+        similarity_threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.92)),
+        ttl_seconds=ttl if ttl > 0 else None,
+        max_entries=int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 1000))
+    )
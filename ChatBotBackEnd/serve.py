@@ -0,0 +1,167 @@
+"""Production entry point for app.py: load models once, then fork workers.
+
+    python serve.py --workers 4 --port 5000
+
+The parent imports app.py, loads the components that hold model weights
+(MiniLM + FAISS, BLIP and the issue matcher) and opens the listening socket,
+then forks. Workers inherit the loaded weights copy-on-write, so N workers
+cost far less than N independent copies, and a restarted worker is serving
+as soon as it has forked. Each worker runs werkzeug's threaded server on the
+shared socket and builds its own Gemini client (gRPC channels do not survive
+a fork). The parent restarts workers that die and stops them all on SIGTERM
+or Ctrl+C.
+
+``--no-preload`` makes every worker load its own models after the fork, which
+is how separately started processes behave (see benchmark_startup.py).
+Linux and macOS only; without ``os.fork`` a single process is served.
+
+Metrics and the ``/…/stats`` counters live in each worker, and a request on
+the shared port reaches whichever worker accepts it, so scraping ``/metrics``
+there jumps between workers. Every sample carries a ``worker`` label, and with
+``--metrics-port P`` worker N also serves the app on port P + N, so each
+worker can be scraped (and its stats read) on its own port.
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import threading
+
+logger = logging.getLogger("serve")
+
+# Components whose weights workers share; the Gemini client is built per worker
+PRELOAD_COMPONENTS = ("rag_system", "image_agent")
+
+
+def _set_torch_threads(threads: int) -> None:
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def _listen(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def run_worker(number: int, sock: socket.socket, args: argparse.Namespace) -> None:
+    """Serve requests from the shared socket until terminated"""
+    from werkzeug.serving import make_server
+
+    import app
+
+    from observability import set_constant_labels
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    set_constant_labels(worker=str(number))
+    # The parent loaded models single-threaded; give each worker its share of cores
+    _set_torch_threads(args.torch_threads)
+    # Loads whatever the parent did not (everything with --no-preload)
+    app.registry.warmup()
+    if args.metrics_port is not None:
+        # This worker's own port, so its metrics and stats can be scraped directly
+        own = make_server(args.host, args.metrics_port + number, app.app, threaded=True)
+        threading.Thread(target=own.serve_forever, name="worker-metrics", daemon=True).start()
+    server = make_server(args.host, args.port, app.app, threaded=True, fd=sock.fileno())
+    logger.info("Worker %d (pid %d) serving on %s:%d", number, os.getpid(), args.host, args.port)
+    server.serve_forever()
+
+
+def _spawn(number: int, sock: socket.socket, args: argparse.Namespace) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(number, sock, args)
+        except BaseException:
+            logger.exception("Worker %d exited with an error", number)
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(args: argparse.Namespace) -> None:
+    # Logging is set up by app.py; importing it loads no models
+    import app
+
+    if not hasattr(os, "fork"):
+        from werkzeug.serving import run_simple
+
+        logger.warning("os.fork is not available; serving from a single process")
+        app.registry.warmup()
+        run_simple(args.host, args.port, app.app, threaded=True)
+        return
+
+    sock = _listen(args.host, args.port, args.backlog)
+    if args.preload:
+        # OpenMP thread pools started in the parent would be unusable in the
+        # children, so load (and run the issue matcher's embedding) on one thread
+        _set_torch_threads(1)
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+        app.registry.warmup(PRELOAD_COMPONENTS)
+        # Move everything loaded so far out of the collector's reach, so
+        # collections in the workers don't write to (and copy) the shared pages
+        gc.collect()
+        gc.freeze()
+
+    workers = {_spawn(number, sock, args): number for number in range(args.workers)}
+    logger.info("Started %d workers (preload=%s): %s", args.workers, args.preload, sorted(workers))
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        number = workers.pop(pid, None)
+        if number is None or stopping:
+            continue
+        logger.warning("Worker %d (pid %d) exited with status %d; restarting", number, pid, status)
+        workers[_spawn(number, sock, args)] = number
+    sock.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve app.py from prefork worker processes")
+    parser.add_argument("--host", default=os.environ.get("SERVE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("SERVE_PORT", 5000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SERVE_WORKERS", 2)))
+    parser.add_argument("--torch-threads", type=int, default=None,
+                        help="Intra-op threads per worker (default: CPU count / workers)")
+    parser.add_argument("--backlog", type=int, default=128)
+    metrics_port = os.environ.get("SERVE_METRICS_PORT")
+    parser.add_argument("--metrics-port", type=int, default=int(metrics_port) if metrics_port else None,
+                        help="Worker N also serves on this port + N, for per-worker /metrics and stats")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Load models in each worker instead of once before forking")
+    args = parser.parse_args()
+    if args.torch_threads is None:
+        args.torch_threads = max(1, (os.cpu_count() or 1) // max(1, args.workers))
+    serve(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""Shared session storage, so any worker process can continue any conversation.
+
+Every session's messages are appended to a SessionBackend. The default,
+``SESSION_BACKEND=memory``, keeps them in a dict private to the serving
+process. ``SESSION_BACKEND=sqlite`` keeps them in one SQLite file that every
+worker on the host shares:
+
+- a worker that gets an unknown ``session_id`` restores the conversation from
+  the backend instead of silently starting a new one
+- a worker holding a cached session pulls only the messages appended since it
+  last saw it
+- every message is one appended row, ``(session_id, seq, role, content)``;
+  after each append the oldest rows beyond the per-session history limits
+  (``SESSION_MAX_HISTORY_MESSAGES`` / ``SESSION_MAX_HISTORY_CHARS``) are
+  deleted, so a stored log never holds more than a session's prompt view
+
+Deleting a session (``/reset``) removes it for every worker.
+"""
+import abc
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# One-letter role codes keep rows small
+_ROLE_CODES = {"system": "s", "human": "h", "ai": "a"}
+_MESSAGE_TYPES = {"s": SystemMessage, "h": HumanMessage, "a": AIMessage}
+# A read refreshes a session's last access at most this often; appends always do
+TOUCH_INTERVAL_SECONDS = 60
+
+
+def encode_message(message: BaseMessage) -> Tuple[str, str]:
+    return _ROLE_CODES.get(message.type, "h"), message.content
+
+
+def decode_message(role: str, content: str) -> BaseMessage:
+    return _MESSAGE_TYPES[role](content=content)
+
+
+def history_excess(
+    entries: Sequence[Tuple[bool, int]],
+    max_messages: Optional[int] = None,
+    max_chars: Optional[int] = None
+) -> Tuple[int, int]:
+    """How many of the oldest messages to drop so a history fits the limits.
+
+    ``entries`` is ``(is_system, length)`` per message, oldest first. A leading
+    system message and the latest message are always kept. Returns
+    ``(start, count)``: drop ``entries[start:start + count]``.
+    """
+    start = 1 if entries and entries[0][0] else 0
+    removed = 0
+    if max_messages is not None:
+        removed = max(0, len(entries) - start - max_messages)
+    if max_chars is not None:
+        total = sum(length for _, length in entries[start + removed:])
+        while total > max_chars and len(entries) - start - removed > 1:
+            total -= entries[start + removed][1]
+            removed += 1
+    return start, removed
+
+
+class SessionBackend(abc.ABC):
+    """Append-only message log per session; ``seq`` numbers a session's messages from 1"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            "created": 0, "appended": 0, "compacted": 0, "loaded": 0, "loaded_messages": 0, "purged": 0
+        }
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    @abc.abstractmethod
+    def create(self, session_id: str) -> None:
+        """Register a new, empty session"""
+
+    @abc.abstractmethod
+    def append(self, session_id: str, messages: Sequence[BaseMessage]) -> List[int]:
+        """Append messages (creating the session if needed) and return the seqs they got"""
+
+    @abc.abstractmethod
+    def load(self, session_id: str, after_seq: int = 0) -> Optional[List[Tuple[int, BaseMessage]]]:
+        """Messages after ``after_seq`` in order, or None if the session is unknown or expired"""
+
+    @abc.abstractmethod
+    def discard(self, session_id: str, seq: int) -> None:
+        """Remove one message (a user message whose request was rejected)"""
+
+    @abc.abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """Remove a session. Returns False if it was not found."""
+
+    @abc.abstractmethod
+    def purge_expired(self) -> int:
+        """Remove expired sessions and the least recently used beyond the cap"""
+
+    @abc.abstractmethod
+    def stats(self) -> dict:
+        """Counters and stored sizes, for /sessions/stats"""
+
+
+class InMemorySessionBackend(SessionBackend):
+    """Message log in a dict, private to this process (the default).
+
+    Keeps the history of up to ``max_sessions`` sessions, compacted to
+    ``history_limits``, so a session the SessionStore evicted can still be
+    restored until it expires.
+    """
+
+    def __init__(self, idle_ttl_seconds: Optional[float] = 3600, max_sessions: Optional[int] = None,
+                 clock=time.monotonic, history_limits: Optional[dict] = None):
+        super().__init__()
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_sessions = max_sessions
+        self.history_limits = history_limits or {}
+        self._clock = clock
+        # session_id -> {"messages": [(seq, message)], "last_seq", "last_access"}, least recently used first
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+
+    def _expired(self, entry: dict, now: float) -> bool:
+        return self.idle_ttl_seconds is not None and now - entry["last_access"] > self.idle_ttl_seconds
+
+    def _touch_locked(self, session_id: str, create: bool = False) -> Optional[dict]:
+        entry = self._sessions.get(session_id)
+        now = self._clock()
+        if entry is not None and self._expired(entry, now):
+            del self._sessions[session_id]
+            entry = None
+        if entry is None:
+            if not create:
+                return None
+            entry = self._sessions[session_id] = {"messages": [], "last_seq": 0, "last_access": now}
+        entry["last_access"] = now
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def create(self, session_id: str) -> None:
+        with self._lock:
+            self._touch_locked(session_id, create=True)
+            self._counters["created"] += 1
+        self.purge_expired()
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]) -> List[int]:
+        with self._lock:
+            entry = self._touch_locked(session_id, create=True)
+            seqs = list(range(entry["last_seq"] + 1, entry["last_seq"] + 1 + len(messages)))
+            entry["messages"].extend(zip(seqs, messages))
+            entry["last_seq"] += len(messages)
+            self._counters["appended"] += len(messages)
+            if self.history_limits:
+                stored = entry["messages"]
+                start, removed = history_excess(
+                    [(msg.type == "system", len(msg.content)) for _, msg in stored], **self.history_limits
+                )
+                del stored[start:start + removed]
+                self._counters["compacted"] += removed
+        return seqs
+
+    def load(self, session_id: str, after_seq: int = 0) -> Optional[List[Tuple[int, BaseMessage]]]:
+        with self._lock:
+            entry = self._touch_locked(session_id)
+            if entry is None:
+                return None
+            messages = entry["messages"]
+            # Callers usually want only the last few messages, so scan from the end
+            start = len(messages)
+            while start > 0 and messages[start - 1][0] > after_seq:
+                start -= 1
+            loaded = messages[start:]
+            if loaded:
+                self._counters["loaded"] += 1
+                self._counters["loaded_messages"] += len(loaded)
+            return loaded
+
+    def discard(self, session_id: str, seq: int) -> None:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return
+            messages = entry["messages"]
+            for index in range(len(messages) - 1, -1, -1):
+                if messages[index][0] == seq:
+                    del messages[index]
+                    return
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def purge_expired(self) -> int:
+        now = self._clock()
+        purged = 0
+        with self._lock:
+            # Least recently used first, so expired sessions are at the front
+            while self._sessions:
+                session_id, entry = next(iter(self._sessions.items()))
+                if not self._expired(entry, now) and (
+                    self.max_sessions is None or len(self._sessions) <= self.max_sessions
+                ):
+                    break
+                del self._sessions[session_id]
+                purged += 1
+            self._counters["purged"] += purged
+        return purged
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "stored_sessions": len(self._sessions),
+                "stored_messages": sum(len(entry["messages"]) for entry in self._sessions.values()),
+                **self._counters,
+            }
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Append-only message log in a SQLite file shared by every process on the host.
+
+    Runs in WAL mode so readers don't block the writer; each thread (and each
+    forked worker) uses its own connection. Sessions idle for longer than
+    ``idle_ttl_seconds`` expire, and beyond ``max_sessions`` the least
+    recently used are deleted when new sessions are created. Each append
+    also deletes the session's oldest rows beyond ``history_limits``.
+    """
+
+    def __init__(self, path: str, idle_ttl_seconds: Optional[float] = 3600, max_sessions: Optional[int] = None,
+                 clock=time.time, history_limits: Optional[dict] = None):
+        super().__init__()
+        self.path = path
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_sessions = max_sessions
+        self.history_limits = history_limits or {}
+        # Wall-clock time, since last-access times are compared across processes
+        self._clock = clock
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY, last_seq INTEGER NOT NULL, last_access REAL NOT NULL"
+            ") WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL,"
+            " PRIMARY KEY (session_id, seq)"
+            ") WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS sessions_by_access ON sessions (last_access);"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # Not shareable across threads, and must not cross a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, session_id: str) -> None:
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR IGNORE INTO sessions (session_id, last_seq, last_access) VALUES (?, 0, ?)",
+            (session_id, self._clock())
+        )
+        with self._lock:
+            self._counters["created"] += 1
+            # Purging needs a scan, so only do it every so often
+            purge = self._counters["created"] % 100 == 0
+        if purge:
+            self.purge_expired()
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]) -> List[int]:
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front, so two workers appending to
+        # one session can't hand out the same seq
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT last_seq FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            seq = row[0] if row else 0
+            rows = []
+            for message in messages:
+                seq += 1
+                rows.append((session_id, seq, *encode_message(message)))
+            conn.executemany("INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)", rows)
+            conn.execute(
+                "INSERT INTO sessions (session_id, last_seq, last_access) VALUES (?, ?, ?)"
+                " ON CONFLICT (session_id) DO UPDATE SET last_seq = excluded.last_seq, last_access = excluded.last_access",
+                (session_id, seq, self._clock())
+            )
+            compacted = self._compact(conn, session_id) if self.history_limits else 0
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("appended", len(rows))
+        self._count("compacted", compacted)
+        return [row[1] for row in rows]
+
+    def _compact(self, conn: sqlite3.Connection, session_id: str) -> int:
+        # Runs inside append's transaction; the log is already bounded, so this reads few rows
+        stored = conn.execute(
+            "SELECT seq, role, length(content) FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+        start, removed = history_excess([(role == "s", length) for _, role, length in stored], **self.history_limits)
+        if removed:
+            conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND seq BETWEEN ? AND ?",
+                (session_id, stored[start][0], stored[start + removed - 1][0])
+            )
+        return removed
+
+    def _expired(self, last_access: float) -> bool:
+        return self.idle_ttl_seconds is not None and self._clock() - last_access > self.idle_ttl_seconds
+
+    def load(self, session_id: str, after_seq: int = 0) -> Optional[List[Tuple[int, BaseMessage]]]:
+        conn = self._connection()
+        row = conn.execute("SELECT last_seq, last_access FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        last_seq, last_access = row
+        if self._expired(last_access):
+            self.delete(session_id)
+            return None
+        if self._clock() - last_access > TOUCH_INTERVAL_SECONDS:
+            conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (self._clock(), session_id))
+        if last_seq <= after_seq:
+            return []
+        rows = conn.execute(
+            "SELECT seq, role, content FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq",
+            (session_id, after_seq)
+        ).fetchall()
+        self._count("loaded")
+        self._count("loaded_messages", len(rows))
+        return [(seq, decode_message(role, content)) for seq, role, content in rows]
+
+    def discard(self, session_id: str, seq: int) -> None:
+        # last_seq is left alone, so the seq is never handed out again
+        self._connection().execute("DELETE FROM messages WHERE session_id = ? AND seq = ?", (session_id, seq))
+
+    def delete(self, session_id: str) -> bool:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted > 0
+
+    def purge_expired(self) -> int:
+        """Delete expired sessions, then the least recently used ones beyond max_sessions"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conditions = []
+            params = []
+            if self.idle_ttl_seconds is not None:
+                conditions.append("last_access < ?")
+                params.append(self._clock() - self.idle_ttl_seconds)
+            if self.max_sessions is not None:
+                conditions.append(
+                    "session_id IN (SELECT session_id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)"
+                )
+                params.append(self.max_sessions)
+            purged = 0
+            if conditions:
+                where = " OR ".join(conditions)
+                conn.execute(
+                    f"DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE {where})", params
+                )
+                purged = conn.execute(f"DELETE FROM sessions WHERE {where}", params).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("purged", purged)
+        return purged
+
+    def stats(self) -> dict:
+        conn = self._connection()
+        sessions, messages = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM sessions), (SELECT COUNT(*) FROM messages)"
+        ).fetchone()
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "stored_sessions": sessions,
+            "stored_messages": messages,
+            **counters,
+        }
+
+
+def create_session_backend(kind: str, path: str, idle_ttl_seconds: Optional[float] = 3600,
+                           max_sessions: Optional[int] = None, history_limits: Optional[dict] = None) -> SessionBackend:
+    """``memory`` (private to this process) or ``sqlite`` at ``path`` (shared by the host's workers)"""
+    if kind == "memory":
+        return InMemorySessionBackend(idle_ttl_seconds, max_sessions, history_limits=history_limits)
+    if kind == "sqlite":
+        return SQLiteSessionBackend(path, idle_ttl_seconds, max_sessions, history_limits=history_limits)
+    raise ValueError(f"Unknown session backend '{kind}', expected 'memory' or 'sqlite'")
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from langchain_core.messages import BaseMessage
+
+from session_backends import InMemorySessionBackend, SessionBackend, create_session_backend, history_excess
+
+
+def trim_history(
+    history: List[BaseMessage],
+    max_messages: Optional[int] = None,
+    max_chars: Optional[int] = None
+) -> int:
+    """Drop the oldest messages in place until the history fits the limits.
+
+    A leading system message is always kept. Returns the number of messages removed.
+    """
+    start, removed = history_excess(
+        [(msg.type == "system", len(msg.content)) for msg in history], max_messages, max_chars
+    )
+    del history[start:start + removed]
+    return removed
+
+
+class SessionStore:
+    """Bounded, thread-safe map of session_id -> session.
+
+    Sessions idle for longer than ``idle_ttl_seconds`` expire, and once
+    ``max_sessions`` is reached (None for no cap) the least recently used
+    session is evicted.
+    Sessions' messages live in ``backend`` (see session_backends.py; an
+    in-memory one by default), so this is a per-process cache of live
+    sessions, and evicted ones can be restored from the backend.
+    """
+
+    def __init__(
+        self,
+        max_sessions: Optional[int] = 1000,
+        idle_ttl_seconds: Optional[float] = 3600,
+        clock: Callable[[], float] = time.monotonic,
+        backend: Optional[SessionBackend] = None
+    ):
+        if max_sessions is not None and max_sessions < 1:
+            raise ValueError(f"max_sessions must be at least 1 (or None for no cap), got {max_sessions}")
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.backend = backend if backend is not None else InMemorySessionBackend(idle_ttl_seconds, max_sessions)
+        self._clock = clock
+        self._lock = threading.Lock()
+        # session_id -> (session, last_access); ordered oldest access first
+        self._sessions = OrderedDict()
+        self._counters = {
+            "created": 0,
+            "restored": 0,
+            "deleted": 0,
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+        }
+
+    def _is_expired(self, last_access: float, now: float) -> bool:
+        return self.idle_ttl_seconds is not None and now - last_access > self.idle_ttl_seconds
+
+    def _purge_expired_locked(self, now: float) -> int:
+        expired = 0
+        # Entries are in access order, so stop at the first live one
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if not self._is_expired(last_access, now):
+                break
+            del self._sessions[session_id]
+            expired += 1
+        self._counters["evicted_ttl"] += expired
+        return expired
+
+    def get(self, session_id: Optional[str]):
+        """Return the session and mark it as recently used, or None if unknown/expired"""
+        if not session_id:
+            return None
+        with self._lock:
+            now = self._clock()
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            session, last_access = entry
+            if self._is_expired(last_access, now):
+                del self._sessions[session_id]
+                self._counters["evicted_ttl"] += 1
+                return None
+            self._sessions[session_id] = (session, now)
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def add(self, session, restored: bool = False) -> None:
+        """Store a new (or restored) session, evicting expired and then least recently used ones"""
+        with self._lock:
+            now = self._clock()
+            self._purge_expired_locked(now)
+            while self.max_sessions is not None and len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._counters["evicted_lru"] += 1
+            self._sessions[session.session_id] = (session, now)
+            self._counters["restored" if restored else "created"] += 1
+
+    def delete(self, session_id: str) -> bool:
+        """Explicitly remove a session (from the backend too). Returns False if it was not found."""
+        with self._lock:
+            deleted = self._sessions.pop(session_id, None) is not None
+        deleted = self.backend.delete(session_id) or deleted
+        if deleted:
+            with self._lock:
+                self._counters["deleted"] += 1
+        return deleted
+
+    def forget(self, session_id: str) -> None:
+        """Drop the local copy of a session that is already gone from the backend"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def purge_expired(self) -> int:
+        """Remove every expired session and return how many were dropped"""
+        with self._lock:
+            return self._purge_expired_locked(self._clock())
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self) -> dict:
+        """Occupancy and eviction counters"""
+        with self._lock:
+            sessions = [session for session, _ in self._sessions.values()]
+            counters = dict(self._counters)
+        return {
+            "active_sessions": len(sessions),
+            "max_sessions": self.max_sessions,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "history_messages": sum(len(s.chat_history) for s in sessions),
+            "history_messages_trimmed": sum(getattr(s, "trimmed_messages", 0) for s in sessions),
+            **counters,
+            "backend": self.backend.stats(),
+        }
+
+
+def _optional_number(name: str, default: Optional[float], cast=int):
+    """``cast`` of the variable, ``default`` if unset; empty, ``none`` or any zero ("0", "0.0") means no limit"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    if value.strip().lower() in ("", "none"):
+        return None
+    number = cast(value)
+    return None if number == 0 else number
+
+
+def create_session_store_from_env() -> SessionStore:
+    """Build a SessionStore from SESSION_MAX_COUNT, SESSION_IDLE_TTL_SECONDS and SESSION_BACKEND"""
+    idle_ttl_seconds = _optional_number("SESSION_IDLE_TTL_SECONDS", 3600, float)
+    max_sessions = _optional_number("SESSION_MAX_COUNT", 1000)
+    kind = os.environ.get("SESSION_BACKEND", "memory").lower()
+    return SessionStore(
+        max_sessions=max_sessions,
+        idle_ttl_seconds=idle_ttl_seconds,
+        backend=create_session_backend(
+            kind,
+            os.environ.get("SESSION_DB_PATH", "sessions.sqlite"),
+            idle_ttl_seconds=idle_ttl_seconds,
+            # The in-memory log is bounded like the store; the shared file holds every worker's sessions
+            max_sessions=max_sessions if kind == "memory" else _optional_number("SESSION_DB_MAX_SESSIONS", 100000),
+            history_limits=history_limits_from_env()
+        )
+    )
+
+
+def history_limits_from_env() -> dict:
+    """Per-session history caps from SESSION_MAX_HISTORY_MESSAGES / SESSION_MAX_HISTORY_CHARS"""
+    return {
+        "max_messages": _optional_number("SESSION_MAX_HISTORY_MESSAGES", 50),
+        "max_chars": _optional_number("SESSION_MAX_HISTORY_CHARS", 20000),
+    }
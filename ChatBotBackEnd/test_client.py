@@ -1,23 +1,21 @@
 
 import requests
 import json
+import time
 import uuid
-import base64
 from pathlib import Path
 from typing import Union, Optional
-from PIL import Image
-import io
 
 class ChatClient:
-    def __init__(self, base_url='http://localhost:5000'):
+    def __init__(self, base_url='http://localhost:5000', verbose: bool = True):
         self.base_url = base_url
         self.session_id = None
+        self.verbose = verbose  # False silences per-request progress output (used by load_test.py)
         self._session = requests.Session()  # Use a persistent session
     
     def chat(self, message: str, image_path: Optional[str] = None):
         """Send a chat message with optional image to the server."""
         url = f'{self.base_url}/chat'
-        headers = {'Content-Type': 'application/json'}
         
         # Always include session_id if we have one
         data = {
@@ -25,27 +23,26 @@ class ChatClient:
             'session_id': self.session_id
         }
         
-        if image_path:
-            try:
-                image_data = self._encode_image(image_path)
-                data['image'] = image_data
-            except Exception as e:
-                print(f"Error processing image: {e}")
-                return None
-        
         try:
-            print(f"Sending request with session_id: {self.session_id}")
-            response = self._session.post(url, json=data, headers=headers)
+            if self.verbose:
+                print(f"Sending request with session_id: {self.session_id}")
+            if image_path:
+                # Images go up as raw bytes in a multipart form, not base64 in JSON
+                with open(image_path, 'rb') as image_file:
+                    response = self._session.post(url, data=data, files={'image': image_file})
+            else:
+                response = self._session.post(url, json=data)
             response.raise_for_status()
             
             result = response.json()
             
             # Update session_id from response
-            if 'session_id' in result:
+            if 'session_id' in result and self.verbose:
                 if not self.session_id:
                     print(f"New session created: {result['session_id']}")
                 elif self.session_id != result['session_id']:
                     print(f"Session ID changed from {self.session_id} to {result['session_id']}")
+            if 'session_id' in result:
                 self.session_id = result['session_id']
             
             return result
@@ -60,20 +57,58 @@ class ChatClient:
                 print(f"Raw response: {response.text}")
             return None
 
-    def _encode_image(self, image_path: str) -> str:
-        """Load image using PIL and convert to base64 string"""
+    def chat_stream(self, message: str, image_path: Optional[str] = None, on_token=None):
+        """Send a chat message to /chat/stream and consume the Server-Sent Events.
+
+        Returns the final 'done' (or 'error') payload with the client-side
+        time_to_first_token_ms added.
+        """
+        url = f'{self.base_url}/chat/stream'
+        data = {
+            'message': message,
+            'session_id': self.session_id
+        }
+
+        start = time.perf_counter()
+        first_token_ms = None
+        result = None
+        image_file = open(image_path, 'rb') if image_path else None
         try:
-            # Open and convert image to RGB
-            with Image.open(image_path).convert('RGB') as img:
-                # Save image to bytes buffer
-                buffered = io.BytesIO()
-                img.save(buffered, format="JPEG")
-                # Convert to base64 string
-                img_str = base64.b64encode(buffered.getvalue()).decode()
-                return img_str
-        except Exception as e:
-            print(f"Error encoding image: {e}")
-            raise
+            if image_file:
+                request = self._session.post(url, data=data, files={'image': image_file}, stream=True)
+            else:
+                request = self._session.post(url, json=data, stream=True)
+            with request as response:
+                response.raise_for_status()
+                event = 'message'
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    if line.startswith('event:'):
+                        event = line[len('event:'):].strip()
+                        continue
+                    if not line.startswith('data:'):
+                        continue
+                    payload = json.loads(line[len('data:'):].strip())
+                    if event == 'session':
+                        self.session_id = payload['session_id']
+                    elif event == 'token':
+                        if first_token_ms is None:
+                            first_token_ms = (time.perf_counter() - start) * 1000
+                        if on_token:
+                            on_token(payload['token'])
+                    elif event in ('done', 'error'):
+                        result = payload
+        except requests.exceptions.RequestException as e:
+            print(f"Error sending request: {e}")
+            return None
+        finally:
+            if image_file:
+                image_file.close()
+
+        if result is not None:
+            result['client_time_to_first_token_ms'] = first_token_ms
+        return result
 
     def reset_session(self):
         """Reset the current chat session."""
@@ -87,7 +122,8 @@ class ChatClient:
         try:
             response = self._session.post(url, json=data)
             response.raise_for_status()
-            print(f"Session {self.session_id} reset successfully")
+            if self.verbose:
+                print(f"Session {self.session_id} reset successfully")
             self.session_id = None
         except requests.exceptions.RequestException as e:
             print(f"Error resetting session: {e}")
@@ -98,6 +134,7 @@ def main():
     print("Commands:")
     print("  'quit' - Exit the program")
     print("  'reset' - Start new session")
+    print("  'stream <message>' - Send message and stream the response token by token")
     print("  'image \"<path>\" <message>' - Send message with an image (path must be in quotes)")
     print(f"Session ID: {client.session_id}")
     
@@ -110,6 +147,20 @@ def main():
         elif user_input.lower() == 'reset':
             client.reset_session()
             continue
+        elif user_input.lower().startswith('stream '):
+            print("\nAI: ", end='', flush=True)
+            result = client.chat_stream(
+                user_input[len('stream '):].strip(),
+                on_token=lambda token: print(token, end='', flush=True)
+            )
+            if result and 'error' in result:
+                print(f"\nError: {result['error']}")
+            elif result and result['client_time_to_first_token_ms'] is not None:
+                print(f"\n(first token after {result['client_time_to_first_token_ms']:.0f} ms)")
+            elif result:
+                print()
+            else:
+                print("\nError: No response received")
         elif user_input.lower().startswith('image '):
             # Handle image + text input
             try:
@@ -0,0 +1,61 @@
+import numpy as np
+
+from context_selection import (
+    Candidate, ContextSelectionStats, merge_passages, mmr_select, select_context, text_overlap
+)
+
+SETTINGS = {"mmr_lambda": 0.7, "max_chunks": 5, "min_similarity": 0.25, "max_chars": 2500,
+            "duplicate_similarity": 0.95}
+
+
+def test_mmr_skips_near_duplicates():
+    query = np.array([1.0, 0.0])
+    vectors = np.array([[1.0, 0.0], [1.0, 0.01], [0.7, 0.7]])
+    result = mmr_select(query, vectors, [10, 10, 10])
+    assert result["picked"] == [0, 2]
+    assert result["dropped"]["duplicate"] == 1
+
+
+def test_mmr_cutoff_keeps_best_and_exempt_candidates():
+    query = np.array([1.0, 0.0])
+    vectors = np.array([[0.1, 1.0], [0.0, 1.0]])
+    assert mmr_select(query, vectors, [10, 10])["picked"] == [0]
+    exempt = mmr_select(query, vectors, [10, 10], cutoff_exempt=np.array([False, True]),
+                        duplicate_similarity=1.01)
+    assert exempt["picked"] == [0, 1]
+
+
+def test_mmr_respects_char_budget():
+    query = np.array([1.0, 0.0])
+    vectors = np.array([[1.0, 0.0], [0.8, 0.6]])
+    result = mmr_select(query, vectors, [100, 100], max_chars=150)
+    assert result["picked"] == [0]
+    assert result["dropped"]["budget"] == 1
+
+
+def test_text_overlap():
+    assert text_overlap("the tenant must pay rent on time", "pay rent on time every month", min_overlap=4) == 16
+    assert text_overlap("abc", "xyz") == 0
+
+
+def test_merge_adjacent_chunks_drops_repeated_text():
+    candidates = [
+        Candidate(position=8, text="then the second half of it.", metadata={"source": "guide.pdf", "page": 2}),
+        Candidate(position=7, text="The first half, then the second half", metadata={"source": "guide.pdf", "page": 2}),
+        Candidate(position=30, text="Unrelated passage", metadata={"source": "other.pdf"}),
+    ]
+    passages = merge_passages(candidates, [0, 2, 1], np.array([0.9, 0.8, 0.7]))
+    assert [passage.positions for passage in passages] == [[7, 8], [30]]
+    assert passages[0].text == "The first half, then the second half of it."
+    assert passages[0].relevance == 0.9
+
+
+def test_select_context_records_savings():
+    candidates = [Candidate(position=i, text="x" * 100, metadata={"source": f"doc{i}"}) for i in range(3)]
+    vectors = np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+    stats = ContextSelectionStats()
+    passages = select_context(np.array([1.0, 0.0]), candidates, vectors, k=3, settings=SETTINGS, stats=stats)
+    assert [passage.positions for passage in passages] == [[0]]
+    assert select_context(np.array([1.0, 0.0]), [], vectors, k=3, settings=SETTINGS) == []
+    recorded = stats.stats()
+    assert recorded["requests"] == 1
@@ -0,0 +1,38 @@
+import numpy as np
+
+from issue_matcher import IssueTaxonomyMatcher
+
+
+class FakeEmbeddings:
+    """Bag-of-letters vectors, so phrases sharing words score higher"""
+
+    def embed_documents(self, texts):
+        vectors = np.zeros((len(texts), 26), dtype="float32")
+        for row, text in enumerate(texts):
+            for char in text.lower():
+                if "a" <= char <= "z":
+                    vectors[row, ord(char) - ord("a")] += 1
+        return vectors
+
+
+def _issue(name, phrases, threshold=0.9):
+    return {"id": name, "issue": name, "severity": "High", "description": "", "phrases": phrases,
+            "threshold": threshold}
+
+
+def test_matches_best_phrase_per_issue():
+    taxonomy = {"issues": [_issue("Mold", ["black mold", "mould"]), _issue("Leak", ["water leak", "dripping"])]}
+    matcher = IssueTaxonomyMatcher(taxonomy, FakeEmbeddings())
+
+    scores = matcher.scores(["black mold"])
+    assert scores.shape == (1, 2)
+    assert scores[0, 0] > scores[0, 1]
+    assert [issue["issue"] for issue in matcher.match("black mold")] == ["Mold"]
+
+
+def test_empty_taxonomy_matches_nothing():
+    matcher = IssueTaxonomyMatcher({"issues": []}, FakeEmbeddings())
+
+    assert matcher.scores(["black mold", "a leak"]).shape == (2, 0)
+    assert matcher.match("black mold") == []
+    assert matcher.match_many(["black mold", "a leak"]) == [[], []]
@@ -0,0 +1,41 @@
+from lexical_index import BM25Index, fused_scores, has_lexical_index, reciprocal_rank_fusion, tokenize
+
+TEXTS = [
+    "A Section 21 notice ends an assured shorthold tenancy",
+    "Your deposit must be protected in a government scheme",
+    "The landlord must give notice before entering the property",
+]
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What is a Section 21 notice?") == ["what", "section", "21", "notice"]
+
+
+def test_search_ranks_matching_documents():
+    index = BM25Index.build(TEXTS)
+    assert index.search("section 21", k=3) == [0]
+    assert index.search("notice", k=3)[0] in (0, 2)
+    assert index.search("unknown words", k=3) == []
+    assert index.search("notice", k=0) == []
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    index = BM25Index.build(TEXTS)
+    assert not has_lexical_index(str(tmp_path))
+    index.save(str(tmp_path))
+    assert has_lexical_index(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    assert loaded.search("deposit scheme", k=2) == index.search("deposit scheme", k=2) == [1]
+
+
+def test_empty_index():
+    index = BM25Index.build([])
+    assert index.search("anything", k=5) == []
+
+
+def test_reciprocal_rank_fusion():
+    fused = fused_scores([[1, 2], [2, 3]], [1.0, 1.0], rrf_k=60)
+    assert fused[2] > fused[1] > fused[3]
+    assert reciprocal_rank_fusion([[1, 2], [2, 3]], [1.0, 1.0]) == [2, 1, 3]
+    # A zero weight drops that ranking
+    assert reciprocal_rank_fusion([[1, 2], [3]], [1.0, 0.0]) == [1, 2]
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from llm_client import LLMClient, LLMDeadlineExceeded, TokenBucket, TransientLLMError, is_retryable
+
+
+class ScriptedProvider:
+    """Raises the scripted errors in turn, then answers"""
+
+    name = "scripted"
+
+    def __init__(self, errors=(), answer="answer", chunks=("a", "b")):
+        self.errors = list(errors)
+        self.answer = answer
+        self.chunks = list(chunks)
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def generate(self, prompt, timeout):
+        self._next()
+        return self.answer
+
+    def stream(self, prompt, timeout):
+        self._next()
+        return iter(self.chunks)
+
+
+def _client(provider, **kwargs):
+    kwargs.setdefault("backoff_base_seconds", 0.001)
+    return LLMClient(provider, **kwargs)
+
+
+def test_retries_transient_errors():
+    provider = ScriptedProvider(errors=[TransientLLMError("busy"), TimeoutError("slow")])
+    client = _client(provider)
+    assert client.generate("hi") == "answer"
+    assert provider.calls == 3
+    assert client.stats()["retries"] == 2
+
+
+def test_does_not_retry_other_errors():
+    provider = ScriptedProvider(errors=[ValueError("bad prompt")])
+    client = _client(provider)
+    with pytest.raises(ValueError):
+        client.generate("hi")
+    assert provider.calls == 1
+    assert client.stats()["errors"] == 1
+
+
+def test_gives_up_after_max_retries():
+    provider = ScriptedProvider(errors=[TransientLLMError("busy")] * 3)
+    with pytest.raises(TransientLLMError):
+        _client(provider, max_retries=2).generate("hi")
+    assert provider.calls == 3
+
+
+def test_stream_retries_before_first_chunk():
+    provider = ScriptedProvider(errors=[ConnectionError("reset")])
+    assert list(_client(provider).stream("hi")) == ["a", "b"]
+    assert provider.calls == 2
+
+
+def test_deadline_exceeded_waiting_for_concurrency_slot():
+    client = _client(ScriptedProvider(), max_concurrency=1)
+    client._slots.acquire()
+    with pytest.raises(LLMDeadlineExceeded):
+        client.generate("hi", timeout=0.05)
+    assert client.stats()["deadline_exceeded"] == 1
+
+
+def test_identical_concurrent_prompts_are_coalesced():
+    release = threading.Event()
+
+    class SlowProvider(ScriptedProvider):
+        def generate(self, prompt, timeout):
+            release.wait(5)
+            return super().generate(prompt, timeout)
+
+    provider = SlowProvider()
+    client = _client(provider)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.generate("same"))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while client.stats()["coalesced"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["answer"] * 3
+    assert provider.calls == 1
+
+
+def test_token_bucket_spaces_out_calls():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=1, clock=lambda: now[0])
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    now[0] = 1.0
+    assert bucket.reserve() == pytest.approx(0.0)
+
+
+def test_is_retryable_matches_provider_error_names():
+    ServiceUnavailable = type("ServiceUnavailable", (Exception,), {})
+    assert is_retryable(ServiceUnavailable())
+    assert not is_retryable(KeyError("x"))
@@ -0,0 +1,38 @@
+from retrieval_cache import LRUCache, SQLiteCacheBackend, normalize_query, vector_store_version
+
+
+def test_normalize_query():
+    assert normalize_query("  What is   a Section 21 notice?? ") == "what is a section 21 notice"
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache("test", max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 1, 1, 1)
+
+
+def test_disk_backend_survives_a_new_cache(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite"))
+    LRUCache("chunks", backend=backend).put("q", ["chunk one", "chunk two"])
+
+    cache = LRUCache("chunks", backend=backend)
+    assert cache.get("q") == ["chunk one", "chunk two"]
+    assert cache.stats()["disk_hits"] == 1
+    assert LRUCache("other", backend=backend).get("q") is None
+
+    cache.delete("q")
+    assert LRUCache("chunks", backend=backend).get("q") is None
+    backend.close()
+
+
+def test_vector_store_version_changes_with_content(tmp_path):
+    (tmp_path / "index.faiss").write_bytes(b"one")
+    before = vector_store_version(str(tmp_path))
+    assert vector_store_version(str(tmp_path)) == before
+    (tmp_path / "index.faiss").write_bytes(b"two")
+    assert vector_store_version(str(tmp_path)) != before
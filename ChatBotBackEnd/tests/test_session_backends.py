@@ -0,0 +1,88 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from session_backends import InMemorySessionBackend, SQLiteSessionBackend, history_excess
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return InMemorySessionBackend(**kwargs)
+        return SQLiteSessionBackend(str(tmp_path / "sessions.sqlite"), **kwargs)
+    return make
+
+
+def _contents(loaded):
+    return [message.content for _, message in loaded]
+
+
+def test_append_and_load_after_seq(make_backend):
+    backend = make_backend()
+    assert backend.append("s", [SystemMessage(content="sys"), HumanMessage(content="hi")]) == [1, 2]
+    assert backend.append("s", [AIMessage(content="hello")]) == [3]
+    assert _contents(backend.load("s")) == ["sys", "hi", "hello"]
+    assert [(seq, message.content) for seq, message in backend.load("s", after_seq=2)] == [(3, "hello")]
+    assert backend.load("s", after_seq=3) == []
+    assert backend.load("unknown") is None
+
+
+def test_discard_does_not_reuse_seq(make_backend):
+    backend = make_backend()
+    backend.append("s", [HumanMessage(content="a"), HumanMessage(content="b")])
+    backend.discard("s", 2)
+    assert backend.append("s", [HumanMessage(content="c")]) == [3]
+    assert _contents(backend.load("s")) == ["a", "c"]
+
+
+def test_delete(make_backend):
+    backend = make_backend()
+    backend.create("s")
+    assert backend.delete("s")
+    assert backend.load("s") is None
+    assert not backend.delete("s")
+
+
+def test_idle_sessions_expire(make_backend):
+    clock = FakeClock()
+    backend = make_backend(idle_ttl_seconds=10, clock=clock)
+    backend.append("s", [HumanMessage(content="hi")])
+    clock.now += 11
+    assert backend.load("s") is None
+
+
+def test_purges_least_recently_used_beyond_cap(make_backend):
+    clock = FakeClock()
+    backend = make_backend(max_sessions=2, clock=clock)
+    for session_id in ("a", "b", "c"):
+        clock.now += 1
+        backend.append(session_id, [HumanMessage(content=session_id)])
+    assert backend.purge_expired() == 1
+    assert backend.load("a") is None
+    assert backend.stats()["stored_sessions"] == 2
+
+
+def test_append_compacts_to_history_limits(make_backend):
+    backend = make_backend(history_limits={"max_messages": 2, "max_chars": None})
+    backend.append("s", [SystemMessage(content="sys")])
+    seqs = [backend.append("s", [HumanMessage(content=f"m{i}")])[0] for i in range(5)]
+    assert seqs == [2, 3, 4, 5, 6]
+    assert _contents(backend.load("s")) == ["sys", "m3", "m4"]
+    assert backend.stats()["compacted"] == 3
+    assert backend.stats()["stored_messages"] == 3
+
+
+def test_history_excess_keeps_system_and_latest():
+    entries = [(True, 3), (False, 10), (False, 10), (False, 50)]
+    assert history_excess(entries, max_messages=None, max_chars=20) == (1, 2)
+    assert history_excess(entries, max_messages=1, max_chars=None) == (1, 2)
+    assert history_excess(entries) == (1, 0)
+    assert history_excess([]) == (0, 0)
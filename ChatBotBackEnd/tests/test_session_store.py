@@ -0,0 +1,79 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from session_store import SessionStore, _optional_number, history_limits_from_env, trim_history
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSession:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.chat_history = []
+
+
+def _history(count):
+    return [SystemMessage(content="sys")] + [HumanMessage(content=f"m{i}") for i in range(count)]
+
+
+def test_trim_history_keeps_system_message_and_newest():
+    history = _history(5)
+    assert trim_history(history, max_messages=2) == 3
+    assert [msg.content for msg in history] == ["sys", "m3", "m4"]
+
+
+def test_trim_history_by_chars_keeps_latest_message():
+    history = [HumanMessage(content="x" * 10), AIMessage(content="y" * 50)]
+    assert trim_history(history, max_chars=20) == 1
+    assert [msg.content for msg in history] == ["y" * 50]
+
+
+def test_evicts_least_recently_used():
+    store = SessionStore(max_sessions=2)
+    for session_id in ("a", "b"):
+        store.add(FakeSession(session_id))
+    store.get("a")
+    store.add(FakeSession("c"))
+    assert "a" in store and "c" in store and "b" not in store
+    assert store.stats()["evicted_lru"] == 1
+
+
+def test_idle_sessions_expire():
+    clock = FakeClock()
+    store = SessionStore(idle_ttl_seconds=10, clock=clock)
+    store.add(FakeSession("a"))
+    clock.now = 11
+    assert store.get("a") is None
+    assert store.stats()["evicted_ttl"] == 1
+
+
+def test_delete_removes_from_backend():
+    store = SessionStore()
+    store.backend.append("a", [HumanMessage(content="hi")])
+    store.add(FakeSession("a"))
+    assert store.delete("a")
+    assert store.backend.load("a") is None
+    assert not store.delete("a")
+
+
+def test_rejects_zero_max_sessions():
+    with pytest.raises(ValueError):
+        SessionStore(max_sessions=0)
+
+
+@pytest.mark.parametrize("value", ["0", "0.0", "", "none"])
+def test_zero_or_empty_setting_means_no_limit(monkeypatch, value):
+    monkeypatch.setenv("SESSION_IDLE_TTL_SECONDS", value)
+    assert _optional_number("SESSION_IDLE_TTL_SECONDS", 3600, float) is None
+
+
+def test_history_limits_from_env(monkeypatch):
+    monkeypatch.setenv("SESSION_MAX_HISTORY_MESSAGES", "10")
+    monkeypatch.delenv("SESSION_MAX_HISTORY_CHARS", raising=False)
+    assert history_limits_from_env() == {"max_messages": 10, "max_chars": 20000}
@@ -1,46 +1,94 @@
-from typing import List, Optional
+from typing import AsyncIterator, Iterator, List, Optional, Union
 from langchain_core.messages import BaseMessage
-import google.generativeai as genai
-import os
+import logging
+
+from llm_client import create_llm_client_from_env
+from observability import PROMPT_TOKENS, span
+from prompt_builder import ConversationMemory, create_prompt_builder_from_env, memory_settings_from_env
+
+logger = logging.getLogger(__name__)
 
 class TextGenerationService:
     def __init__(self):
-        print("Initializing Text Generation Service...")
-        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-
-    def generate_response(self, user_message: str, chat_history: List[BaseMessage], context: Optional[str] = None) -> str:
-        """Generate a response based on the user message, chat history, and retrieved context"""
-        try:
-            # Format chat history into a string
-            history_str = "\n".join([
-                f"{'User' if msg.type == 'human' else 'Assistant'}: {msg.content}"
-                for msg in chat_history[:-1]  # Exclude the latest user message as we'll add it separately
-            ])
+        logger.info("Initializing Text Generation Service...")
+        # LLM_BACKEND=fake swaps Gemini for a deterministic local model (no network).
+        # The client adds deadlines, retries, rate/concurrency limits and coalescing.
+        self.llm = create_llm_client_from_env()
+        self.backend = self.llm.provider.name
+        self.prompt_builder = create_prompt_builder_from_env()
+        self.memory_settings = memory_settings_from_env()
 
-            # Construct the prompt with all available information
-            prompt = f"""
-Context information: {context if context else 'No additional context available'}
+    def _build_prompt(
+        self,
+        user_message: str,
+        chat_history: List[BaseMessage],
+        context: Optional[Union[str, List[str]]] = None,
+        memory: Optional[ConversationMemory] = None
+    ) -> str:
+        """Build the Gemini prompt within the token budget.
 
-Previous conversation:
-{history_str}
+        context is a string or a list of chunks, most relevant first. Sessions pass
+        their incrementally maintained memory; otherwise it is built from chat_history.
+        """
+        with span("prompt.build"):
+            if memory is None:
+                memory = ConversationMemory.from_history(chat_history, **self.memory_settings)
+            prompt, info = self.prompt_builder.build(user_message, memory, context)
+        PROMPT_TOKENS.observe(info["prompt_tokens"], part="total")
+        PROMPT_TOKENS.observe(info["context_tokens"], part="context")
+        PROMPT_TOKENS.observe(info["history_tokens"], part="history")
+        PROMPT_TOKENS.observe(info["summary_tokens"], part="summary")
+        logger.debug("Prompt: %d tokens (context %d, history %d, summary %d; %d/%d chunks)",
+                     info["prompt_tokens"], info["context_tokens"], info["history_tokens"],
+                     info["summary_tokens"], info["chunks_used"], info["chunks_offered"])
+        return prompt
 
-Current user message: {user_message}
+    def generate_response(self, user_message: str, chat_history: List[BaseMessage], context: Optional[Union[str, List[str]]] = None, memory: Optional[ConversationMemory] = None) -> str:
+        """Generate a response based on the user message, chat history, and retrieved context"""
+        try:
+            prompt = self._build_prompt(user_message, chat_history, context, memory)
 
-Please provide a helpful response based on the above information.Stick to property related topics only and dont deviate.
-"""
             # Generate response using Gemini
-            response = self.model.generate_content(prompt)
-            
-            return response.text
+            with span("llm.generate"):
+                return self.llm.generate(prompt)
 
         except Exception as e:
-            print(f"Error generating text response: {e}")
+            logger.error("Error generating text response: %s", e)
             raise
 
+    def generate_response_stream(self, user_message: str, chat_history: List[BaseMessage], context: Optional[Union[str, List[str]]] = None, memory: Optional[ConversationMemory] = None) -> Iterator[str]:
+        """Yield the response text chunk by chunk as the model produces it"""
+        try:
+            prompt = self._build_prompt(user_message, chat_history, context, memory)
 
+            # The span covers the whole stream, including time the client takes to read it
+            with span("llm.stream"):
+                yield from self.llm.stream(prompt)
 
+        except Exception as e:
+            logger.error("Error streaming text response: %s", e)
+            raise
+
+    async def generate_response_async(self, user_message: str, chat_history: List[BaseMessage], context: Optional[Union[str, List[str]]] = None, memory: Optional[ConversationMemory] = None) -> str:
+        """Async variant of generate_response; awaits the model instead of blocking a thread"""
+        try:
+            prompt = self._build_prompt(user_message, chat_history, context, memory)
+            with span("llm.generate"):
+                return await self.llm.generate_async(prompt)
 
+        except Exception as e:
+            logger.error("Error generating text response: %s", e)
+            raise
 
+    async def generate_response_stream_async(self, user_message: str, chat_history: List[BaseMessage], context: Optional[Union[str, List[str]]] = None, memory: Optional[ConversationMemory] = None) -> AsyncIterator[str]:
+        """Async variant of generate_response_stream"""
+        try:
+            prompt = self._build_prompt(user_message, chat_history, context, memory)
 
+            with span("llm.stream"):
+                async for text in self.llm.stream_async(prompt):
+                    yield text
 
+        except Exception as e:
+            logger.error("Error streaming text response: %s", e)
+            raise
@@ -0,0 +1,94 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+
+class PoolSaturatedError(Exception):
+    """Raised when a pool already has as many running and queued tasks as it allows"""
+
+    def __init__(self, pool_name: str):
+        super().__init__(f"{pool_name} pool is saturated")
+        self.pool_name = pool_name
+
+
+class BoundedExecutor:
+    """Thread pool that rejects work instead of queueing without limit.
+
+    At most ``max_workers`` tasks run at once and at most ``max_queue`` more wait
+    for a thread; beyond that ``submit`` raises PoolSaturatedError immediately so
+    the caller can shed load.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int = 0):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-pool")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+    def _release(self, _future: Future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Schedule fn on the pool, or raise PoolSaturatedError if it is full"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PoolSaturatedError(self.name)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            # Run in a copy of the caller's context so the request id follows the task
+            future = self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Run fn on the pool and await its result without blocking the event loop"""
+        future = self.submit(functools.partial(fn, *args, **kwargs))
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+def create_pools_from_env() -> dict:
+    """Build the image (BLIP) and retrieval (embedding + FAISS) pools.
+
+    Sizes come from IMAGE_POOL_WORKERS / IMAGE_POOL_QUEUE and
+    RETRIEVAL_POOL_WORKERS / RETRIEVAL_POOL_QUEUE.
+    """
+    return {
+        "image": BoundedExecutor(
+            "image",
+            # Enough threads to fill a BLIP micro-batch (see BLIP_MAX_BATCH_SIZE)
+            max_workers=int(os.environ.get("IMAGE_POOL_WORKERS", 8)),
+            max_queue=int(os.environ.get("IMAGE_POOL_QUEUE", 16))
+        ),
+        "retrieval": BoundedExecutor(
+            "retrieval",
+            max_workers=int(os.environ.get("RETRIEVAL_POOL_WORKERS", 4)),
+            max_queue=int(os.environ.get("RETRIEVAL_POOL_QUEUE", 32))
+        ),
+    }